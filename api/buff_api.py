@@ -1,11 +1,46 @@
+import asyncio
 import logging
-from typing import Optional, Dict, Any
-from buff163_unofficial_api import Buff163API
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Dict, Any
+
+import requests
+from buff163_unofficial_api import Buff163API, rest_adapter
 from config import config
 from api.currency_converter import currency_converter
+from api.request_scheduler import Priority, PriorityScheduler
 
 logger = logging.getLogger(__name__)
 
+# Минимальный timeout HTTP-запроса (секунды), если дедлайн почти истек
+MIN_HTTP_TIMEOUT = 0.5
+
+
+class DeadlineRequests:
+    """
+    Модуль requests для buff163_unofficial_api с timeout запроса
+
+    Библиотека вызывает requests.request без timeout, и зависший ответ Buff
+    держал бы поток пула бесконечно - дедлайн asyncio отменяет только
+    ожидание, но не сам вызов. timeout - остаток дедлайна, который
+    BuffAPIClient._call записывает в поток перед вызовом (вне его -
+    BUFF_TIMEOUT_BACKGROUND). Остальные атрибуты - из настоящего requests.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(requests, name)
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault("timeout", getattr(self.local, "timeout", None) or config.BUFF_TIMEOUT_BACKGROUND)
+        return requests.request(*args, **kwargs)
+
+
+deadline_requests = DeadlineRequests()
+
 
 class BuffAPIClient:
     """Клиент для работы с Buff API через buff163_unofficial_api"""
@@ -13,21 +48,142 @@ class BuffAPIClient:
     def __init__(self, session_cookie: str):
         self.session_cookie = session_cookie
         self.api: Optional[Buff163API] = None
+        # Второй клиент (отдельная HTTP-сессия) для хеджированных запросов
+        self.hedge_api: Optional[Buff163API] = None
+        self.requests_total = 0
+        self.hedged_total = 0
+        # Все запросы к Buff проходят через общий лимит с полосами приоритета и
+        # выполняются в своем пуле потоков: медленные ответы Buff не занимают
+        # пул asyncio по умолчанию (asyncio.to_thread других задач)
+        self.scheduler = PriorityScheduler(
+            rate=config.BUFF_RATE_LIMIT,
+            burst=config.BUFF_RATE_BURST,
+            p95_targets={Priority.INTERACTIVE: config.INTERACTIVE_P95_TARGET_MS / 1000},
+            executor=ThreadPoolExecutor(max_workers=config.BUFF_THREADS, thread_name_prefix="buff")
+        )
         self._initialize_api()
     
     def _initialize_api(self):
         """Инициализация API клиента"""
         try:
+            # HTTP-запросы библиотеки - с timeout из дедлайна запроса
+            rest_adapter.requests = deadline_requests
             self.api = Buff163API(session_cookie=self.session_cookie)
+            if config.BUFF_HEDGE_RATIO > 0:
+                self.hedge_api = Buff163API(session_cookie=self.session_cookie)
             logger.info("Buff API клиент инициализирован")
         except Exception as e:
             logger.error(f"Ошибка инициализации Buff API: {e}")
             raise
     
-    async def get_item_price(self, goods_id: int) -> Optional[Dict[str, Any]]:
+    def _default_timeout(self, priority: Priority) -> float:
+        """Дедлайн запроса по умолчанию: короткий для действий пользователя, длинный для фона"""
+        if priority <= Priority.VALIDATION:
+            return config.BUFF_TIMEOUT_INTERACTIVE
+        return config.BUFF_TIMEOUT_BACKGROUND
+    
+    async def _request(self, priority: Priority, timeout: Optional[float], method: str, *args) -> Any:
+        """
+        Выполнить запрос к Buff с дедлайном
+        
+        Дедлайн включает ожидание в очереди лимита. При превышении
+        выбрасывается asyncio.TimeoutError. Остаток дедлайна на момент
+        отправки становится timeout HTTP-запроса (см. DeadlineRequests),
+        поэтому поток не остается занятым после отмены ожидания.
+        """
+        if timeout is None:
+            timeout = self._default_timeout(priority)
+        
+        deadline = time.monotonic() + timeout
+        return await asyncio.wait_for(self._hedged(priority, deadline, method, *args), timeout)
+    
+    @staticmethod
+    def _call(func: Callable[..., Any], deadline: float, *args) -> Any:
+        """Вызов Buff API в потоке пула с timeout HTTP до дедлайна запроса"""
+        deadline_requests.local.timeout = max(deadline - time.monotonic(), MIN_HTTP_TIMEOUT)
+        try:
+            return func(*args)
+        finally:
+            deadline_requests.local.timeout = None
+    
+    def _hedge_allowed(self) -> bool:
+        """Не превышена ли доля хеджированных запросов"""
+        return self.hedged_total < config.BUFF_HEDGE_RATIO * self.requests_total
+    
+    async def _hedged(self, priority: Priority, deadline: float, method: str, *args) -> Any:
+        """
+        Запрос с хеджированием
+        
+        Если основной запрос не ответил за p95 обычного времени ответа Buff,
+        отправляется второй такой же запрос через отдельную сессию. Время
+        отсчитывается с момента отправки основного запроса: ожидание токена
+        в очереди лимита - не медленный ответ, и хедж в это время только
+        добавил бы нагрузку, когда лимит и так исчерпан.
+        Побеждает тот, кто ответит первым, второй отменяется. Доля
+        хеджированных запросов ограничена BUFF_HEDGE_RATIO, поэтому
+        средняя нагрузка почти не растет.
+        """
+        self.requests_total += 1
+        sent = asyncio.Event()
+        primary = asyncio.create_task(
+            self.scheduler.run(priority, self._call, getattr(self.api, method), deadline, *args, acquired=sent)
+        )
+        tasks = {primary}
+        
+        try:
+            hedge_delay = self.scheduler.service_p95(min_samples=20)
+            if self.hedge_api is None or hedge_delay is None:
+                return await primary
+            
+            # Ждем, пока основной запрос получит токен и будет отправлен
+            sending = asyncio.create_task(sent.wait())
+            try:
+                await asyncio.wait({primary, sending}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                sending.cancel()
+            
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if done or not self._hedge_allowed():
+                return await primary
+            
+            self.hedged_total += 1
+            logger.debug(f"Buff отвечает дольше {hedge_delay:.2f} с, отправляю хеджированный запрос {method}{args}")
+            tasks.add(asyncio.create_task(
+                self.scheduler.run(priority, self._call, getattr(self.hedge_api, method), deadline, *args)
+            ))
+            
+            error: Optional[BaseException] = None
+            pending = tasks
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = error or task.exception()
+            
+            # Оба запроса завершились ошибкой
+            raise error
+        
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    # Помечаем ошибку проигравшего запроса как обработанную
+                    task.exception()
+    
+    async def get_item_price(self, goods_id: int,
+                             priority: Priority = Priority.SCHEDULED,
+                             timeout: Optional[float] = None,
+                             raise_errors: bool = False) -> Optional[Dict[str, Any]]:
         """
         Получить информацию о цене товара по goods_id
         
+        priority - полоса приоритета запроса (интерактивные запросы идут первыми)
+        timeout - дедлайн в секундах (по умолчанию зависит от полосы)
+        raise_errors - пробрасывать ошибки запроса (дедлайн, сбой API), чтобы
+        отличать их от отсутствия товара; по умолчанию вместо них None
+        
         Возвращает словарь с ключами:
         - goods_id: ID товара
         - market_hash_name: название товара
@@ -41,7 +197,7 @@ class BuffAPIClient:
         try:
             # Используем метод get_item для получения конкретного товара
             # Доступен в новой версии библиотеки с GitHub
-            item_data = self.api.get_item(goods_id)
+            item_data = await self._request(priority, timeout, "get_item", goods_id)
             
             if not item_data:
                 logger.warning(f"Товар с goods_id={goods_id} не найден")
@@ -73,14 +229,23 @@ class BuffAPIClient:
                 "prices": prices  # Новое поле с ценами в разных валютах
             }
         
+        except asyncio.TimeoutError:
+            logger.warning(f"Превышен дедлайн запроса цены товара {goods_id}")
+            if raise_errors:
+                raise
+            return None
         except AttributeError as e:
             logger.error(f"Ошибка доступа к атрибутам товара {goods_id}: {e}")
             return None
         except Exception as e:
             logger.error(f"Ошибка при получении цены товара {goods_id}: {e}")
+            if raise_errors:
+                raise
             return None
     
-    async def search_item_by_name(self, name: str) -> Optional[list]:
+    async def search_item_by_name(self, name: str,
+                                  priority: Priority = Priority.INTERACTIVE,
+                                  timeout: Optional[float] = None) -> Optional[list]:
         """
         Поиск товаров по названию
         
@@ -91,7 +256,7 @@ class BuffAPIClient:
             return None
         
         try:
-            results = self.api.search_item(name)
+            results = await self._request(priority, timeout, "search_item", name)
             
             items = []
             for item in results:
@@ -119,7 +284,9 @@ class BuffAPIClient:
             logger.error(f"Ошибка при поиске товара '{name}': {e}")
             return None
     
-    async def get_featured_market(self, limit: int = 50) -> Optional[list]:
+    async def get_featured_market(self, limit: int = 50,
+                                  priority: Priority = Priority.WARMUP,
+                                  timeout: Optional[float] = None) -> Optional[list]:
         """
         Получить список популярных товаров с рынка
         
@@ -130,7 +297,7 @@ class BuffAPIClient:
             return None
         
         try:
-            market = self.api.get_featured_market()
+            market = await self._request(priority, timeout, "get_featured_market")
             
             items = []
             count = 0
@@ -172,9 +339,13 @@ class BuffAPIClient:
     
     async def close(self):
         """Закрыть соединение (если требуется)"""
-        # buff163_unofficial_api не требует явного закрытия соединений
+        # buff163_unofficial_api не требует явного закрытия соединений;
+        # зависшие вызовы завершатся по timeout HTTP, их не ждем
+        if self.scheduler.executor is not None:
+            self.scheduler.executor.shutdown(wait=False, cancel_futures=True)
         logger.info("Buff API клиент закрыт")
         self.api = None
+        self.hedge_api = None
 
 
 # Глобальный экземпляр клиента
@@ -0,0 +1,176 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import math
+import time
+from collections import deque
+from concurrent.futures import Executor
+from enum import IntEnum
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Полосы приоритета запросов к Buff (меньше значение - выше приоритет)"""
+    INTERACTIVE = 0  # Действия пользователя: /now, обновление цены, карточка товара
+    VALIDATION = 1   # Проверка товара при добавлении
+    SCHEDULED = 2    # Плановая проверка цен планировщиком
+    WARMUP = 3       # Фоновый прогрев (популярные товары и т.п.)
+
+
+class PriorityScheduler:
+    """
+    Общий лимит запросов к Buff с полосами приоритета
+
+    Все запросы проходят через один token bucket (`rate` запросов в секунду,
+    до `burst` подряд). Когда токенов не хватает, запросы ждут в очереди и
+    получают токены строго по приоритету полосы, внутри полосы - по порядку
+    поступления. Для каждой полосы собирается задержка (ожидание + сам запрос)
+    за последние `window` запросов, чтобы контролировать p95.
+    """
+
+    def __init__(self, rate: float, burst: int = 1,
+                 p95_targets: Optional[Dict[Priority, float]] = None,
+                 window: int = 500, executor: Optional[Executor] = None):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.p95_targets = p95_targets or {}
+        # Пул потоков для блокирующих вызовов (None - пул цикла событий по умолчанию)
+        self.executor = executor
+
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump_task: Optional[asyncio.Task] = None
+        self._latencies: Dict[Priority, Deque[float]] = {
+            lane: deque(maxlen=window) for lane in Priority
+        }
+        # Время выполнения самих запросов (без ожидания в очереди) по всем полосам
+        self._service_times: Deque[float] = deque(maxlen=window)
+
+    def _refill(self):
+        """Пополнить токены за прошедшее время"""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, priority: Priority):
+        """Дождаться своей очереди на запрос к Buff"""
+        if self.rate <= 0:
+            # Лимит отключен
+            return
+
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (int(priority), next(self._seq), future))
+
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Токен уже выдан, но запрос отменен - возвращаем токен
+            if future.done() and not future.cancelled():
+                self._tokens = min(self.burst, self._tokens + 1)
+            raise
+
+    async def _pump(self):
+        """Раздавать токены ожидающим запросам по приоритету"""
+        while self._waiters:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                # Ожидание отменено
+                continue
+
+            self._tokens -= 1
+            future.set_result(None)
+
+    async def run(self, priority: Priority, func: Callable[..., Any], *args,
+                  acquired: Optional[asyncio.Event] = None) -> Any:
+        """
+        Выполнить блокирующий вызов Buff API в потоке пула executor
+
+        Вызов ждет токен в своей полосе, задержка записывается в статистику полосы.
+        acquired (если передан) устанавливается, когда токен получен и запрос
+        отправляется.
+        """
+        started = time.monotonic()
+        try:
+            await self.acquire(priority)
+            if acquired is not None:
+                acquired.set()
+            call_started = time.monotonic()
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self.executor, functools.partial(func, *args))
+            self._service_times.append(time.monotonic() - call_started)
+            return result
+        finally:
+            self.record(priority, time.monotonic() - started)
+
+    def record(self, priority: Priority, latency: float):
+        """Записать задержку запроса (в секундах)"""
+        self._latencies[priority].append(latency)
+
+    def p95(self, priority: Priority) -> Optional[float]:
+        """p95 задержки полосы в секундах (None, если запросов еще не было)"""
+        return _percentile(self._latencies[priority], 0.95)
+
+    def service_p95(self, min_samples: int = 1) -> Optional[float]:
+        """
+        p95 времени выполнения запроса к Buff без ожидания в очереди
+
+        Возвращает None, если успешных запросов меньше min_samples.
+        """
+        if len(self._service_times) < min_samples:
+            return None
+        return _percentile(self._service_times, 0.95)
+
+    def lane_stats(self) -> Dict[Priority, Dict[str, Any]]:
+        """Статистика по полосам: число запросов в окне, p95 и цель"""
+        return {
+            lane: {
+                "count": len(self._latencies[lane]),
+                "p95": self.p95(lane),
+                "target": self.p95_targets.get(lane),
+                "waiting": sum(1 for p, _, f in self._waiters if p == lane and not f.done()),
+            }
+            for lane in Priority
+        }
+
+    def log_stats(self):
+        """Записать в лог p95 задержки по полосам"""
+        for lane, stats in self.lane_stats().items():
+            if not stats["count"]:
+                continue
+
+            p95_ms = stats["p95"] * 1000
+            message = f"Buff {lane.name}: p95={p95_ms:.0f} мс, запросов={stats['count']}, в очереди={stats['waiting']}"
+            target = stats["target"]
+
+            if target is not None and stats["p95"] > target:
+                logger.warning(f"{message} - превышена цель {target * 1000:.0f} мс")
+            else:
+                logger.info(message)
+
+
+def _percentile(samples: Deque[float], fraction: float) -> Optional[float]:
+    """Перцентиль по выборке (None для пустой выборки)"""
+    if not samples:
+        return None
+
+    ordered = sorted(samples)
+    return ordered[math.ceil(fraction * len(ordered)) - 1]
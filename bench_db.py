@@ -0,0 +1,131 @@
+"""
+Бенчмарк базы данных: профиль SQLite default против performance
+Сравнивает задержку get_price_history и чтения во время записи планировщика
+
+python bench_db.py [--items 200] [--rows 500] [--queries 300]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from database.db import Database
+
+logging.basicConfig(
+    level=logging.WARNING,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+
+def percentile(samples, fraction):
+    """Перцентиль по выборке"""
+    ordered = sorted(samples)
+    return ordered[max(0, int(round(fraction * len(ordered))) - 1)]
+
+
+async def populate(database: Database, items: int, rows: int):
+    """Заполнить БД товарами и историей цен"""
+    now = datetime.utcnow()
+    async with database.engine.begin() as conn:
+        await conn.execute(
+            text("INSERT INTO items (goods_id, market_hash_name, last_price, created_at, updated_at) "
+                 "VALUES (:goods_id, :name, 100, :now, :now)"),
+            [{"goods_id": 1000 + i, "name": f"Item {i}", "now": now} for i in range(items)]
+        )
+        # История перемешана по товарам, как при реальных проверках
+        history = [
+            {"item_id": item_id, "price": 100 + random.random(), "ts": now - timedelta(minutes=15 * step)}
+            for step in range(rows)
+            for item_id in range(1, items + 1)
+        ]
+        await conn.execute(
+            text("INSERT INTO price_history (item_id, price, timestamp) VALUES (:item_id, :price, :ts)"),
+            history
+        )
+
+
+async def measure_reads(database: Database, items: int, queries: int):
+    """Задержки get_price_history (мс)"""
+    latencies = []
+    for _ in range(queries):
+        item_id = random.randint(1, items)
+        started = time.perf_counter()
+        await database.get_price_history(item_id, days=1)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+async def writer(database: Database, items: int, stop: asyncio.Event):
+    """Имитация записи результатов проверки планировщиком"""
+    while not stop.is_set():
+        batch = {random.randint(1, items): 100 + random.random() for _ in range(50)}
+        await database.save_price_batch(batch)
+
+
+async def run_profile(profile: str, composite_index: bool, args) -> dict:
+    """Прогнать бенчмарк для одного профиля"""
+    with tempfile.TemporaryDirectory(prefix="bench_db_") as directory:
+        path = os.path.join(directory, "bench.db")
+        database = Database(f"sqlite+aiosqlite:///{path}", sqlite_profile=profile)
+
+        try:
+            await database.init_db()
+            if not composite_index:
+                async with database.engine.begin() as conn:
+                    await conn.execute(text("DROP INDEX IF EXISTS ix_price_history_item_id_timestamp"))
+
+            await populate(database, args.items, args.rows)
+
+            idle = await measure_reads(database, args.items, args.queries)
+
+            # Чтение во время непрерывной записи
+            stop = asyncio.Event()
+            writer_task = asyncio.create_task(writer(database, args.items, stop))
+            await asyncio.sleep(0.1)
+            busy = await measure_reads(database, args.items, args.queries)
+            stop.set()
+            await writer_task
+
+            return {
+                "idle_p50": statistics.median(idle),
+                "idle_p95": percentile(idle, 0.95),
+                "busy_p50": statistics.median(busy),
+                "busy_p95": percentile(busy, 0.95),
+            }
+        finally:
+            # Соединения закрываются до удаления каталога (иначе остаются -wal/-shm)
+            await database.close()
+
+async def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк профилей SQLite")
+    parser.add_argument("--items", type=int, default=200, help="Количество товаров")
+    parser.add_argument("--rows", type=int, default=500, help="Записей истории на товар")
+    parser.add_argument("--queries", type=int, default=300, help="Запросов на замер")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"📊 Бенчмарк БД: {args.items} товаров × {args.rows} записей истории")
+    print("=" * 60)
+
+    runs = [
+        ("До: default, без составного индекса", "default", False),
+        ("После: performance + (item_id, timestamp)", "performance", True),
+    ]
+
+    for title, profile, composite_index in runs:
+        result = await run_profile(profile, composite_index, args)
+        print(f"\n{title}")
+        print(f"   get_price_history:            p50={result['idle_p50']:.2f} мс  p95={result['idle_p95']:.2f} мс")
+        print(f"   get_price_history при записи: p50={result['busy_p50']:.2f} мс  p95={result['busy_p95']:.2f} мс")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, InlineQuery, Message, TelegramObject, Update, User
+
+from config import config
+from database.db import db, ROLE_ADMIN, ROLE_USER
+
+logger = logging.getLogger(__name__)
+
+ROLES = (ROLE_ADMIN, ROLE_USER)
+
+
+class AccessList:
+    """
+    Список доступа к боту
+
+    Источник - таблица allowed_users, в памяти - зеркало из двух frozenset,
+    поэтому проверка доступа - поиск в хеш-множестве без обращения к БД.
+    Зеркало пересобирается после каждого изменения через бота и
+    периодически (изменения, сделанные другими экземплярами бота).
+    """
+
+    def __init__(self):
+        self.users: FrozenSet[int] = frozenset()
+        self.admins: FrozenSet[int] = frozenset()
+
+    async def load(self):
+        """Перечитать список из БД"""
+        entries = await db.get_allowed_users()
+        self.users = frozenset(user_id for user_id, _ in entries)
+        self.admins = frozenset(user_id for user_id, role in entries if role == ROLE_ADMIN)
+        logger.debug(f"Список доступа: пользователей {len(self.users)}, администраторов {len(self.admins)}")
+
+    async def init(self):
+        """Добавить администраторов из ALLOWED_USER_IDS и загрузить список"""
+        await db.seed_allowed_users(config.ALLOWED_USER_IDS)
+        await self.load()
+        logger.info(f"Список доступа загружен: пользователей {len(self.users)}")
+
+    def is_allowed(self, user_id: int) -> bool:
+        return user_id in self.users
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self.admins
+
+    async def grant(self, user_id: int, role: str = ROLE_USER, added_by: Optional[int] = None):
+        """Выдать доступ (или сменить роль)"""
+        await db.set_allowed_user(user_id, role, added_by)
+        await self.load()
+
+    async def revoke(self, user_id: int) -> bool:
+        """Отозвать доступ"""
+        removed = await db.remove_allowed_user(user_id)
+        if removed:
+            await self.load()
+        return removed
+
+
+class AccessMiddleware(BaseMiddleware):
+    """
+    Проверка доступа один раз на каждый update
+
+    Регистрируется как outer middleware на dp.update, после встроенного
+    middleware aiogram, который кладет пользователя события в
+    data["event_from_user"]. Отказ отправляется в форме, подходящей
+    для типа события.
+    """
+
+    def __init__(self, access: AccessList):
+        self.access = access
+
+    async def __call__(self,
+                       handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject,
+                       data: Dict[str, Any]) -> Any:
+        user: Optional[User] = data.get("event_from_user")
+        if user is None or self.access.is_allowed(user.id):
+            return await handler(event, data)
+
+        await self._deny(event)
+        return None
+
+    async def _deny(self, update: Update):
+        """Сообщить пользователю об отсутствии доступа"""
+        event = update.event
+        try:
+            if isinstance(event, Message):
+                await event.answer(
+                    "❌ У вас нет доступа к этому боту.\n"
+                    "Обратитесь к администратору для получения доступа."
+                )
+            elif isinstance(event, CallbackQuery):
+                await event.answer("❌ У вас нет доступа к этому боту.", show_alert=True)
+            elif isinstance(event, InlineQuery):
+                await event.answer([], cache_time=config.INLINE_CACHE_TIME, is_personal=True)
+        except Exception as e:
+            logger.warning(f"Не удалось отправить отказ в доступе: {e}")
+
+
+# Глобальный список доступа
+access_list = AccessList()
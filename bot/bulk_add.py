@@ -0,0 +1,163 @@
+import asyncio
+import html
+import logging
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from config import config
+from api.buff_api import buff_client
+from api.request_scheduler import Priority
+
+logger = logging.getLogger(__name__)
+
+# Ссылка на товар: https://buff.163.com/goods/43012?from=market
+GOODS_URL_RE = re.compile(r"buff\.163\.com/goods/(\d+)", re.IGNORECASE)
+# Разделители goods_id в строке: пробелы, запятые и точки с запятой (CSV)
+TOKEN_SEPARATORS_RE = re.compile(r"[\s,;]+")
+
+# Файлы со списком товаров: расширения и максимальный размер
+DOCUMENT_EXTENSIONS = (".txt", ".csv")
+MAX_DOCUMENT_SIZE = 256 * 1024
+
+# Сколько записей показывать в каждом разделе итогового отчета
+SUMMARY_SECTION_LIMIT = 20
+
+# Как часто обновлять сообщение с прогрессом проверки (секунды)
+PROGRESS_INTERVAL = 2.0
+
+
+class FetchResults(NamedTuple):
+    """Результаты проверки товаров на Buff (списки - в порядке запроса)"""
+    found: Dict[int, Dict[str, Any]]
+    not_found: List[int]
+    errors: List[int]  # Не удалось проверить: дедлайн или ошибка запроса
+
+
+def parse_goods_ids(text: str) -> Tuple[List[int], List[str]]:
+    """
+    Извлечь goods_id из текста: по одному или несколько в строке
+
+    В строке ищутся ссылки buff.163.com/goods/<id>, если их нет - числа,
+    разделенные пробелами, запятыми или точками с запятой. Повторы
+    отбрасываются с сохранением порядка. Возвращает (goods_id, ошибки
+    по строкам без goods_id).
+    """
+    goods_ids: List[int] = []
+    failures: List[str] = []
+    seen = set()
+
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+
+        found = GOODS_URL_RE.findall(line) or [
+            token for token in TOKEN_SEPARATORS_RE.split(line) if token.isdigit()
+        ]
+        if not found:
+            shown = line if len(line) <= 40 else line[:37] + "..."
+            failures.append(f"строка {number}: не найден goods_id ({html.escape(shown)})")
+            continue
+
+        for token in found:
+            goods_id = int(token)
+            if goods_id not in seen:
+                seen.add(goods_id)
+                goods_ids.append(goods_id)
+
+    return goods_ids, failures
+
+
+def is_goods_document(file_name: Optional[str], mime_type: Optional[str]) -> bool:
+    """Похож ли документ на текстовый список товаров (.txt/.csv)"""
+    if file_name and file_name.lower().endswith(DOCUMENT_EXTENSIONS):
+        return True
+    return bool(mime_type) and (mime_type.startswith("text/") or mime_type == "application/csv")
+
+
+async def fetch_goods(goods_ids: List[int],
+                      progress: Optional[Callable[[int, int], Awaitable[None]]] = None
+                      ) -> FetchResults:
+    """
+    Проверить товары на Buff параллельно
+
+    Одновременно не больше BULK_ADD_CONCURRENCY запросов, общий лимит
+    запросов к Buff соблюдает планировщик клиента (полоса VALIDATION).
+    progress(готово, всего) вызывается не чаще раза в PROGRESS_INTERVAL секунд.
+    Товар, который Buff не вернул, и товар, запрос которого не удался
+    (дедлайн, ошибка API), попадают в разные списки: второй стоит повторить.
+    """
+    semaphore = asyncio.Semaphore(config.BULK_ADD_CONCURRENCY)
+    failed = set()
+
+    async def fetch(goods_id: int):
+        async with semaphore:
+            try:
+                return goods_id, await buff_client.get_item_price(
+                    goods_id, priority=Priority.VALIDATION, raise_errors=True
+                )
+            except Exception as e:
+                logger.warning(f"Не удалось проверить товар {goods_id}: {e!r}")
+                failed.add(goods_id)
+                return goods_id, None
+
+    found: Dict[int, Dict[str, Any]] = {}
+    reported = time.monotonic()
+    for done, result in enumerate(asyncio.as_completed([fetch(goods_id) for goods_id in goods_ids]), 1):
+        goods_id, price_data = await result
+        if price_data:
+            found[goods_id] = price_data
+
+        if progress is not None and done < len(goods_ids) and time.monotonic() - reported >= PROGRESS_INTERVAL:
+            reported = time.monotonic()
+            await progress(done, len(goods_ids))
+
+    return FetchResults(
+        found=found,
+        not_found=[goods_id for goods_id in goods_ids if goods_id not in found and goods_id not in failed],
+        errors=[goods_id for goods_id in goods_ids if goods_id in failed],
+    )
+
+
+def _section(title: str, lines: List[str]) -> str:
+    """Раздел отчета: заголовок и не больше SUMMARY_SECTION_LIMIT строк"""
+    shown = [f"• {line}" for line in lines[:SUMMARY_SECTION_LIMIT]]
+    if len(lines) > SUMMARY_SECTION_LIMIT:
+        shown.append(f"… и еще {len(lines) - SUMMARY_SECTION_LIMIT}")
+    return f"{title}\n" + "\n".join(shown)
+
+
+def format_bulk_summary(added: List[Tuple[int, str, float]], already: List[int],
+                        not_found: List[int], errors: List[int], failures: List[str]) -> str:
+    """Итоговый отчет массового добавления (errors - товары, которые не удалось проверить)"""
+    sections = [f"📥 <b>Массовое добавление</b>\n\n✅ Добавлено товаров: {len(added)}"]
+
+    if added:
+        sections.append(_section(
+            "📦 <b>Добавлены:</b>",
+            [f"{name} - {price:.2f} CNY ({goods_id})" for goods_id, name, price in added]
+        ))
+    if already:
+        sections.append(_section(
+            f"⚠️ <b>Уже отслеживаются ({len(already)}):</b>",
+            [str(goods_id) for goods_id in already]
+        ))
+    if not_found:
+        sections.append(_section(
+            f"❌ <b>Не найдены на Buff ({len(not_found)}):</b>",
+            [str(goods_id) for goods_id in not_found]
+        ))
+    if errors:
+        sections.append(
+            f"⏳ <b>Не удалось проверить ({len(errors)}):</b>\n"
+            f"Buff не ответил вовремя или вернул ошибку. Отправьте эти goods_id еще раз позже:\n"
+            f"<code>{' '.join(str(goods_id) for goods_id in errors)}</code>"
+        )
+    if failures:
+        sections.append(_section(
+            f"❌ <b>Не распознаны ({len(failures)}):</b>",
+            failures
+        ))
+
+    return "\n\n".join(sections)
@@ -0,0 +1,161 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Доступные периоды графика (дни) и их подписи
+CHART_RANGES = {
+    1: "1 день",
+    7: "7 дней",
+    30: "30 дней",
+}
+
+# (item_id, период, число точек, первая и последняя точки истории целиком)
+ChartKey = Tuple[int, int, int, tuple, tuple]
+
+
+def _init_worker():
+    """Подготовить процесс пула: неинтерактивный бэкенд и прогрев импорта matplotlib"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa: F401
+
+
+def render_chart(title: str, days: int, timestamps: Sequence[datetime],
+                 closes: Sequence[float], lows: Sequence[float], highs: Sequence[float]) -> bytes:
+    """
+    Нарисовать график цены в PNG
+
+    Выполняется в процессе пула, поэтому принимает только простые
+    сериализуемые значения. Для агрегатов закрашивается диапазон min-max.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.dates as mdates
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(8, 4), dpi=100)
+    try:
+        ax.step(timestamps, closes, where="post", color="#1f77b4", linewidth=1.5)
+        if any(low != high for low, high in zip(lows, highs)):
+            ax.fill_between(timestamps, lows, highs, step="post", color="#1f77b4", alpha=0.2, linewidth=0)
+
+        ax.set_title(title, fontsize=10)
+        ax.set_ylabel("CNY")
+        ax.grid(True, alpha=0.3)
+        ax.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M" if days <= 1 else "%d.%m"))
+        fig.autofmt_xdate()
+        fig.tight_layout()
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png")
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+
+class ChartRenderer:
+    """
+    Рендеринг графиков истории цен вне цикла событий
+
+    matplotlib выполняется в ProcessPoolExecutor (пул создается при первом
+    графике). Готовые PNG кешируются по (item_id, период, число точек,
+    первая и последняя точки истории): пока окно не сдвинулось и не
+    появилась новая цена, повторный просмотр не рисует график заново.
+    Первая точка и число точек меняются, когда старые точки выходят из
+    окна. Последняя точка входит в ключ целиком, а не только ее время:
+    у агрегата за час или день время - начало периода, а новые цены
+    внутри периода меняют close/high/low и count. Кеш ограничен суммарным размером картинок,
+    вытесняются давно не запрошенные.
+    """
+
+    def __init__(self, workers: int, cache_bytes: int):
+        self.workers = workers
+        self.cache_bytes = cache_bytes
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._cache: "OrderedDict[ChartKey, bytes]" = OrderedDict()
+        self._cache_size = 0
+        # Одинаковые графики, запрошенные одновременно, рисуются один раз
+        self._pending: Dict[ChartKey, asyncio.Future] = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: дочерние процессы не наследуют потоки и состояние цикла событий
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+        return self._executor
+
+    def _cache_get(self, key: ChartKey) -> Optional[bytes]:
+        png = self._cache.get(key)
+        if png is not None:
+            self._cache.move_to_end(key)
+        return png
+
+    def _cache_set(self, key: ChartKey, png: bytes):
+        if key in self._cache or len(png) > self.cache_bytes:
+            return
+
+        self._cache[key] = png
+        self._cache_size += len(png)
+        while self._cache_size > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_size -= len(evicted)
+
+    async def render(self, item_id: int, title: str, days: int, points: List) -> bytes:
+        """
+        PNG графика по точкам истории (PricePoint, отсортированы по времени)
+
+        Точки должны быть непустыми: первая, последняя и их число определяют ключ кеша.
+        """
+        key = (item_id, days, len(points), tuple(points[0]), tuple(points[-1]))
+
+        png = self._cache_get(key)
+        if png is not None:
+            return png
+
+        pending = self._pending.get(key)
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            pending = loop.run_in_executor(
+                self._get_executor(),
+                render_chart,
+                title,
+                days,
+                [p.timestamp for p in points],
+                [p.close for p in points],
+                [p.low for p in points],
+                [p.high for p in points],
+            )
+            self._pending[key] = pending
+
+        try:
+            png = await asyncio.shield(pending)
+        finally:
+            self._pending.pop(key, None)
+
+        self._cache_set(key, png)
+        return png
+
+    def shutdown(self):
+        """Остановить процессы пула"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._cache.clear()
+        self._cache_size = 0
+
+
+# Глобальный рендерер графиков
+chart_renderer = ChartRenderer(config.CHART_WORKERS, config.CHART_CACHE_MB * 1024 * 1024)
@@ -0,0 +1,65 @@
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Iterable, Iterator, Optional, Tuple
+
+
+class FairQueue:
+    """
+    Справедливая очередь запросов (Deficit Round Robin) по пользователям
+
+    У каждого пользователя своя очередь товаров. За один раунд пользователь
+    получает квант `quantum * weight` запросов к Buff, неизрасходованный
+    остаток (дефицит) переносится на следующий раунд. Поэтому пользователь
+    с большим списком не задерживает проверку остальных: пока его очередь
+    обрабатывается, короткие очереди успевают опустеть.
+    """
+
+    def __init__(self, quantum: float = 1.0, weights: Optional[Dict[int, float]] = None):
+        if quantum <= 0:
+            raise ValueError("Квант должен быть больше нуля")
+
+        self.quantum = quantum
+        self.weights = weights or {}
+        self._queues: "OrderedDict[int, Deque[Any]]" = OrderedDict()
+        self._deficits: Dict[int, float] = {}
+
+    def weight(self, user_id: int) -> float:
+        """Вес пользователя (по умолчанию 1 - равные доли)"""
+        weight = self.weights.get(user_id, 1.0)
+        return weight if weight > 0 else 1.0
+
+    def push(self, user_id: int, items: Iterable[Any]):
+        """Добавить товары в очередь пользователя"""
+        queue = self._queues.setdefault(user_id, deque())
+        queue.extend(items)
+        self._deficits.setdefault(user_id, 0.0)
+
+        if not queue:
+            # Пустые очереди не участвуют в раундах
+            del self._queues[user_id]
+            del self._deficits[user_id]
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def __iter__(self) -> Iterator[Tuple[int, Any, bool]]:
+        """
+        Выдавать запросы в справедливом порядке
+
+        Возвращает кортежи (user_id, item, is_last), где is_last=True
+        означает, что это последний товар в очереди пользователя.
+        Стоимость каждого запроса - 1.
+        """
+        while self._queues:
+            for user_id in list(self._queues):
+                queue = self._queues[user_id]
+                self._deficits[user_id] += self.quantum * self.weight(user_id)
+
+                while queue and self._deficits[user_id] >= 1:
+                    self._deficits[user_id] -= 1
+                    item = queue.popleft()
+                    yield user_id, item, not queue
+
+                if not queue:
+                    # Очередь опустела - дефицит не накапливаем
+                    del self._queues[user_id]
+                    del self._deficits[user_id]
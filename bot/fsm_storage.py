@@ -0,0 +1,119 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, NamedTuple, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from config import config
+from database.cache import MISSING, TTLCache
+from database.db import db
+
+logger = logging.getLogger(__name__)
+
+# Сколько ключей FSM держать в кеше
+FSM_CACHE_SIZE = 10000
+
+
+class FSMRecord(NamedTuple):
+    """Состояние диалога: состояние, данные и срок действия (None - записи нет)"""
+    state: Optional[str]
+    data: Dict[str, Any]
+    expires_at: Optional[datetime]
+
+
+EMPTY_RECORD = FSMRecord(None, {}, None)
+
+
+class DatabaseStorage(BaseStorage):
+    """
+    Хранилище FSM в общей БД (таблица fsm_states)
+
+    Запись сквозная: сначала БД, затем кеш в памяти процесса, поэтому
+    диалог переживает перезапуск и продолжается на любом экземпляре бота.
+    Чтение идет из кеша, а в БД - только при промахе. Кеш другого
+    экземпляра может отставать не дольше cache_ttl секунд. Отсутствие
+    записи кешируется отдельно и на miss_ttl секунд: update без диалога
+    обращаются к БД не чаще раза за miss_ttl, а диалог, начатый на другом
+    экземпляре, виден не позже чем через miss_ttl.
+    Диалог, не менявшийся state_ttl, считается брошенным: он не читается,
+    а запись удаляется плановой очисткой. Данные хранятся как JSON.
+    """
+
+    def __init__(self, state_ttl: timedelta, cache_ttl: float, miss_ttl: float,
+                 key_builder: Optional[KeyBuilder] = None):
+        self.state_ttl = state_ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.cache: TTLCache[FSMRecord] = TTLCache("fsm", cache_ttl, max_entries=FSM_CACHE_SIZE)
+        # Ключи без записи в БД (значение не используется)
+        self.missing: TTLCache[bool] = TTLCache("fsm_missing", miss_ttl, max_entries=FSM_CACHE_SIZE)
+
+    async def _get(self, key: StorageKey) -> FSMRecord:
+        """Запись по ключу: из кеша или из БД"""
+        db_key = self.key_builder.build(key)
+        record = self.cache.get(db_key)
+        if record is MISSING:
+            if self.missing.get(db_key) is not MISSING:
+                return EMPTY_RECORD
+            row = await db.get_fsm_state(db_key)
+            if row is None:
+                self.missing.set(db_key, True)
+                return EMPTY_RECORD
+            record = FSMRecord(*row)
+            self.cache.set(db_key, record)
+
+        if record.expires_at is not None and record.expires_at <= datetime.utcnow():
+            return EMPTY_RECORD
+        return record
+
+    async def _set(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]):
+        """Записать в БД и в кеш"""
+        db_key = self.key_builder.build(key)
+        expires_at = datetime.utcnow() + self.state_ttl
+        await db.set_fsm_state(db_key, state, data, expires_at)
+
+        if state is None and not data:
+            self.cache.invalidate(db_key)
+            self.missing.set(db_key, True)
+        else:
+            self.missing.invalidate(db_key)
+            self.cache.set(db_key, FSMRecord(state, data.copy(), expires_at))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._get(key)
+        await self._set(key, state.state if isinstance(state, State) else state, record.data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._get(key)
+        await self._set(key, record.state, data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._get(key)).data.copy()
+
+    async def close(self) -> None:
+        self.cache.log_stats()
+        self.missing.log_stats()
+
+
+def create_fsm_storage() -> BaseStorage:
+    """
+    Хранилище FSM по FSM_STORAGE
+
+    В режиме polling экземпляр бота единственный (Telegram не отдает
+    getUpdates двум клиентам сразу), поэтому кеш не может отстать и
+    живет столько же, сколько состояние. В режиме webhook экземпляров
+    может быть несколько - кеш живет FSM_CACHE_SECONDS. Отсутствие записи
+    в любом режиме кешируется не дольше FSM_MISS_CACHE_SECONDS.
+    """
+    if config.FSM_STORAGE == "memory":
+        return MemoryStorage()
+
+    state_ttl = timedelta(hours=config.FSM_STATE_TTL_HOURS)
+    cache_ttl = config.FSM_CACHE_SECONDS if config.WEBHOOK_BASE_URL else state_ttl.total_seconds()
+    miss_ttl = min(config.FSM_MISS_CACHE_SECONDS, cache_ttl)
+    logger.info(f"Состояния диалогов хранятся в БД, кеш {cache_ttl:.0f} с, отсутствие записи {miss_ttl:.0f} с")
+    return DatabaseStorage(state_ttl, cache_ttl, miss_ttl)
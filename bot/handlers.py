@@ -1,25 +1,39 @@
+import asyncio
 import logging
 from aiogram import Router, F
-from aiogram.filters import Command, CommandStart
+from aiogram.filters import Command, CommandObject, CommandStart
+from aiogram.types import BufferedInputFile, InlineKeyboardMarkup, InputMediaPhoto
+from aiogram.types import InlineQuery, InlineQueryResultArticle, InputTextMessageContent
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from typing import Any
+from typing import Any, Dict, List, Optional, Tuple
 
 from config import config
-from database.db import db
+from database.db import db, ROLE_ADMIN, ROLE_USER
 from api.buff_api import buff_client
+from api.request_scheduler import Priority
 from api.currency_converter import currency_converter
+from bot.access import ROLES, access_list
+from bot.bulk_add import MAX_DOCUMENT_SIZE, fetch_goods, format_bulk_summary, is_goods_document, parse_goods_ids
+from bot.charts import CHART_RANGES, chart_renderer
+from bot.inline_search import IndexEntry, inline_search
+from bot.stats import format_stats, format_stats_line, load_price_stats
+from bot.streaming import StreamingMessage
+from database.models import Item, User
 from bot.keyboards import (
     get_main_menu_keyboard,
     get_tracked_items_keyboard,
     get_item_actions_keyboard,
+    get_chart_keyboard,
+    get_track_keyboard,
     get_confirm_delete_keyboard,
     get_cancel_keyboard,
     get_back_to_menu_keyboard,
     get_settings_keyboard,
     get_interval_keyboard,
-    get_notifications_keyboard
+    get_notifications_keyboard,
+    trim_watchlist_search
 )
 
 logger = logging.getLogger(__name__)
@@ -33,11 +47,164 @@ class AddItemStates(StatesGroup):
     waiting_for_goods_id = State()
 
 
-# === Middleware для проверки доступа ===
+# FSM состояния для ввода позиции портфеля
+class HoldingStates(StatesGroup):
+    waiting_for_holding = State()
 
-async def check_user_access(user_id: int) -> bool:
-    """Проверить, есть ли у пользователя доступ к боту"""
-    return user_id in config.ALLOWED_USER_IDS
+
+# === Список товаров ===
+
+async def build_watchlist_page(user_id: int, sort: str = "new", after: Optional[int] = None,
+                               search: str = "") -> Optional[Tuple[str, InlineKeyboardMarkup]]:
+    """
+    Текст и клавиатура страницы списка товаров
+    
+    Количество товаров считается только на первой странице: повторный
+    COUNT (с фильтром по названию) на каждой странице свел бы на нет
+    keyset-пагинацию. Возвращает None, если у пользователя нет товаров
+    (без учета фильтра).
+    """
+    items, next_after = await db.get_user_items_page(
+        user_id, sort=sort, after=after, limit=config.WATCHLIST_PAGE_SIZE, search=search or None
+    )
+    if after is not None and not items:
+        # Товар-курсор удален - начинаем сначала
+        after = None
+        items, next_after = await db.get_user_items_page(
+            user_id, sort=sort, limit=config.WATCHLIST_PAGE_SIZE, search=search or None
+        )
+    
+    if after is None:
+        total = await db.count_user_items(user_id, search=search or None)
+        if not total and not search:
+            return None
+        title = f"📋 <b>Ваши отслеживаемые товары ({total}):</b>"
+    else:
+        title = "📋 <b>Ваши отслеживаемые товары:</b>"
+    
+    search_text = f"🔍 Фильтр: {search}\n" if search else ""
+    text = (
+        f"{title}\n"
+        f"{search_text}\n"
+        "Нажмите на товар для просмотра деталей:"
+    )
+    keyboard = get_tracked_items_keyboard(
+        items, sort=sort, next_after=next_after, search=search, first_page=after is None
+    )
+    return text, keyboard
+
+
+# === Актуальные цены ===
+
+def format_current_price(item: Item, price_data: Optional[Dict[str, Any]]) -> str:
+    """Блок сообщения /now для одного товара"""
+    if not price_data:
+        return (
+            f"<b>{item.market_hash_name}</b>\n"
+            f"❌ Не удалось получить цену\n"
+            f"🔗 goods_id: {item.goods_id}\n\n"
+        )
+    
+    current_price = price_data["min_price"]
+    prices = price_data.get("prices", {})
+    old_price = item.last_price
+    
+    # Вычисляем изменение цены
+    change_text = ""
+    if old_price:
+        diff = current_price - old_price
+        percent = (diff / old_price) * 100
+        
+        if diff > 0:
+            change_text = f" 📈 +{diff:.2f} CNY (+{percent:.1f}%)"
+        elif diff < 0:
+            change_text = f" 📉 {diff:.2f} CNY ({percent:.1f}%)"
+        else:
+            change_text = " ➡️ без изменений"
+    
+    # Форматируем цены
+    price_text = currency_converter.format_price(prices) if prices else f"{current_price:.2f} CNY"
+    
+    return (
+        f"<b>{item.market_hash_name}</b>\n"
+        f"{price_text}\n"
+        f"{change_text}\n"
+        f"🔗 goods_id: {item.goods_id}\n\n"
+    )
+
+
+async def stream_current_prices(status_msg: Message, items: List[Item]):
+    """
+    Загрузить цены товаров параллельно и выводить их по мере поступления
+    
+    Запросы к Buff идут одновременно (не больше NOW_CONCURRENCY), каждый
+    готовый результат сразу дописывается в status_msg (правки не чаще
+    NOW_EDIT_INTERVAL секунд, длинный ответ продолжается новыми сообщениями).
+    """
+    semaphore = asyncio.Semaphore(config.NOW_CONCURRENCY)
+    
+    async def fetch(item: Item):
+        async with semaphore:
+            return item, await buff_client.get_item_price(item.goods_id, priority=Priority.INTERACTIVE)
+    
+    stream = StreamingMessage(
+        status_msg,
+        "💰 <b>Актуальные цены:</b>\n\n",
+        reply_markup=get_back_to_menu_keyboard(),
+        min_interval=config.NOW_EDIT_INTERVAL
+    )
+    
+    for done, result in enumerate(asyncio.as_completed([fetch(item) for item in items]), 1):
+        item, price_data = await result
+        await stream.append(
+            format_current_price(item, price_data),
+            footer=f"⏳ Загружено {done}/{len(items)}" if done < len(items) else ""
+        )
+    
+    await stream.finish()
+
+
+# === Портфель ===
+
+def format_pnl(pnl: float, cost: float) -> str:
+    """Прибыль/убыток в CNY с процентом от затрат"""
+    sign = "+" if pnl > 0 else ""
+    percent = f" ({sign}{pnl / cost * 100:.1f}%)" if cost else ""
+    return f"{sign}{pnl:.2f} CNY{percent}"
+
+
+async def build_portfolio_text(user: Optional[User]) -> str:
+    """
+    Текст портфеля по итогам из users
+    
+    Итоги поддерживаются при каждом обновлении цен, поэтому просмотр не
+    зависит от числа позиций и не обращается к Buff.
+    """
+    if user is None or (round(user.portfolio_value, 2) == 0 and round(user.portfolio_cost, 2) == 0):
+        return (
+            "💼 <b>Портфель пуст</b>\n\n"
+            "Откройте товар в списке и нажмите '💼 Позиция', "
+            "чтобы указать количество и цену покупки."
+        )
+    
+    value = await currency_converter.convert(user.portfolio_value)
+    pnl = await currency_converter.convert(user.portfolio_value - user.portfolio_cost)
+    sign = "+" if pnl["CNY"] > 0 else ""
+    percent = (
+        f" ({sign}{(user.portfolio_value - user.portfolio_cost) / user.portfolio_cost * 100:.1f}%)"
+        if user.portfolio_cost else ""
+    )
+    
+    return (
+        "💼 <b>Портфель</b>\n\n"
+        f"💰 <b>Стоимость:</b>\n{currency_converter.format_price(value)}\n\n"
+        f"🧾 <b>Вложено:</b> {user.portfolio_cost:.2f} CNY\n\n"
+        f"{'📈' if pnl['CNY'] >= 0 else '📉'} <b>P&amp;L:</b>{percent}\n"
+        f"💴 {sign}{pnl['CNY']:.2f} CNY\n"
+        f"💵 {sign}${pnl['USD']:.2f} USD\n"
+        f"💸 {sign}{pnl['RUB']:.2f} RUB\n\n"
+        "ℹ️ Стоимость - по последним проверенным ценам"
+    )
 
 
 # === Обработчики команд ===
@@ -47,13 +214,6 @@ async def cmd_start(message: Message):
     """Обработчик команды /start"""
     user_id = message.from_user.id
     
-    if not await check_user_access(user_id):
-        await message.answer(
-            "❌ У вас нет доступа к этому боту.\n"
-            "Обратитесь к администратору для получения доступа."
-        )
-        return
-    
     # Добавляем пользователя в БД
     await db.add_user(user_id)
     
@@ -72,12 +232,6 @@ async def cmd_start(message: Message):
 @router.message(Command("help"))
 async def cmd_help(message: Message):
     """Обработчик команды /help"""
-    user_id = message.from_user.id
-    
-    if not await check_user_access(user_id):
-        await message.answer("❌ У вас нет доступа к этому боту.")
-        return
-    
     help_text = (
         "ℹ️ <b>Помощь по использованию бота</b>\n\n"
         "<b>Как добавить товар:</b>\n"
@@ -88,29 +242,37 @@ async def cmd_help(message: Message):
         "4. Отправьте этот номер боту\n\n"
         "<b>Команды:</b>\n"
         "/start - Главное меню\n"
-        "/list - Список отслеживаемых товаров\n"
+        "/list [текст] - Список отслеживаемых товаров (с фильтром по названию)\n"
         "/now - Актуальные цены\n"
+        "/stats goods_id - Статистика цены за 24ч/7д/30д\n"
+        "/portfolio - Стоимость портфеля и P&amp;L\n"
         "/help - Эта справка\n\n"
         "<b>Уведомления:</b>\n"
         f"Бот проверяет цены каждые {config.CHECK_INTERVAL} минут "
         "и уведомляет вас об изменениях."
     )
     
+    if access_list.is_admin(message.from_user.id):
+        help_text += (
+            "\n\n<b>Администрирование:</b>\n"
+            "/grant user_id [admin] - Выдать доступ (или роль администратора)\n"
+            "/revoke user_id - Отозвать доступ\n"
+            "/users - Список доступа"
+        )
+    
     await message.answer(help_text, reply_markup=get_back_to_menu_keyboard())
 
 
 @router.message(Command("list"))
-async def cmd_list(message: Message):
-    """Обработчик команды /list"""
+async def cmd_list(message: Message, command: CommandObject):
+    """Обработчик команды /list [часть названия]"""
     user_id = message.from_user.id
     
-    if not await check_user_access(user_id):
-        await message.answer("❌ У вас нет доступа к этому боту.")
-        return
-    
-    items = await db.get_user_items(user_id)
+    # Фильтр по названию должен поместиться в callback_data кнопок
+    search = trim_watchlist_search((command.args or "").strip())
+    page = await build_watchlist_page(user_id, search=search)
     
-    if not items:
+    if page is None:
         await message.answer(
             "📭 У вас нет отслеживаемых товаров.\n\n"
             "Нажмите '➕ Добавить товар' для начала отслеживания.",
@@ -118,10 +280,8 @@ async def cmd_list(message: Message):
         )
         return
     
-    await message.answer(
-        f"📋 <b>Ваши отслеживаемые товары ({len(items)}):</b>",
-        reply_markup=get_tracked_items_keyboard(items)
-    )
+    text, keyboard = page
+    await message.answer(text, reply_markup=keyboard)
 
 
 @router.message(Command("now"))
@@ -129,10 +289,6 @@ async def cmd_now(message: Message):
     """Обработчик команды /now - показать актуальные цены"""
     user_id = message.from_user.id
     
-    if not await check_user_access(user_id):
-        await message.answer("❌ У вас нет доступа к этому боту.")
-        return
-    
     items = await db.get_user_items(user_id)
     
     if not items:
@@ -143,55 +299,135 @@ async def cmd_now(message: Message):
         return
     
     status_msg = await message.answer("🔄 Загружаю актуальные цены...")
+    await stream_current_prices(status_msg, items)
+
+
+@router.message(Command("stats"))
+async def cmd_stats(message: Message, command: CommandObject):
+    """Обработчик команды /stats <goods_id> - статистика цены товара"""
+    user_id = message.from_user.id
     
-    response_text = "💰 <b>Актуальные цены:</b>\n\n"
+    if not command.args or not command.args.strip().isdigit():
+        await message.answer(
+            "❌ Укажите goods_id товара\n"
+            "Пример: <code>/stats 43012</code>"
+        )
+        return
     
-    for item in items:
-        price_data = await buff_client.get_item_price(item.goods_id)
-        
-        if price_data:
-            current_price = price_data["min_price"]
-            prices = price_data.get("prices", {})
-            old_price = item.last_price
-            
-            # Вычисляем изменение цены
-            change_text = ""
-            if old_price:
-                diff = current_price - old_price
-                percent = (diff / old_price) * 100
-                
-                if diff > 0:
-                    change_text = f" 📈 +{diff:.2f} CNY (+{percent:.1f}%)"
-                elif diff < 0:
-                    change_text = f" 📉 {diff:.2f} CNY ({percent:.1f}%)"
-                else:
-                    change_text = " ➡️ без изменений"
-            
-            # Форматируем цены
-            price_text = currency_converter.format_price(prices) if prices else f"{current_price:.2f} CNY"
-            
-            response_text += (
-                f"<b>{item.market_hash_name}</b>\n"
-                f"{price_text}\n"
-                f"{change_text}\n"
-                f"🔗 goods_id: {item.goods_id}\n\n"
-            )
-        else:
-            response_text += (
-                f"<b>{item.market_hash_name}</b>\n"
-                f"❌ Не удалось получить цену\n"
-                f"🔗 goods_id: {item.goods_id}\n\n"
-            )
+    goods_id = int(command.args.strip())
+    item = await db.get_item_by_goods_id(goods_id)
+    
+    if not item or not await db.is_user_subscribed(user_id, goods_id):
+        await message.answer(
+            "❌ Товар не отслеживается\n"
+            "Статистика доступна для товаров из вашего списка."
+        )
+        return
+    
+    stats = await load_price_stats(item.id)
+    
+    if not stats:
+        await message.answer(
+            f"📦 <b>{item.market_hash_name}</b>\n\n"
+            "📭 История цен пока пуста"
+        )
+        return
+    
+    await message.answer(
+        f"📊 <b>{item.market_hash_name}</b>\n\n{format_stats(stats)}",
+        reply_markup=get_item_actions_keyboard(item.id)
+    )
+
+
+@router.message(Command("portfolio"))
+async def cmd_portfolio(message: Message):
+    """Обработчик команды /portfolio - стоимость портфеля и P&L"""
+    user_id = message.from_user.id
+    
+    user = await db.get_user(user_id)
+    await message.answer(await build_portfolio_text(user), reply_markup=get_back_to_menu_keyboard())
+
+
+# === Администрирование доступа ===
+
+async def ensure_admin(message: Message) -> bool:
+    """Проверить роль администратора (сообщает об отказе)"""
+    if access_list.is_admin(message.from_user.id):
+        return True
+    await message.answer("❌ Команда доступна только администраторам.")
+    return False
+
+
+@router.message(Command("grant"))
+async def cmd_grant(message: Message, command: CommandObject):
+    """Обработчик команды /grant <user_id> [admin|user] - выдать доступ"""
+    if not await ensure_admin(message):
+        return
+    
+    args = (command.args or "").split()
+    if not args or not args[0].isdigit() or len(args) > 2 or (len(args) == 2 and args[1] not in ROLES):
+        await message.answer(
+            "❌ Укажите Telegram ID пользователя и, при необходимости, роль\n"
+            "Пример: <code>/grant 123456789</code> или <code>/grant 123456789 admin</code>"
+        )
+        return
+    
+    user_id = int(args[0])
+    role = args[1] if len(args) == 2 else ROLE_USER
+    await access_list.grant(user_id, role, added_by=message.from_user.id)
+    
+    role_text = "администратор" if role == ROLE_ADMIN else "пользователь"
+    await message.answer(f"✅ Доступ выдан: <code>{user_id}</code> ({role_text})")
+
+
+@router.message(Command("revoke"))
+async def cmd_revoke(message: Message, command: CommandObject):
+    """Обработчик команды /revoke <user_id> - отозвать доступ"""
+    if not await ensure_admin(message):
+        return
     
-    await status_msg.delete()
-    await message.answer(response_text, reply_markup=get_back_to_menu_keyboard())
+    args = (command.args or "").split()
+    if len(args) != 1 or not args[0].isdigit():
+        await message.answer(
+            "❌ Укажите Telegram ID пользователя\n"
+            "Пример: <code>/revoke 123456789</code>"
+        )
+        return
+    
+    user_id = int(args[0])
+    if user_id == message.from_user.id:
+        await message.answer("❌ Нельзя отозвать доступ у самого себя.")
+        return
+    
+    if await access_list.revoke(user_id):
+        await message.answer(f"✅ Доступ отозван: <code>{user_id}</code>")
+    else:
+        await message.answer(f"⚠️ У пользователя <code>{user_id}</code> не было доступа.")
+
+
+@router.message(Command("users"))
+async def cmd_users(message: Message):
+    """Обработчик команды /users - список доступа"""
+    if not await ensure_admin(message):
+        return
+    
+    admins = sorted(access_list.admins)
+    users = sorted(access_list.users - access_list.admins)
+    
+    lines = ["👥 <b>Список доступа</b>\n", f"👑 <b>Администраторы ({len(admins)}):</b>"]
+    lines += [f"• <code>{user_id}</code>" for user_id in admins]
+    lines.append(f"\n👤 <b>Пользователи ({len(users)}):</b>")
+    lines += [f"• <code>{user_id}</code>" for user_id in users] or ["—"]
+    
+    await message.answer("\n".join(lines))
 
 
 # === Обработчики callback кнопок ===
 
 @router.callback_query(F.data == "back_to_menu")
-async def callback_back_to_menu(callback: CallbackQuery):
-    """Возврат в главное меню"""
+async def callback_back_to_menu(callback: CallbackQuery, state: FSMContext):
+    """Возврат в главное меню (отменяет начатый ввод)"""
+    await state.clear()
     await callback.message.edit_text(
         "🏠 <b>Главное меню</b>\n\n"
         "Выберите действие:",
@@ -210,7 +446,10 @@ async def callback_add_item(callback: CallbackQuery, state: FSMContext):
         "1. Откройте страницу товара на buff.163.com\n"
         "2. В адресной строке найдите число после /goods/\n"
         "   Пример: https://buff.163.com/goods/<b>43012</b>\n\n"
-        "Отправьте это число:",
+        "Отправьте это число или ссылку на товар.\n\n"
+        "📥 Можно добавить сразу несколько товаров: отправьте список "
+        "goods_id или ссылок (через пробел, запятую или с новой строки) "
+        "либо файл .txt/.csv",
         reply_markup=get_cancel_keyboard()
     )
     await state.set_state(AddItemStates.waiting_for_goods_id)
@@ -221,20 +460,42 @@ async def callback_add_item(callback: CallbackQuery, state: FSMContext):
 async def callback_list_items(callback: CallbackQuery):
     """Показать список отслеживаемых товаров"""
     user_id = callback.from_user.id
-    items = await db.get_user_items(user_id)
+    page = await build_watchlist_page(user_id)
     
-    if not items:
+    if page is None:
         await callback.message.edit_text(
             "📭 У вас нет отслеживаемых товаров.\n\n"
             "Нажмите '➕ Добавить товар' для начала отслеживания.",
             reply_markup=get_main_menu_keyboard()
         )
     else:
+        text, keyboard = page
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("items_page:"))
+async def callback_items_page(callback: CallbackQuery):
+    """Страница списка товаров: сортировка, курсор и фильтр из callback_data"""
+    user_id = callback.from_user.id
+    _, sort, after, search = callback.data.split(":", 3)
+    
+    page = await build_watchlist_page(user_id, sort=sort, after=int(after) if after else None, search=search)
+    
+    if page is None:
         await callback.message.edit_text(
-            f"📋 <b>Ваши отслеживаемые товары ({len(items)}):</b>\n\n"
-            "Нажмите на товар для просмотра деталей:",
-            reply_markup=get_tracked_items_keyboard(items)
+            "📭 У вас нет отслеживаемых товаров.",
+            reply_markup=get_main_menu_keyboard()
         )
+    else:
+        text, keyboard = page
+        try:
+            await callback.message.edit_text(text, reply_markup=keyboard)
+        except Exception as e:
+            # Игнорируем ошибку "message is not modified" (повторное нажатие той же сортировки)
+            if "message is not modified" not in str(e):
+                raise
     
     await callback.answer()
 
@@ -254,52 +515,18 @@ async def callback_current_prices(callback: CallbackQuery):
         return
     
     await callback.answer("🔄 Загружаю цены...")
-    
-    response_text = "💰 <b>Актуальные цены:</b>\n\n"
-    
-    for item in items:
-        price_data = await buff_client.get_item_price(item.goods_id)
-        
-        if price_data:
-            current_price = price_data["min_price"]
-            prices = price_data.get("prices", {})
-            old_price = item.last_price
-            
-            change_text = ""
-            if old_price:
-                diff = current_price - old_price
-                percent = (diff / old_price) * 100
-                
-                if diff > 0:
-                    change_text = f" 📈 +{diff:.2f} CNY (+{percent:.1f}%)"
-                elif diff < 0:
-                    change_text = f" 📉 {diff:.2f} CNY ({percent:.1f}%)"
-                else:
-                    change_text = " ➡️"
-            
-            # Форматируем цены
-            price_text = currency_converter.format_price(prices) if prices else f"{current_price:.2f} CNY"
-            
-            response_text += (
-                f"<b>{item.market_hash_name}</b>\n"
-                f"{price_text}\n"
-                f"{change_text}\n\n"
-            )
-        else:
-            response_text += (
-                f"<b>{item.market_hash_name}</b>\n"
-                f"❌ Ошибка загрузки\n\n"
-            )
-    
-    try:
-        await callback.message.edit_text(
-            response_text, 
-            reply_markup=get_back_to_menu_keyboard()
-        )
-    except Exception as e:
-        # Игнорируем ошибку "message is not modified"
-        if "message is not modified" not in str(e):
-            raise
+    await stream_current_prices(callback.message, items)
+
+
+@router.callback_query(F.data == "portfolio")
+async def callback_portfolio(callback: CallbackQuery):
+    """Показать портфель"""
+    user = await db.get_user(callback.from_user.id)
+    await callback.message.edit_text(
+        await build_portfolio_text(user),
+        reply_markup=get_back_to_menu_keyboard()
+    )
+    await callback.answer()
 
 
 @router.callback_query(F.data == "help")
@@ -331,15 +558,14 @@ async def callback_item_info(callback: CallbackQuery):
     item_id = int(callback.data.split("_")[2])
     user_id = callback.from_user.id
     
-    items = await db.get_user_items(user_id)
-    item = next((i for i in items if i.id == item_id), None)
+    item = await db.get_user_item(user_id, item_id)
     
     if not item:
         await callback.answer("❌ Товар не найден", show_alert=True)
         return
     
     # Получаем актуальную цену
-    price_data = await buff_client.get_item_price(item.goods_id)
+    price_data = await buff_client.get_item_price(item.goods_id, priority=Priority.INTERACTIVE)
     
     if price_data:
         current_price = price_data["min_price"]
@@ -380,6 +606,20 @@ async def callback_item_info(callback: CallbackQuery):
             f"📅 Добавлен: {item.created_at.strftime('%d.%m.%Y %H:%M')}"
         )
     
+    # Позиция в портфеле
+    holding = await db.get_holding(user_id, item_id)
+    if holding:
+        buy_text = f" по {holding.buy_price:.2f} CNY" if holding.buy_price else ""
+        info_text += f"\n\n💼 <b>Позиция:</b> {holding.quantity} шт.{buy_text}"
+        if holding.buy_price and item.last_price:
+            cost = holding.quantity * holding.buy_price
+            info_text += f"\nP&amp;L: {format_pnl(holding.quantity * item.last_price - cost, cost)}"
+    
+    # Статистика по истории цен
+    stats = await load_price_stats(item_id)
+    if stats:
+        info_text += "\n\n📊 <b>Статистика:</b>\n" + "\n".join(format_stats_line(window) for window in stats)
+    
     await callback.message.edit_text(
         info_text,
         reply_markup=get_item_actions_keyboard(item_id)
@@ -393,8 +633,7 @@ async def callback_refresh_price(callback: CallbackQuery):
     item_id = int(callback.data.split("_")[2])
     user_id = callback.from_user.id
     
-    items = await db.get_user_items(user_id)
-    item = next((i for i in items if i.id == item_id), None)
+    item = await db.get_user_item(user_id, item_id)
     
     if not item:
         await callback.answer("❌ Товар не найден", show_alert=True)
@@ -403,15 +642,14 @@ async def callback_refresh_price(callback: CallbackQuery):
     await callback.answer("🔄 Обновляю...")
     
     # Получаем актуальную цену
-    price_data = await buff_client.get_item_price(item.goods_id)
+    price_data = await buff_client.get_item_price(item.goods_id, priority=Priority.INTERACTIVE)
     
     if price_data:
         current_price = price_data["min_price"]
         prices = price_data.get("prices", {})
         
-        # Обновляем в БД
-        await db.update_item_price(item_id, current_price)
-        await db.add_price_history(item_id, current_price)
+        # Обновляем в БД (история и цена - одной транзакцией)
+        await db.record_price(item_id, current_price)
         
         # Форматируем цены
         price_text = currency_converter.format_price(prices) if prices else f"💵 {current_price:.2f} CNY"
@@ -427,14 +665,129 @@ async def callback_refresh_price(callback: CallbackQuery):
         )
 
 
+@router.callback_query(F.data == "chart_close")
+async def callback_chart_close(callback: CallbackQuery):
+    """Закрыть график"""
+    await callback.message.delete()
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("chart_"))
+async def callback_chart(callback: CallbackQuery):
+    """Показать график истории цен товара за выбранный период"""
+    _, item_id, days = callback.data.split("_")
+    item_id, days = int(item_id), int(days)
+    user_id = callback.from_user.id
+
+    item = await db.get_user_item(user_id, item_id)
+
+    if not item or days not in CHART_RANGES:
+        await callback.answer("❌ Товар не найден", show_alert=True)
+        return
+
+    points = await db.get_price_series(item_id, days)
+    if not points:
+        await callback.answer("📭 Истории цен за этот период пока нет", show_alert=True)
+        return
+
+    await callback.answer()
+
+    # Рендеринг - в пуле процессов, повторный просмотр берется из кеша
+    png = await chart_renderer.render(item_id, item.market_hash_name, days, points)
+
+    photo = BufferedInputFile(png, filename=f"chart_{item_id}_{days}.png")
+    caption = (
+        f"📈 <b>{item.market_hash_name}</b>\n"
+        f"За {CHART_RANGES[days]}: "
+        f"мин {min(p.low for p in points):.2f} / "
+        f"макс {max(p.high for p in points):.2f} / "
+        f"сейчас {points[-1].close:.2f} CNY"
+    )
+    keyboard = get_chart_keyboard(item_id, days)
+
+    if callback.message.photo:
+        # Переключение периода - заменяем картинку в том же сообщении
+        await callback.message.edit_media(
+            InputMediaPhoto(media=photo, caption=caption),
+            reply_markup=keyboard
+        )
+    else:
+        await callback.message.answer_photo(photo, caption=caption, reply_markup=keyboard)
+
+
+@router.callback_query(F.data.startswith("holding_"))
+async def callback_holding(callback: CallbackQuery, state: FSMContext):
+    """Начало ввода позиции по товару"""
+    item_id = int(callback.data.split("_")[1])
+    user_id = callback.from_user.id
+    
+    item = await db.get_user_item(user_id, item_id)
+    
+    if not item:
+        await callback.answer("❌ Товар не найден", show_alert=True)
+        return
+    
+    holding = await db.get_holding(user_id, item_id)
+    current_text = (
+        f"Сейчас: {holding.quantity} шт." + (f" по {holding.buy_price:.2f} CNY" if holding.buy_price else "") + "\n\n"
+        if holding else ""
+    )
+    
+    await callback.message.edit_text(
+        f"💼 <b>Позиция</b>\n\n"
+        f"📦 {item.market_hash_name}\n"
+        f"{current_text}"
+        "Отправьте количество и цену покупки за штуку (CNY) через пробел:\n"
+        "Пример: <code>3 125.5</code>\n\n"
+        "Отправьте <code>0</code>, чтобы убрать позицию.",
+        reply_markup=get_cancel_keyboard()
+    )
+    await state.set_state(HoldingStates.waiting_for_holding)
+    await state.update_data(item_id=item_id)
+    await callback.answer()
+
+
+@router.message(HoldingStates.waiting_for_holding)
+async def process_holding(message: Message, state: FSMContext):
+    """Обработка введенной позиции: '<количество> <цена покупки>' или '0'"""
+    user_id = message.from_user.id
+    item_id = (await state.get_data()).get("item_id")
+    
+    parts = (message.text or "").replace(",", ".").split()
+    try:
+        quantity = int(parts[0])
+        buy_price = float(parts[1]) if len(parts) > 1 else None
+    except (IndexError, ValueError):
+        quantity, buy_price = -1, None
+    
+    if len(parts) > 2 or quantity < 0 or (quantity and (buy_price is None or buy_price <= 0)):
+        await message.answer(
+            "❌ Отправьте количество и цену покупки через пробел\n\n"
+            "Пример: <code>3 125.5</code> (или <code>0</code>, чтобы убрать позицию)",
+            reply_markup=get_cancel_keyboard()
+        )
+        return
+    
+    await state.clear()
+    
+    if item_id is None or not await db.set_holding(user_id, item_id, quantity, buy_price):
+        await message.answer("❌ Товар не найден", reply_markup=get_main_menu_keyboard())
+        return
+    
+    text = (
+        f"✅ Позиция сохранена: {quantity} шт. по {buy_price:.2f} CNY"
+        if quantity else "✅ Позиция удалена"
+    )
+    await message.answer(text, reply_markup=get_item_actions_keyboard(item_id))
+
+
 @router.callback_query(F.data.startswith("remove_item_"))
 async def callback_remove_item(callback: CallbackQuery):
     """Запрос подтверждения удаления товара"""
     item_id = int(callback.data.split("_")[2])
     user_id = callback.from_user.id
     
-    items = await db.get_user_items(user_id)
-    item = next((i for i in items if i.id == item_id), None)
+    item = await db.get_user_item(user_id, item_id)
     
     if not item:
         await callback.answer("❌ Товар не найден", show_alert=True)
@@ -456,8 +809,7 @@ async def callback_confirm_delete(callback: CallbackQuery):
     item_id = int(callback.data.split("_")[2])
     user_id = callback.from_user.id
     
-    items = await db.get_user_items(user_id)
-    item = next((i for i in items if i.id == item_id), None)
+    item = await db.get_user_item(user_id, item_id)
     
     if not item:
         await callback.answer("❌ Товар не найден", show_alert=True)
@@ -481,21 +833,100 @@ async def callback_confirm_delete(callback: CallbackQuery):
 
 # === Обработчик добавления товара через FSM ===
 
+async def read_goods_document(message: Message) -> Optional[str]:
+    """Текст присланного файла со списком товаров (None - файл не подходит)"""
+    document = message.document
+    if not is_goods_document(document.file_name, document.mime_type):
+        await message.answer(
+            "❌ Поддерживаются только текстовые файлы .txt и .csv",
+            reply_markup=get_cancel_keyboard()
+        )
+        return None
+    if document.file_size and document.file_size > MAX_DOCUMENT_SIZE:
+        await message.answer(
+            f"❌ Файл слишком большой (максимум {MAX_DOCUMENT_SIZE // 1024} КБ)",
+            reply_markup=get_cancel_keyboard()
+        )
+        return None
+    
+    content = await message.bot.download(document)
+    return content.read().decode("utf-8-sig", errors="replace")
+
+
+async def process_bulk_add(message: Message, state: FSMContext, goods_ids: List[int], failures: List[str]):
+    """
+    Добавить несколько товаров из одного сообщения или файла
+    
+    Товары проверяются на Buff параллельно, найденные добавляются одной
+    транзакцией, результат - один отчет с ошибками по строкам.
+    """
+    user_id = message.from_user.id
+    
+    if len(goods_ids) > config.BULK_ADD_MAX_ITEMS:
+        await message.answer(
+            f"❌ Слишком много товаров: {len(goods_ids)} "
+            f"(максимум {config.BULK_ADD_MAX_ITEMS} за раз)",
+            reply_markup=get_cancel_keyboard()
+        )
+        return
+    
+    await state.clear()
+    
+    subscribed = await db.get_subscribed_goods_ids(user_id, goods_ids)
+    already = [goods_id for goods_id in goods_ids if goods_id in subscribed]
+    to_check = [goods_id for goods_id in goods_ids if goods_id not in subscribed]
+    
+    status_msg = await message.answer(f"🔄 Проверяю товары: {len(to_check)}...")
+    
+    async def report_progress(done: int, total: int):
+        try:
+            await status_msg.edit_text(f"🔄 Проверяю товары: {done}/{total}...")
+        except Exception as e:
+            logger.debug(f"Не удалось обновить прогресс: {e}")
+    
+    results = await fetch_goods(to_check, progress=report_progress)
+    
+    added = [
+        (goods_id, results.found[goods_id]["market_hash_name"], results.found[goods_id]["min_price"])
+        for goods_id in to_check if goods_id in results.found
+    ]
+    
+    if added:
+        await db.add_user_subscriptions(user_id, added)
+    
+    await status_msg.edit_text(
+        format_bulk_summary(added, already, results.not_found, results.errors, failures),
+        reply_markup=get_main_menu_keyboard()
+    )
+
+
 @router.message(AddItemStates.waiting_for_goods_id)
 async def process_goods_id(message: Message, state: FSMContext):
-    """Обработка введенного goods_id"""
+    """Обработка введенных goods_id: число, ссылка Buff, список или файл .txt/.csv"""
     user_id = message.from_user.id
     
-    # Проверяем, что это число
-    if not message.text.isdigit():
+    if message.document:
+        text = await read_goods_document(message)
+        if text is None:
+            return
+    else:
+        text = message.text or ""
+    
+    goods_ids, failures = parse_goods_ids(text)
+    
+    if not goods_ids:
         await message.answer(
-            "❌ Пожалуйста, отправьте корректный goods_id (только цифры)\n\n"
-            "Пример: 43012",
+            "❌ Пожалуйста, отправьте корректный goods_id (только цифры) или ссылку на товар\n\n"
+            "Пример: 43012 или https://buff.163.com/goods/43012",
             reply_markup=get_cancel_keyboard()
         )
         return
     
-    goods_id = int(message.text)
+    if len(goods_ids) > 1 or failures or message.document:
+        await process_bulk_add(message, state, goods_ids, failures)
+        return
+    
+    goods_id = goods_ids[0]
     
     # Проверяем, не подписан ли уже пользователь на этот товар
     is_subscribed = await db.is_user_subscribed(user_id, goods_id)
@@ -510,7 +941,7 @@ async def process_goods_id(message: Message, state: FSMContext):
     status_msg = await message.answer("🔄 Проверяю товар...")
     
     # Получаем информацию о товаре
-    price_data = await buff_client.get_item_price(goods_id)
+    price_data = await buff_client.get_item_price(goods_id, priority=Priority.VALIDATION)
     
     if not price_data:
         await status_msg.edit_text(
@@ -526,23 +957,24 @@ async def process_goods_id(message: Message, state: FSMContext):
     min_price = price_data["min_price"]
     prices = price_data.get("prices", {})
     
-    await db.add_user_subscription(
-        user_id=user_id,
-        goods_id=goods_id,
-        market_hash_name=market_hash_name,
-        initial_price=min_price
-    )
-    
-    # Добавляем первую запись в историю
-    item = await db.get_item_by_goods_id(goods_id)
-    if item:
-        await db.add_price_history(item.id, min_price)
+    # Подписка, первая запись в историю и чтение настроек - одна сессия и транзакция
+    async with db.unit_of_work():
+        item_id = await db.add_user_subscription(
+            user_id=user_id,
+            goods_id=goods_id,
+            market_hash_name=market_hash_name,
+            initial_price=min_price
+        )
+        
+        # Добавляем первую запись в историю
+        await db.add_price_history(item_id, min_price)
+        
+        # Получаем настройки пользователя
+        user = await db.get_user(user_id)
     
     # Форматируем цены
     price_text = currency_converter.format_price(prices) if prices else f"💵 {min_price:.2f} CNY"
     
-    # Получаем настройки пользователя
-    user = await db.get_user(user_id)
     interval_text = f"{user.check_interval} минут" if user else f"{config.CHECK_INTERVAL} минут"
     
     await status_msg.edit_text(
@@ -557,6 +989,93 @@ async def process_goods_id(message: Message, state: FSMContext):
     await state.clear()
 
 
+# === Inline-режим ===
+
+def build_inline_result(entry: IndexEntry) -> InlineQueryResultArticle:
+    """Результат inline-поиска: товар с ценой и кнопкой отслеживания"""
+    price_text = f"💴 {entry.price:.2f} CNY" if entry.price else "❓ Цена неизвестна"
+    return InlineQueryResultArticle(
+        id=str(entry.goods_id),
+        title=entry.market_hash_name,
+        description=f"{price_text} • goods_id: {entry.goods_id}",
+        input_message_content=InputTextMessageContent(
+            message_text=(
+                f"📦 <b>{entry.market_hash_name}</b>\n"
+                f"{price_text}\n"
+                f"🔗 https://buff.163.com/goods/{entry.goods_id}"
+            )
+        ),
+        reply_markup=get_track_keyboard(entry.goods_id)
+    )
+
+
+@router.inline_query()
+async def inline_query_search(inline_query: InlineQuery):
+    """
+    Inline-поиск товаров: @bot ak-47 redline
+    
+    Пустой запрос - товары из списка пользователя. Результаты без
+    привязки к пользователю кешируются Telegram на INLINE_CACHE_TIME.
+    """
+    user_id = inline_query.from_user.id
+    query = inline_query.query.strip()
+    
+    if not query:
+        items = await db.get_user_items(user_id)
+        entries = [
+            IndexEntry(item.goods_id, item.market_hash_name, item.last_price)
+            for item in items[:config.INLINE_RESULTS_LIMIT]
+        ]
+        await inline_query.answer(
+            [build_inline_result(entry) for entry in entries],
+            cache_time=config.INLINE_CACHE_TIME,
+            is_personal=True
+        )
+        return
+    
+    entries = await inline_search.search(user_id, query)
+    if entries is None:
+        # Пользователь уже ввел более новый запрос
+        return
+    
+    await inline_query.answer(
+        [build_inline_result(entry) for entry in entries],
+        cache_time=config.INLINE_CACHE_TIME
+    )
+
+
+@router.callback_query(F.data.startswith("track_"))
+async def callback_track(callback: CallbackQuery):
+    """Добавить товар в отслеживание из inline-результата"""
+    goods_id = int(callback.data.split("_")[1])
+    user_id = callback.from_user.id
+    
+    await db.add_user(user_id)
+    
+    if await db.is_user_subscribed(user_id, goods_id):
+        await callback.answer("⚠️ Вы уже отслеживаете этот товар", show_alert=True)
+        return
+    
+    price_data = await buff_client.get_item_price(goods_id, priority=Priority.INTERACTIVE)
+    if not price_data:
+        await callback.answer("❌ Не удалось получить товар с Buff, попробуйте позже", show_alert=True)
+        return
+    
+    async with db.unit_of_work():
+        item_id = await db.add_user_subscription(
+            user_id=user_id,
+            goods_id=goods_id,
+            market_hash_name=price_data["market_hash_name"],
+            initial_price=price_data["min_price"]
+        )
+        await db.add_price_history(item_id, price_data["min_price"])
+    
+    await callback.answer(
+        f"✅ Добавлено в отслеживание:\n{price_data['market_hash_name']}",
+        show_alert=True
+    )
+
+
 # === Обработчики настроек ===
 
 @router.callback_query(F.data == "settings")
@@ -0,0 +1,260 @@
+import asyncio
+import heapq
+import logging
+import re
+import time
+from bisect import bisect_left, insort
+from typing import Dict, List, NamedTuple, Optional, Set
+
+from config import config
+from database.cache import TTLCache
+from database.db import db
+from api.buff_api import buff_client
+from api.request_scheduler import Priority
+
+logger = logging.getLogger(__name__)
+
+# Слова названия: буквы, цифры и дефис ("ak-47"), остальное - разделители
+TOKEN_RE = re.compile(r"[\w-]+")
+
+# Минимальная длина запроса для поиска на Buff
+MIN_QUERY_LENGTH = 2
+
+# Как часто дополнять индекс товарами из БД (секунды)
+INDEX_REFRESH_SECONDS = 600
+
+# Сколько запросов к Buff помнить
+SEARCH_CACHE_SIZE = 5000
+
+
+def normalize_query(text: str) -> str:
+    """Привести запрос или название к виду для индекса: нижний регистр, слова через пробел"""
+    return " ".join(TOKEN_RE.findall(text.lower()))
+
+
+class IndexEntry(NamedTuple):
+    """Товар в индексе поиска"""
+    goods_id: int
+    market_hash_name: str
+    price: Optional[float]
+
+
+class PrefixIndex:
+    """
+    Индекс товаров по префиксам слов названия
+
+    Слова хранятся в отсортированном списке, поэтому все слова с заданным
+    префиксом - непрерывный диапазон, который находится бинарным поиском.
+    Товар подходит под запрос, если каждое слово запроса - префикс
+    какого-либо слова названия ("ak red" -> "AK-47 | Redline").
+    """
+
+    def __init__(self):
+        self.entries: Dict[int, IndexEntry] = {}
+        self._tokens: List[str] = []
+        self._postings: Dict[str, Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, goods_id: int, market_hash_name: str, price: Optional[float]):
+        """Добавить товар или обновить его цену (и название)"""
+        previous = self.entries.get(goods_id)
+        self.entries[goods_id] = IndexEntry(goods_id, market_hash_name, price)
+        if previous is not None:
+            if previous.market_hash_name == market_hash_name:
+                return
+            self._unlink(goods_id, previous.market_hash_name)
+
+        for token in set(normalize_query(market_hash_name).split()):
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                insort(self._tokens, token)
+            postings.add(goods_id)
+
+    def remove(self, goods_id: int) -> bool:
+        """Удалить товар (False, если его нет в индексе)"""
+        entry = self.entries.pop(goods_id, None)
+        if entry is None:
+            return False
+        self._unlink(goods_id, entry.market_hash_name)
+        return True
+
+    def _unlink(self, goods_id: int, market_hash_name: str):
+        """Убрать товар из списков слов названия, слова без товаров - из индекса"""
+        for token in set(normalize_query(market_hash_name).split()):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.discard(goods_id)
+            if not postings:
+                del self._postings[token]
+                del self._tokens[bisect_left(self._tokens, token)]
+
+    def _matching(self, prefix: str) -> Set[int]:
+        """Товары, в названии которых есть слово с префиксом prefix"""
+        lo = bisect_left(self._tokens, prefix)
+        hi = bisect_left(self._tokens, prefix + "\uffff", lo)
+        matched: Set[int] = set()
+        for token in self._tokens[lo:hi]:
+            matched |= self._postings[token]
+        return matched
+
+    def search(self, query: str, limit: int) -> List[IndexEntry]:
+        """Товары под нормализованный запрос: сначала короткие названия"""
+        terms = query.split()
+        if not terms:
+            return []
+
+        found: Optional[Set[int]] = None
+        # Длинные слова отбирают меньше товаров - начинаем с них
+        for term in sorted(terms, key=len, reverse=True):
+            matched = self._matching(term)
+            found = matched if found is None else found & matched
+            if not found:
+                return []
+
+        return heapq.nsmallest(
+            limit,
+            (self.entries[goods_id] for goods_id in found),
+            key=lambda entry: (len(entry.market_hash_name), entry.market_hash_name)
+        )
+
+
+class InlineSearch:
+    """
+    Поиск товаров для inline-режима
+
+    Ответ собирается из локального индекса: товары из БД и все, что уже
+    находил поиск Buff. К Buff обращаемся только при промахе - если запрос
+    и его префиксы еще не искались (запросы к Buff кешируются на
+    INLINE_SEARCH_TTL), а локальных результатов недостаточно. Найденное на
+    Buff живет в индексе столько же: при обновлении индекса устаревшие
+    неотслеживаемые товары удаляются, поэтому их старые цены не выдаются
+    как актуальные, а индекс не растет бесконечно. Перед
+    запросом к Buff выдерживается пауза INLINE_DEBOUNCE_MS: если за это
+    время пользователь ввел следующий символ, старый запрос отменяется
+    и не доходит до Buff. Одинаковые запросы разных пользователей
+    выполняются один раз.
+    """
+
+    def __init__(self, debounce: float, search_ttl: float, limit: int):
+        self.debounce = debounce
+        self.limit = limit
+        self.index = PrefixIndex()
+        # Запросы, уже выполненные на Buff (нормализованные)
+        self.searched: TTLCache[bool] = TTLCache("inline_search", search_ttl, max_entries=SEARCH_CACHE_SIZE)
+
+        self._index_loaded_at: Optional[float] = None
+        # Когда товар последний раз пришел из поиска Buff (goods_id -> time.monotonic())
+        self._found_at: Dict[int, float] = {}
+        self._index_lock = asyncio.Lock()
+        self._waiting: Dict[int, asyncio.Task] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def ensure_index(self):
+        """
+        Обновить индекс (при первом запросе и раз в INDEX_REFRESH_SECONDS)
+
+        Отслеживаемые товары из БД добавляются с текущей ценой. Остальные
+        товары остаются, только если поиск Buff возвращал их не раньше
+        INLINE_SEARCH_TTL назад.
+        """
+        if self._index_loaded_at is not None and time.monotonic() - self._index_loaded_at < INDEX_REFRESH_SECONDS:
+            return
+
+        async with self._index_lock:
+            if self._index_loaded_at is not None and time.monotonic() - self._index_loaded_at < INDEX_REFRESH_SECONDS:
+                return
+            keep = set()
+            for item in await db.get_all_tracked_items():
+                self.index.add(item.goods_id, item.market_hash_name, item.last_price)
+                keep.add(item.goods_id)
+
+            now = time.monotonic()
+            for goods_id, found_at in list(self._found_at.items()):
+                if now - found_at < self.searched.ttl:
+                    keep.add(goods_id)
+                else:
+                    del self._found_at[goods_id]
+
+            stale = [goods_id for goods_id in self.index.entries if goods_id not in keep]
+            for goods_id in stale:
+                self.index.remove(goods_id)
+            self._index_loaded_at = now
+            logger.info(f"Индекс inline-поиска обновлен: товаров {len(self.index)}, удалено устаревших {len(stale)}")
+
+    def _searched_prefix(self, query: str) -> bool:
+        """Искался ли на Buff сам запрос или его префикс"""
+        return any(query[:length] in self.searched for length in range(len(query), MIN_QUERY_LENGTH - 1, -1))
+
+    async def search(self, user_id: int, query: str) -> Optional[List[IndexEntry]]:
+        """
+        Результаты поиска для пользователя
+
+        Возвращает None, если запрос вытеснен более новым запросом того же
+        пользователя (отвечать на него уже не нужно).
+        """
+        query = normalize_query(query)
+        await self.ensure_index()
+
+        local = self.index.search(query, self.limit)
+        if len(query) < MIN_QUERY_LENGTH or len(local) >= self.limit:
+            return local
+        if query in self.searched or (local and self._searched_prefix(query)):
+            return local
+
+        # Промах - запрос к Buff после паузы, предыдущий запрос пользователя отменяется
+        previous = self._waiting.pop(user_id, None)
+        if previous is not None:
+            previous.cancel()
+
+        waiter = asyncio.create_task(self._debounced_fetch(query))
+        self._waiting[user_id] = waiter
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled() and not asyncio.current_task().cancelling():
+                return None
+            raise
+        finally:
+            if self._waiting.get(user_id) is waiter:
+                del self._waiting[user_id]
+
+        return self.index.search(query, self.limit)
+
+    async def _debounced_fetch(self, query: str):
+        """Выждать паузу ввода и дождаться общего запроса к Buff"""
+        await asyncio.sleep(self.debounce)
+
+        task = self._inflight.get(query)
+        if task is None:
+            task = asyncio.create_task(self._fetch(query))
+            self._inflight[query] = task
+            task.add_done_callback(lambda _: self._inflight.pop(query, None))
+        # Отмена ожидания одним пользователем не отменяет запрос для остальных
+        await asyncio.shield(task)
+
+    async def _fetch(self, query: str):
+        """Поиск на Buff: найденные товары попадают в индекс"""
+        results = await buff_client.search_item_by_name(query, priority=Priority.INTERACTIVE)
+        if results is None:
+            return
+
+        found_at = time.monotonic()
+        for result in results:
+            if result.get("goods_id"):
+                goods_id = int(result["goods_id"])
+                self.index.add(goods_id, result["market_hash_name"], result["min_price"])
+                self._found_at[goods_id] = found_at
+        self.searched.set(query, True)
+        logger.debug(f"Inline-поиск '{query}': найдено на Buff {len(results)}")
+
+
+# Глобальный поиск для inline-режима
+inline_search = InlineSearch(
+    debounce=config.INLINE_DEBOUNCE_MS / 1000,
+    search_ttl=config.INLINE_SEARCH_TTL,
+    limit=config.INLINE_RESULTS_LIMIT
+)
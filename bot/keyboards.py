@@ -1,7 +1,8 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from typing import List
+from typing import List, Optional
 from database.models import Item
+from bot.charts import CHART_RANGES
 
 
 def get_main_menu_keyboard() -> InlineKeyboardMarkup:
@@ -26,6 +27,12 @@ def get_main_menu_keyboard() -> InlineKeyboardMarkup:
             callback_data="current_prices"
         )
     )
+    builder.row(
+        InlineKeyboardButton(
+            text="💼 Портфель",
+            callback_data="portfolio"
+        )
+    )
     builder.row(
         InlineKeyboardButton(
             text="⚙️ Настройки",
@@ -42,11 +49,37 @@ def get_main_menu_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def get_tracked_items_keyboard(items: List[Item]) -> InlineKeyboardMarkup:
+# Сортировки списка товаров (ключи database.db.WATCHLIST_SORTS)
+WATCHLIST_SORT_TITLES = {
+    "new": "🆕 Новые",
+    "old": "📅 Старые",
+    "name": "🔤 Имя",
+    "price": "💰 Цена",
+}
+
+# Ограничение Telegram на callback_data (байты) и место под фильтр в нем:
+# "items_page:" + самая длинная сортировка + id до 10 цифр + ":"
+CALLBACK_DATA_LIMIT = 64
+WATCHLIST_SEARCH_LIMIT = CALLBACK_DATA_LIMIT - len("items_page:price:0000000000:")
+
+
+def trim_watchlist_search(search: str) -> str:
+    """Обрезать фильтр списка товаров, чтобы он поместился в callback_data"""
+    return search.encode()[:WATCHLIST_SEARCH_LIMIT].decode(errors="ignore")
+
+
+def watchlist_callback_data(sort: str = "new", after: Optional[int] = None, search: str = "") -> str:
+    """callback_data страницы списка товаров: items_page:<сортировка>:<после id>:<фильтр>"""
+    return f"items_page:{sort}:{after or ''}:{trim_watchlist_search(search)}"
+
+
+def get_tracked_items_keyboard(items: List[Item], sort: str = "new", next_after: Optional[int] = None,
+                               search: str = "", first_page: bool = True) -> InlineKeyboardMarkup:
     """
-    Клавиатура со списком отслеживаемых товаров
+    Клавиатура со страницей отслеживаемых товаров
     
-    Каждый товар имеет кнопку для удаления
+    Каждый товар - кнопка с карточкой товара. Ниже - переход по страницам
+    и выбор сортировки.
     """
     builder = InlineKeyboardBuilder()
     
@@ -74,6 +107,34 @@ def get_tracked_items_keyboard(items: List[Item]) -> InlineKeyboardMarkup:
                 )
             )
     
+    # Навигация по страницам (keyset: назад - только в начало)
+    navigation = []
+    if not first_page:
+        navigation.append(
+            InlineKeyboardButton(
+                text="⏮ В начало",
+                callback_data=watchlist_callback_data(sort, search=search)
+            )
+        )
+    if next_after is not None:
+        navigation.append(
+            InlineKeyboardButton(
+                text="Далее ▶️",
+                callback_data=watchlist_callback_data(sort, next_after, search)
+            )
+        )
+    if navigation:
+        builder.row(*navigation)
+    
+    # Сортировка
+    builder.row(*[
+        InlineKeyboardButton(
+            text=f"• {title}" if key == sort else title,
+            callback_data=watchlist_callback_data(key, search=search)
+        )
+        for key, title in WATCHLIST_SORT_TITLES.items()
+    ])
+    
     # Кнопка "Назад"
     builder.row(
         InlineKeyboardButton(
@@ -95,6 +156,18 @@ def get_item_actions_keyboard(item_id: int) -> InlineKeyboardMarkup:
             callback_data=f"refresh_price_{item_id}"
         )
     )
+    builder.row(
+        InlineKeyboardButton(
+            text="📈 График",
+            callback_data=f"chart_{item_id}_7"
+        )
+    )
+    builder.row(
+        InlineKeyboardButton(
+            text="💼 Позиция",
+            callback_data=f"holding_{item_id}"
+        )
+    )
     builder.row(
         InlineKeyboardButton(
             text="🗑 Удалить из отслеживания",
@@ -111,6 +184,41 @@ def get_item_actions_keyboard(item_id: int) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+def get_chart_keyboard(item_id: int, days: int) -> InlineKeyboardMarkup:
+    """Клавиатура графика: выбор периода и закрытие"""
+    builder = InlineKeyboardBuilder()
+    
+    builder.row(*[
+        InlineKeyboardButton(
+            text=f"• {title}" if period == days else title,
+            callback_data=f"chart_{item_id}_{period}"
+        )
+        for period, title in CHART_RANGES.items()
+    ])
+    builder.row(
+        InlineKeyboardButton(
+            text="❌ Закрыть",
+            callback_data="chart_close"
+        )
+    )
+    
+    return builder.as_markup()
+
+
+def get_track_keyboard(goods_id: int) -> InlineKeyboardMarkup:
+    """Кнопка отслеживания под inline-результатом"""
+    builder = InlineKeyboardBuilder()
+    
+    builder.row(
+        InlineKeyboardButton(
+            text="➕ Отслеживать",
+            callback_data=f"track_{goods_id}"
+        )
+    )
+    
+    return builder.as_markup()
+
+
 def get_confirm_delete_keyboard(item_id: int) -> InlineKeyboardMarkup:
     """Клавиатура подтверждения удаления товара"""
     builder = InlineKeyboardBuilder()
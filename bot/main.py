@@ -8,8 +8,12 @@ from aiogram.types import BotCommand
 
 from config import config
 from database.db import db
-from bot.handlers import router, check_user_access
+from bot.handlers import router
+from bot.access import AccessMiddleware, access_list
 from bot.scheduler import init_scheduler
+from bot.charts import chart_renderer
+from bot.webhook import run_webhook
+from bot.fsm_storage import create_fsm_storage
 from api.buff_api import buff_client
 
 # Настройка логирования
@@ -47,6 +51,8 @@ async def set_bot_commands(bot: Bot):
         BotCommand(command="start", description="🏠 Главное меню"),
         BotCommand(command="list", description="📋 Список отслеживаемых товаров"),
         BotCommand(command="now", description="💰 Актуальные цены"),
+        BotCommand(command="stats", description="📊 Статистика цены товара"),
+        BotCommand(command="portfolio", description="💼 Портфель"),
         BotCommand(command="help", description="ℹ️ Помощь"),
     ]
     
@@ -69,6 +75,7 @@ async def on_startup(bot: Bot, dp: Dispatcher):
     try:
         await db.init_db()
         logger.info("База данных инициализирована")
+        await access_list.init()
     except Exception as e:
         logger.error(f"Ошибка инициализации БД: {e}")
         sys.exit(1)
@@ -90,7 +97,7 @@ async def on_startup(bot: Bot, dp: Dispatcher):
     scheduler.start()
     
     # Уведомляем администраторов о запуске
-    for admin_id in config.ALLOWED_USER_IDS:
+    for admin_id in access_list.admins:
         try:
             await bot.send_message(
                 chat_id=admin_id,
@@ -117,6 +124,9 @@ async def on_shutdown(bot: Bot, dp: Dispatcher):
     if scheduler:
         scheduler.stop()
     
+    # Останавливаем процессы рендеринга графиков
+    chart_renderer.shutdown()
+    
     # Закрываем соединение с БД
     await db.close()
     
@@ -124,7 +134,7 @@ async def on_shutdown(bot: Bot, dp: Dispatcher):
     await buff_client.close()
     
     # Уведомляем администраторов об остановке
-    for admin_id in config.ALLOWED_USER_IDS:
+    for admin_id in access_list.admins:
         try:
             await bot.send_message(
                 chat_id=admin_id,
@@ -145,38 +155,11 @@ async def main():
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
     
-    # Создаем диспетчер
-    dp = Dispatcher()
-    
-    # Регистрируем middleware для проверки доступа
-    @dp.message.middleware()
-    async def access_control_middleware(handler, event, data):
-        """Middleware для проверки доступа пользователя"""
-        user_id = event.from_user.id
-        
-        # Пропускаем только разрешенных пользователей
-        if not await check_user_access(user_id):
-            await event.answer(
-                "❌ У вас нет доступа к этому боту.\n"
-                "Обратитесь к администратору для получения доступа."
-            )
-            return
-        
-        return await handler(event, data)
-    
-    @dp.callback_query.middleware()
-    async def callback_access_control_middleware(handler, event, data):
-        """Middleware для проверки доступа к callback запросам"""
-        user_id = event.from_user.id
-        
-        if not await check_user_access(user_id):
-            await event.answer(
-                "❌ У вас нет доступа к этому боту.",
-                show_alert=True
-            )
-            return
-        
-        return await handler(event, data)
+    # Создаем диспетчер (состояния диалогов - в общей БД, см. FSM_STORAGE)
+    dp = Dispatcher(storage=create_fsm_storage())
+    
+    # Проверка доступа - один раз на каждый update, до любых обработчиков
+    dp.update.outer_middleware(AccessMiddleware(access_list))
     
     # Регистрируем роутер с обработчиками
     dp.include_router(router)
@@ -191,10 +174,16 @@ async def main():
     dp.startup.register(startup_handler)
     dp.shutdown.register(shutdown_handler)
     
-    # Запускаем бота
+    # Запускаем бота: webhook, если задан WEBHOOK_BASE_URL, иначе polling
     try:
-        logger.info("Начинаю polling...")
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if config.WEBHOOK_BASE_URL:
+            logger.info("Запуск в режиме webhook...")
+            await run_webhook(bot, dp)
+        else:
+            logger.info("Начинаю polling...")
+            # getUpdates не работает, пока установлен webhook (например, после запуска в режиме webhook)
+            await bot.delete_webhook()
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     except KeyboardInterrupt:
         logger.info("Получен сигнал остановки")
     except Exception as e:
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from config import config
+from database.db import db
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxSender:
+    """Фоновая отправка уведомлений из очереди outbox"""
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+
+    async def drain(self):
+        """
+        Отправить все накопившиеся уведомления
+
+        Уведомления забираются пачками по OUTBOX_BATCH_SIZE и отмечаются
+        отправленными одним запросом на пачку. Ошибка отправки оставляет
+        запись в очереди: она будет повторена после окончания аренды.
+        """
+        total_sent = 0
+
+        while True:
+            batch = await db.claim_notifications(config.OUTBOX_BATCH_SIZE)
+            if not batch:
+                break
+
+            sent, dropped, released = [], [], []
+            retry_after = 0
+
+            for index, notification in enumerate(batch):
+                try:
+                    await self.bot.send_message(
+                        chat_id=notification.user_id,
+                        text=notification.text
+                    )
+                    sent.append(notification.id)
+                except TelegramRetryAfter as e:
+                    # Telegram просит подождать - возвращаем остаток пачки в очередь
+                    logger.warning(f"Превышен лимит Telegram, пауза {e.retry_after} с")
+                    retry_after = e.retry_after
+                    released = [n.id for n in batch[index:]]
+                    break
+                except (TelegramForbiddenError, TelegramBadRequest) as e:
+                    # Бот заблокирован или чат недоступен - повторять бессмысленно
+                    logger.warning(
+                        f"Уведомление {notification.id} пользователю {notification.user_id} "
+                        f"не будет доставлено: {e}"
+                    )
+                    dropped.append(notification.id)
+                except Exception as e:
+                    logger.error(
+                        f"Ошибка при отправке уведомления пользователю "
+                        f"{notification.user_id}: {e}"
+                    )
+
+            await db.mark_notifications_sent(sent)
+            await db.drop_notifications(dropped)
+            await db.release_notifications(released)
+            total_sent += len(sent)
+
+            if retry_after:
+                await asyncio.sleep(retry_after)
+            elif len(batch) < config.OUTBOX_BATCH_SIZE:
+                break
+
+        if total_sent:
+            logger.info(f"Отправлено уведомлений: {total_sent}")
@@ -1,15 +1,58 @@
 import logging
+import time
 from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from aiogram import Bot
 
 from config import config
 from database.db import db
+from database.archive import price_archive
+from database.models import Item
 from api.buff_api import buff_client
+from api.request_scheduler import Priority
 from api.currency_converter import currency_converter
+from bot.access import access_list
+from bot.fair_queue import FairQueue
+from bot.outbox import OutboxSender
 
 logger = logging.getLogger(__name__)
 
+# Как часто во время проверки добавлять в очередь пользователей, которым подошло время (секунды)
+ADMIT_INTERVAL_SECONDS = 30
+
+
+class SweepBuffer:
+    """Результаты проверки цен, накопленные для пакетной записи в БД"""
+    
+    def __init__(self):
+        # Ответы Buff за текущую проверку: goods_id -> price_data (товар общий для пользователей)
+        self.fetched: Dict[int, Optional[Dict[str, Any]]] = {}
+        # Еще не сохраненные цены: item_id -> цена
+        self.prices: Dict[int, float] = {}
+        self.notifications: List[Dict[str, Any]] = []
+        self.checked_user_ids: List[int] = []
+        self.flushed_at = time.monotonic()
+    
+    def __len__(self) -> int:
+        return len(self.prices) + len(self.notifications) + len(self.checked_user_ids)
+    
+    def should_flush(self) -> bool:
+        """Пора ли записать накопленное: по размеру пачки или по времени"""
+        if not len(self):
+            return False
+        return (
+            len(self) >= config.PRICE_BATCH_SIZE
+            or time.monotonic() - self.flushed_at >= config.PRICE_FLUSH_SECONDS
+        )
+    
+    def clear(self):
+        """Очистить сохраненные результаты (кеш ответов Buff сохраняется до конца проверки)"""
+        self.prices = {}
+        self.notifications = []
+        self.checked_user_ids = []
+        self.flushed_at = time.monotonic()
+
 
 class PriceScheduler:
     """Планировщик для проверки цен"""
@@ -17,138 +60,213 @@ class PriceScheduler:
     def __init__(self, bot: Bot):
         self.bot = bot
         self.scheduler = AsyncIOScheduler()
+        self.outbox = OutboxSender(bot)
         self.is_running = False
     
     async def check_prices(self):
-        """Проверить цены для пользователей, которым пора проверять"""
+        """
+        Проверить цены для пользователей, которым пора проверять
+        
+        Проверка идет до тех пор, пока в справедливой очереди есть товары.
+        Не реже раза в ADMIT_INTERVAL_SECONDS в очередь добавляются
+        пользователи, которым подошло время проверки уже после начала
+        прохода. Поэтому длинный список одного пользователя не откладывает
+        проверку остальных до своего конца (тики планировщика во время
+        прохода пропускаются).
+        """
         logger.info("Начинаю проверку цен...")
         
         try:
-            # Получаем пользователей, которым пора проверять цены
-            users_to_check = await db.get_users_to_check()
+            queue = FairQueue(quantum=config.FAIR_QUANTUM, weights=config.USER_WEIGHTS)
+            # Пользователи, попавшие в очередь за этот проход (время проверки
+            # пишется пачками, до записи они снова выглядят "пора проверять")
+            admitted: Set[int] = set()
+            await self._admit_due_users(queue, admitted)
             
-            if not users_to_check:
+            if not admitted:
                 logger.debug("Нет пользователей для проверки в данный момент")
                 return
             
-            logger.info(f"Проверяю цены для {len(users_to_check)} пользователей...")
+            # Результаты пишутся в БД пачками: история, цены, уведомления
+            # и время последней проверки - одной транзакцией на пачку
+            buffer = SweepBuffer()
+            admitted_at = time.monotonic()
             
-            # Для каждого пользователя проверяем его товары
-            for user in users_to_check:
-                try:
-                    logger.info(f"Проверяю товары пользователя {user.user_id} ({len(user.items)} товаров)")
-                    
-                    # Собираем уникальные товары для этого пользователя
-                    items_to_check = user.items
-                    
-                    for item in items_to_check:
-                        try:
-                            # Получаем актуальную цену
-                            price_data = await buff_client.get_item_price(item.goods_id)
-                            
-                            if not price_data:
-                                logger.warning(
-                                    f"Не удалось получить цену для товара {item.goods_id}"
-                                )
-                                continue
-                            
-                            current_price = price_data["min_price"]
-                            prices = price_data.get("prices", {})
-                            old_price = item.last_price
-                            
-                            # Добавляем запись в историю
-                            await db.add_price_history(item.id, current_price)
-                            
-                            # Проверяем, изменилась ли цена
-                            if old_price is None:
-                                # Первая проверка цены - просто сохраняем
-                                await db.update_item_price(item.id, current_price)
-                                logger.info(
-                                    f"Установлена начальная цена {current_price} "
-                                    f"для товара {item.goods_id}"
-                                )
-                            elif current_price != old_price:
-                                # Цена изменилась - отправляем уведомление
-                                diff = current_price - old_price
-                                percent = (diff / old_price) * 100
-                                
-                                # Обновляем цену в БД
-                                await db.update_item_price(item.id, current_price)
-                                
-                                # Формируем сообщение
-                                if diff > 0:
-                                    emoji = "📈"
-                                    change_text = f"+{diff:.2f} CNY (+{percent:.1f}%)"
-                                else:
-                                    emoji = "📉"
-                                    change_text = f"{diff:.2f} CNY ({percent:.1f}%)"
-                                
-                                # Форматируем цены
-                                price_text = currency_converter.format_price(prices) if prices else f"💵 {current_price:.2f} CNY"
-                                old_prices = await currency_converter.convert(old_price) if old_price else {}
-                                old_price_text = currency_converter.format_price(old_prices) if old_prices else f"💵 {old_price:.2f} CNY"
-                                
-                                message = (
-                                    f"{emoji} <b>Изменение цены!</b>\n\n"
-                                    f"📦 {item.market_hash_name}\n"
-                                    f"🔗 goods_id: {item.goods_id}\n\n"
-                                    f"💰 <b>Новая цена:</b>\n{price_text}\n\n"
-                                    f"💾 <b>Старая цена:</b>\n{old_price_text}\n\n"
-                                    f"📊 Изменение: {change_text}\n\n"
-                                    f"🕒 {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}"
-                                )
-                                
-                                # Отправляем уведомление пользователю
-                                try:
-                                    await self.bot.send_message(
-                                        chat_id=user.user_id,
-                                        text=message
-                                    )
-                                    logger.info(
-                                        f"Отправлено уведомление пользователю {user.user_id} "
-                                        f"о товаре {item.goods_id}"
-                                    )
-                                except Exception as e:
-                                    logger.error(
-                                        f"Ошибка при отправке уведомления пользователю "
-                                        f"{user.user_id}: {e}"
-                                    )
-                            else:
-                                logger.debug(
-                                    f"Цена товара {item.goods_id} не изменилась: "
-                                    f"{current_price}"
-                                )
-                        
-                        except Exception as e:
-                            logger.error(
-                                f"Ошибка при проверке товара {item.goods_id}: {e}"
-                            )
-                            continue
-                    
-                    # Обновляем время последней проверки для пользователя
-                    await db.update_user_last_check(user.user_id)
-                    logger.info(f"Проверка для пользователя {user.user_id} завершена")
+            for user_id, item, is_last in queue:
+                await self._check_item(user_id, item, buffer)
+                
+                if is_last:
+                    # Очередь пользователя обработана - обновляем время последней проверки
+                    buffer.checked_user_ids.append(user_id)
+                    logger.info(f"Проверка для пользователя {user_id} завершена")
+                
+                if buffer.should_flush():
+                    await self._flush(buffer)
                 
-                except Exception as e:
-                    logger.error(
-                        f"Ошибка при проверке цен для пользователя {user.user_id}: {e}"
-                    )
-                    continue
+                if time.monotonic() - admitted_at >= ADMIT_INTERVAL_SECONDS:
+                    # Новые пользователи встают в очередь со следующего раунда
+                    await self._admit_due_users(queue, admitted)
+                    admitted_at = time.monotonic()
             
+            await self._flush(buffer)
             logger.info("Проверка цен завершена")
         
         except Exception as e:
             logger.error(f"Ошибка при проверке цен: {e}")
     
+    async def _admit_due_users(self, queue: FairQueue, admitted: Set[int]):
+        """Добавить в очередь товары пользователей, которым пора проверять (кроме уже добавленных)"""
+        # Получаем пользователей, которым пора проверять цены, и их товары (одна сессия)
+        async with db.unit_of_work():
+            users_to_check = [user for user in await db.get_users_to_check() if user.user_id not in admitted]
+            if not users_to_check:
+                return
+            items_by_user = await db.get_items_for_users([user.user_id for user in users_to_check])
+        
+        logger.info(f"Проверяю цены для {len(users_to_check)} пользователей...")
+        
+        # Раскладываем товары по очередям пользователей: запросы к Buff
+        # распределяются между пользователями по весам (Deficit Round Robin),
+        # поэтому большой список одного пользователя не задерживает остальных
+        for user_id, items in items_by_user.items():
+            logger.info(f"Проверяю товары пользователя {user_id} ({len(items)} товаров)")
+            queue.push(user_id, items)
+            admitted.add(user_id)
+    
+    async def _flush(self, buffer: SweepBuffer):
+        """Записать накопленные результаты проверки одной транзакцией"""
+        if not len(buffer):
+            return
+        
+        try:
+            await db.save_price_batch(
+                buffer.prices,
+                notifications=buffer.notifications,
+                checked_user_ids=buffer.checked_user_ids
+            )
+            logger.info(
+                f"Сохранено цен: {len(buffer.prices)}, "
+                f"уведомлений в очереди: {len(buffer.notifications)}"
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении результатов проверки: {e}")
+        finally:
+            buffer.clear()
+    
+    async def _check_item(self, user_id: int, item: Item, buffer: SweepBuffer):
+        """Проверить цену одного товара пользователя и подготовить уведомление"""
+        try:
+            # Получаем актуальную цену (один запрос к Buff на товар за проверку)
+            if item.goods_id in buffer.fetched:
+                price_data = buffer.fetched[item.goods_id]
+            else:
+                price_data = await buff_client.get_item_price(item.goods_id, priority=Priority.SCHEDULED)
+                buffer.fetched[item.goods_id] = price_data
+                if price_data:
+                    buffer.prices[item.id] = price_data["min_price"]
+            
+            if not price_data:
+                logger.warning(
+                    f"Не удалось получить цену для товара {item.goods_id}"
+                )
+                return
+            
+            current_price = price_data["min_price"]
+            prices = price_data.get("prices", {})
+            old_price = item.last_price
+            
+            # Проверяем, изменилась ли цена
+            if old_price is None:
+                # Первая проверка цены - просто сохраняем
+                logger.info(
+                    f"Установлена начальная цена {current_price} "
+                    f"для товара {item.goods_id}"
+                )
+            elif current_price != old_price:
+                # Цена изменилась - ставим уведомление в очередь
+                diff = current_price - old_price
+                percent = (diff / old_price) * 100
+                
+                # Формируем сообщение
+                if diff > 0:
+                    emoji = "📈"
+                    change_text = f"+{diff:.2f} CNY (+{percent:.1f}%)"
+                else:
+                    emoji = "📉"
+                    change_text = f"{diff:.2f} CNY ({percent:.1f}%)"
+                
+                # Форматируем цены
+                price_text = currency_converter.format_price(prices) if prices else f"💵 {current_price:.2f} CNY"
+                old_prices = await currency_converter.convert(old_price) if old_price else {}
+                old_price_text = currency_converter.format_price(old_prices) if old_prices else f"💵 {old_price:.2f} CNY"
+                
+                message = (
+                    f"{emoji} <b>Изменение цены!</b>\n\n"
+                    f"📦 {item.market_hash_name}\n"
+                    f"🔗 goods_id: {item.goods_id}\n\n"
+                    f"💰 <b>Новая цена:</b>\n{price_text}\n\n"
+                    f"💾 <b>Старая цена:</b>\n{old_price_text}\n\n"
+                    f"📊 Изменение: {change_text}\n\n"
+                    f"🕒 {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}"
+                )
+                
+                # Ключ идемпотентности: одно и то же изменение цены (от одного
+                # и того же известного состояния товара) ставится в очередь один раз
+                buffer.notifications.append({
+                    "user_id": user_id,
+                    "idempotency_key": (
+                        f"price:{user_id}:{item.id}:{old_price}:{current_price}:"
+                        f"{item.updated_at.isoformat() if item.updated_at else ''}"
+                    ),
+                    "text": message
+                })
+                logger.info(
+                    f"Подготовлено уведомление пользователю {user_id} "
+                    f"о товаре {item.goods_id}"
+                )
+            else:
+                logger.debug(
+                    f"Цена товара {item.goods_id} не изменилась: "
+                    f"{current_price}"
+                )
+        
+        except Exception as e:
+            logger.error(
+                f"Ошибка при проверке товара {item.goods_id}: {e}"
+            )
+    
     async def cleanup_old_history(self):
-        """Очистить старую историю цен (старше 7 дней)"""
+        """Очистить устаревшую историю цен (сырые записи и агрегаты по уровням хранения)"""
         logger.info("Очистка старой истории цен...")
         try:
-            await db.cleanup_old_price_history(days=7)
-            logger.info("Старая история цен очищена")
+            finished = await db.cleanup_old_price_history()
+            if finished:
+                logger.info("Старая история цен очищена")
+            await db.cleanup_sent_notifications(days=7)
         except Exception as e:
             logger.error(f"Ошибка при очистке истории: {e}")
     
+    async def cleanup_fsm_states(self):
+        """Удалить брошенные диалоги из хранилища FSM"""
+        try:
+            await db.cleanup_fsm_states()
+        except Exception as e:
+            logger.error(f"Ошибка при очистке состояний диалогов: {e}")
+    
+    async def archive_history(self):
+        """Выгрузить новую историю цен в колоночный архив"""
+        try:
+            await db.archive_price_history(price_archive)
+        except Exception as e:
+            logger.error(f"Ошибка при выгрузке истории цен в архив: {e}")
+    
+    async def reconcile_portfolios(self):
+        """Сверить инкрементальные итоги портфелей с позициями"""
+        try:
+            await db.reconcile_portfolios()
+        except Exception as e:
+            logger.error(f"Ошибка при пересчете портфелей: {e}")
+    
     async def update_currency_rates(self):
         """Обновить курсы валют"""
         logger.info("Плановое обновление курсов валют...")
@@ -161,42 +279,141 @@ class PriceScheduler:
         except Exception as e:
             logger.error(f"Ошибка при обновлении курсов валют: {e}")
     
+    async def drain_outbox(self):
+        """Отправить уведомления из очереди outbox"""
+        try:
+            await self.outbox.drain()
+        except Exception as e:
+            logger.error(f"Ошибка при отправке уведомлений из очереди: {e}")
+    
+    async def log_buff_latency(self):
+        """Записать в лог задержки запросов к Buff по полосам приоритета"""
+        buff_client.scheduler.log_stats()
+    
+    async def refresh_access_list(self):
+        """Перечитать список доступа (изменения, сделанные другими экземплярами бота)"""
+        try:
+            await access_list.load()
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении списка доступа: {e}")
+    
+    async def log_cache_stats(self):
+        """Записать в лог долю попаданий в кеш БД"""
+        db.log_cache_stats()
+    
     def start(self):
         """Запустить планировщик"""
         if self.is_running:
             logger.warning("Планировщик уже запущен")
             return
         
-        # Добавляем задачу проверки цен (проверяем каждую минуту, кому пора проверять)
+        # Задачи над общей БД (проверка цен, очистка, архив, сверка портфелей):
+        # при нескольких экземплярах бота - только в одном (SCHEDULER_ENABLED)
+        if config.SCHEDULER_ENABLED:
+            # Добавляем задачу проверки цен (проверяем каждую минуту, кому пора проверять)
+            self.scheduler.add_job(
+                self.check_prices,
+                trigger="interval",
+                minutes=1,  # Проверяем каждую минуту, но проверяем только тех, кому пора
+                id="check_prices",
+                name="Проверка цен товаров",
+                replace_existing=True
+            )
+            
+            # Добавляем задачу очистки истории (каждые 30 минут небольшими пачками
+            # в пределах бюджета времени, долгосрочные тренды сохраняются в агрегатах)
+            self.scheduler.add_job(
+                self.cleanup_old_history,
+                trigger="interval",
+                minutes=30,
+                id="cleanup_history",
+                name="Очистка старой истории цен",
+                replace_existing=True
+            )
+            
+            # Добавляем задачу очистки брошенных диалогов (каждый час)
+            self.scheduler.add_job(
+                self.cleanup_fsm_states,
+                trigger="interval",
+                hours=1,
+                id="cleanup_fsm_states",
+                name="Очистка брошенных диалогов",
+                replace_existing=True
+            )
+            
+            # Добавляем задачу выгрузки истории в архив (каждый час, сырые записи
+            # хранятся в БД RAW_HISTORY_DAYS дней - архив успевает их забрать)
+            if price_archive is not None:
+                self.scheduler.add_job(
+                    self.archive_history,
+                    trigger="interval",
+                    hours=1,
+                    id="archive_history",
+                    name="Выгрузка истории цен в архив",
+                    replace_existing=True
+                )
+            
+            # Добавляем задачу сверки итогов портфелей (каждый день в 00:30)
+            self.scheduler.add_job(
+                self.reconcile_portfolios,
+                trigger="cron",
+                hour=0,
+                minute=30,
+                id="reconcile_portfolios",
+                name="Сверка итогов портфелей",
+                replace_existing=True
+            )
+        else:
+            logger.info("Задачи над общей БД отключены (SCHEDULER_ENABLED=false)")
+        
+        # Добавляем задачу обновления курсов валют (каждый день в 00:00)
+        self.scheduler.add_job(
+            self.update_currency_rates,
+            trigger="cron",
+            hour=0,
+            minute=0,
+            id="update_currency",
+            name="Обновление курсов валют",
+            replace_existing=True
+        )
+        
+        # Добавляем задачу отправки уведомлений из очереди outbox
         self.scheduler.add_job(
-            self.check_prices,
+            self.drain_outbox,
             trigger="interval",
-            minutes=1,  # Проверяем каждую минуту, но проверяем только тех, кому пора
-            id="check_prices",
-            name="Проверка цен товаров",
+            seconds=config.OUTBOX_DRAIN_INTERVAL,
+            id="drain_outbox",
+            name="Отправка уведомлений",
             replace_existing=True
         )
         
-        # Добавляем задачу очистки истории (раз в неделю по воскресеньям в 3:00)
+        # Добавляем задачу контроля задержек запросов к Buff (каждые 15 минут)
         self.scheduler.add_job(
-            self.cleanup_old_history,
-            trigger="cron",
-            day_of_week="sun",
-            hour=3,
-            minute=0,
-            id="cleanup_history",
-            name="Очистка старой истории цен",
+            self.log_buff_latency,
+            trigger="interval",
+            minutes=15,
+            id="log_buff_latency",
+            name="Статистика задержек Buff",
             replace_existing=True
         )
         
-        # Добавляем задачу обновления курсов валют (каждый день в 00:00)
+        # Добавляем задачу обновления списка доступа (каждую минуту)
         self.scheduler.add_job(
-            self.update_currency_rates,
-            trigger="cron",
-            hour=0,
-            minute=0,
-            id="update_currency",
-            name="Обновление курсов валют",
+            self.refresh_access_list,
+            trigger="interval",
+            minutes=1,
+            id="refresh_access_list",
+            name="Обновление списка доступа",
+            replace_existing=True
+        )
+        
+        # Добавляем задачу контроля кеша БД (каждые 15 минут)
+        self.scheduler.add_job(
+            self.log_cache_stats,
+            trigger="interval",
+            minutes=15,
+            id="log_cache_stats",
+            name="Статистика кеша БД",
             replace_existing=True
         )
         
@@ -215,6 +432,17 @@ class PriceScheduler:
         logger.info("Планировщик остановлен")
 
 
+# Глобальный планировщик (создается при запуске бота)
+_scheduler: Optional[PriceScheduler] = None
+
+
 def init_scheduler(bot: Bot) -> PriceScheduler:
     """Инициализировать планировщик"""
-    return PriceScheduler(bot)
+    global _scheduler
+    _scheduler = PriceScheduler(bot)
+    return _scheduler
+
+
+def get_scheduler() -> Optional[PriceScheduler]:
+    """Текущий планировщик (None, если бот еще не запущен)"""
+    return _scheduler
@@ -0,0 +1,233 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from config import config
+from database.archive import PriceArchive, price_archive
+from database.db import db, PriceColumns, RollupColumns, ROLLUP_DAY, ROLLUP_HOUR
+
+# Окна статистики: подпись и длительность
+STATS_WINDOWS = (
+    ("24ч", timedelta(days=1)),
+    ("7д", timedelta(days=7)),
+    ("30д", timedelta(days=30)),
+)
+
+# Глубина истории для статистики (самое длинное окно), дни
+STATS_DAYS = max(window for _, window in STATS_WINDOWS).days
+
+# Длительность периода агрегатов в микросекундах
+BUCKET_MICROS = {ROLLUP_HOUR: 3600 * 10**6, ROLLUP_DAY: 86400 * 10**6}
+
+
+class WindowStats(NamedTuple):
+    """Статистика цены за окно (change и volatility - в процентах)"""
+    label: str
+    samples: int
+    min: float
+    max: float
+    mean: float
+    median: float
+    std: float
+    change: float
+    volatility: float
+
+
+def window_resolution(window: timedelta) -> Optional[str]:
+    """
+    Источник данных для окна: None - сырая история, иначе уровень агрегатов
+
+    Сырая история хранится RAW_HISTORY_DAYS, агрегаты по часам -
+    HOURLY_ROLLUP_DAYS: более длинное окно по сырой истории было бы
+    неполным.
+    """
+    if window <= timedelta(days=config.RAW_HISTORY_DAYS):
+        return None
+    if window <= timedelta(days=config.HOURLY_ROLLUP_DAYS):
+        return ROLLUP_HOUR
+    return ROLLUP_DAY
+
+
+def _realized_volatility(prices: np.ndarray) -> float:
+    """Корень из суммы квадратов логарифмических доходностей между соседними ценами, %"""
+    returns = np.diff(np.log(prices[prices > 0]))
+    return float(np.sqrt(np.square(returns).sum()) * 100)
+
+
+def compute_window_stats(label: str, prices: np.ndarray) -> Optional[WindowStats]:
+    """
+    Статистика по ценам окна (в хронологическом порядке)
+
+    Реализованная волатильность - корень из суммы квадратов
+    логарифмических доходностей между соседними наблюдениями.
+    """
+    if not len(prices):
+        return None
+
+    first, last = prices[0], prices[-1]
+    return WindowStats(
+        label=label,
+        samples=len(prices),
+        min=float(prices.min()),
+        max=float(prices.max()),
+        mean=float(prices.mean()),
+        median=float(np.median(prices)),
+        std=float(prices.std()),
+        change=float((last - first) / first * 100) if first else 0.0,
+        volatility=_realized_volatility(prices),
+    )
+
+
+def compute_rollup_window_stats(label: str, rollups: RollupColumns) -> Optional[WindowStats]:
+    """
+    Статистика окна по агрегатам (в хронологическом порядке)
+
+    Минимум, максимум, среднее и число наблюдений точные. Медиана и σ
+    считаются по средним ценам периодов с весом по числу наблюдений,
+    волатильность - по ценам закрытия периодов.
+    """
+    counts = rollups.counts
+    if not counts.sum():
+        return None
+
+    averages = rollups.sums / np.maximum(counts, 1)
+    mean = rollups.sums.sum() / counts.sum()
+
+    # Взвешенная медиана: первое среднее, на котором накопленный вес достигает половины
+    order = np.argsort(averages)
+    cumulative = np.cumsum(counts[order])
+    median = averages[order][np.searchsorted(cumulative, cumulative[-1] / 2)]
+
+    first, last = rollups.opens[0], rollups.closes[-1]
+    return WindowStats(
+        label=label,
+        samples=int(counts.sum()),
+        min=float(rollups.lows.min()),
+        max=float(rollups.highs.max()),
+        mean=float(mean),
+        median=float(median),
+        std=float(np.sqrt(np.average(np.square(averages - mean), weights=counts))),
+        change=float((last - first) / first * 100) if first else 0.0,
+        volatility=_realized_volatility(rollups.closes),
+    )
+
+
+def _slice_rollups(rollups: RollupColumns, start: int) -> RollupColumns:
+    """Агрегаты начиная с индекса start (срезы без копирования)"""
+    return RollupColumns(*(column[start:] for column in rollups))
+
+
+def archived_history(archive: PriceArchive, item_id: int, columns: PriceColumns, raw_since: datetime,
+                     rollups: Dict[str, RollupColumns], now: datetime) -> Optional[PriceColumns]:
+    """
+    Полная история товара за STATS_DAYS: архив до водяной метки и сырая история после нее
+
+    columns - сырая история с момента raw_since. None, если архив не
+    покрывает окно: выгрузки еще не было, метка старше raw_since или архив
+    начинается позже агрегатов (товар отслеживался до включения архива).
+    Файлы читаются через mmap, в память копируются только столбцы окна.
+    """
+    watermark = archive.watermark
+    if watermark is None or watermark < raw_since:
+        return None
+    watermark_us = np.datetime64(watermark, "us").astype(np.int64)
+
+    with archive.read(item_id, now - timedelta(days=STATS_DAYS), watermark) as series:
+        timestamps = np.frombuffer(series.timestamps, dtype=np.int64).copy()
+        prices = np.frombuffer(series.prices, dtype=np.float64).copy()
+
+    resolution = window_resolution(timedelta(days=STATS_DAYS))
+    buckets = rollups.get(resolution)
+    if buckets is not None and len(buckets.bucket_starts):
+        if not len(timestamps) or timestamps[0] >= buckets.bucket_starts[0] + BUCKET_MICROS[resolution]:
+            return None
+
+    start = np.searchsorted(columns.timestamps, watermark_us, side="right")
+    return PriceColumns(
+        np.concatenate([timestamps, columns.timestamps[start:]]),
+        np.concatenate([prices, columns.prices[start:]]),
+    )
+
+
+def compute_price_stats(columns: PriceColumns, rollups: Optional[Dict[str, RollupColumns]] = None,
+                        now: Optional[datetime] = None,
+                        history: Optional[PriceColumns] = None) -> List[WindowStats]:
+    """
+    Статистика по всем окнам STATS_WINDOWS
+
+    columns - сырая история. Окна длиннее RAW_HISTORY_DAYS считаются по
+    history (полная история из архива, см. archived_history), а без нее -
+    по агрегатам rollups соответствующего уровня (см. window_resolution).
+    Время отсортировано, поэтому начало окна находится бинарным поиском,
+    а окно - срез массива без копирования.
+    """
+    now = now or datetime.utcnow()
+    rollups = rollups or {}
+    stats = []
+    for label, window in STATS_WINDOWS:
+        cutoff = np.datetime64(now - window, "us").astype(np.int64)
+        resolution = window_resolution(window)
+        if resolution is None:
+            start = np.searchsorted(columns.timestamps, cutoff)
+            window_stats = compute_window_stats(label, columns.prices[start:])
+        elif history is not None:
+            start = np.searchsorted(history.timestamps, cutoff)
+            window_stats = compute_window_stats(label, history.prices[start:])
+        elif resolution in rollups:
+            start = np.searchsorted(rollups[resolution].bucket_starts, cutoff)
+            window_stats = compute_rollup_window_stats(label, _slice_rollups(rollups[resolution], start))
+        else:
+            window_stats = None
+        if window_stats is not None:
+            stats.append(window_stats)
+    return stats
+
+
+async def load_price_stats(item_id: int) -> List[WindowStats]:
+    """
+    Загрузить историю, нужную окнам, и посчитать статистику
+
+    Длинные окна считаются по архиву (ARCHIVE_DIR), если он покрывает
+    окно, иначе - по агрегатам из БД.
+    """
+    now = datetime.utcnow()
+    windows = [window for _, window in STATS_WINDOWS]
+    raw_days = max((window.days for window in windows if window_resolution(window) is None), default=0)
+    columns = await db.get_price_columns(item_id, raw_days)
+    raw_since = now - timedelta(days=raw_days)
+
+    rollups: Dict[str, RollupColumns] = {}
+    for resolution in {window_resolution(window) for window in windows} - {None}:
+        rollups[resolution] = await db.get_rollup_columns(item_id, STATS_DAYS, resolution)
+
+    history = None
+    if rollups and price_archive is not None:
+        history = await asyncio.to_thread(archived_history, price_archive, item_id, columns, raw_since, rollups, now)
+
+    return compute_price_stats(columns, rollups, now, history)
+
+
+def format_stats_line(stats: WindowStats) -> str:
+    """Краткая строка статистики для карточки товара"""
+    sign = "+" if stats.change > 0 else ""
+    return (
+        f"{stats.label}: {stats.min:.2f}–{stats.max:.2f}, "
+        f"ср. {stats.mean:.2f}, {sign}{stats.change:.1f}%"
+    )
+
+
+def format_stats(stats: List[WindowStats]) -> str:
+    """Подробная статистика для /stats"""
+    blocks = []
+    for window in stats:
+        sign = "+" if window.change > 0 else ""
+        blocks.append(
+            f"<b>{window.label}</b> ({window.samples} наблюдений)\n"
+            f"📉 Мин: {window.min:.2f} / 📈 Макс: {window.max:.2f}\n"
+            f"➗ Среднее: {window.mean:.2f} / Медиана: {window.median:.2f}\n"
+            f"σ: {window.std:.2f} / Волатильность: {window.volatility:.1f}%\n"
+            f"🔀 Изменение: {sign}{window.change:.1f}%"
+        )
+    return "\n\n".join(blocks)
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from aiogram.types import InlineKeyboardMarkup, Message
+
+logger = logging.getLogger(__name__)
+
+# Ограничение Telegram на длину текста сообщения
+MESSAGE_LIMIT = 4096
+
+
+class StreamingMessage:
+    """
+    Сообщение, которое дополняется по мере поступления результатов
+
+    Блоки текста дописываются в сообщение через edit_text не чаще одного
+    раза в min_interval секунд (последние изменения дописываются отложенной
+    правкой). Если очередной блок не помещается в лимит Telegram, текущее
+    сообщение фиксируется и продолжение отправляется новым сообщением.
+    Блоки не разрезаются, поэтому HTML-разметка внутри блока не ломается.
+    """
+
+    def __init__(self, message: Message, header: str,
+                 reply_markup: Optional[InlineKeyboardMarkup] = None,
+                 min_interval: float = 1.0, limit: int = MESSAGE_LIMIT):
+        self.message = message
+        self.reply_markup = reply_markup
+        self.min_interval = min_interval
+        self.limit = limit
+
+        self._text = header
+        self._footer = ""
+        self._shown: Optional[str] = None
+        self._last_edit = 0.0
+        self._lock = asyncio.Lock()
+        self._pending: Optional[asyncio.Task] = None
+        self.messages: List[Message] = [message]
+
+    async def append(self, block: str, footer: str = ""):
+        """Дописать блок (footer - строка состояния в конце, например прогресс)"""
+        async with self._lock:
+            self._footer = footer
+
+            if len(self._text) + len(block) + len(footer) > self.limit:
+                # Текущее сообщение заполнено - фиксируем его и продолжаем в новом
+                self._footer = ""
+                await self._edit()
+                self.message = await self.message.answer(block + footer)
+                self.messages.append(self.message)
+                self._text = block
+                self._footer = footer
+                self._shown = self._render()
+                self._last_edit = time.monotonic()
+                return
+
+            self._text += block
+
+        await self._schedule()
+
+    async def finish(self, footer: str = ""):
+        """Показать итоговый текст и клавиатуру"""
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+
+        async with self._lock:
+            self._footer = footer
+            await self._edit(self.reply_markup)
+
+    def _render(self) -> str:
+        return self._text + self._footer
+
+    async def _schedule(self):
+        """Обновить сообщение сейчас или отложить правку до конца интервала"""
+        delay = self._last_edit + self.min_interval - time.monotonic()
+        if delay <= 0:
+            async with self._lock:
+                await self._edit()
+        elif self._pending is None:
+            self._pending = asyncio.create_task(self._delayed_edit(delay))
+
+    async def _delayed_edit(self, delay: float):
+        await asyncio.sleep(delay)
+        async with self._lock:
+            self._pending = None
+            await self._edit()
+
+    async def _edit(self, reply_markup: Optional[InlineKeyboardMarkup] = None):
+        """Заменить текст текущего сообщения (вызывается под блокировкой)"""
+        text = self._render()
+        if text == self._shown and reply_markup is None:
+            return
+
+        try:
+            await self.message.edit_text(text, reply_markup=reply_markup)
+            self._shown = text
+        except Exception as e:
+            # "message is not modified" и временные ошибки не прерывают вывод
+            if "message is not modified" not in str(e):
+                logger.warning(f"Не удалось обновить сообщение: {e}")
+        finally:
+            self._last_edit = time.monotonic()
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import signal
+from typing import Any, Dict
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramAPIError
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import config
+from database.db import db
+
+logger = logging.getLogger(__name__)
+
+# Маршрут проверки работоспособности (для балансировщика и Docker)
+HEALTHCHECK_PATH = "/healthz"
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """
+    Прием update от Telegram с ограничением одновременной обработки
+
+    Update обрабатывается в фоне, Telegram сразу получает ответ 200. Когда
+    обрабатывается уже WEBHOOK_CONCURRENCY update, ответ на следующий запрос
+    откладывается до освобождения места - Telegram не отправляет новые
+    update, пока не получит ответ (не больше WEBHOOK_MAX_CONNECTIONS
+    запросов одновременно), поэтому очередь задач в памяти не растет.
+    Секрет из заголовка X-Telegram-Bot-Api-Secret-Token проверяет
+    SimpleRequestHandler (401 при несовпадении).
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str, concurrency: int, **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self._slots = asyncio.Semaphore(concurrency)
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        try:
+            await super()._background_feed_update(bot, update)
+        except Exception as e:
+            logger.error(f"Ошибка обработки update {update.get('update_id')}: {e}")
+        finally:
+            self._slots.release()
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        await self._slots.acquire()
+        try:
+            return await super()._handle_request_background(bot, request)
+        except BaseException:
+            # Задача не создана (например, тело запроса - не JSON)
+            self._slots.release()
+            raise
+
+
+async def healthcheck(request: web.Request) -> web.Response:
+    """Бот принимает запросы и БД отвечает"""
+    try:
+        await db.ping()
+    except Exception as e:
+        logger.warning(f"Проверка работоспособности: БД недоступна: {e}")
+        return web.json_response({"status": "error", "database": "unavailable"}, status=503)
+    return web.json_response({"status": "ok"})
+
+
+def create_app(bot: Bot, dp: Dispatcher) -> web.Application:
+    """HTTP-приложение: прием update по WEBHOOK_PATH и /healthz"""
+    app = web.Application()
+    app.router.add_get(HEALTHCHECK_PATH, healthcheck)
+
+    # Startup/shutdown диспетчера выполняются при запуске и остановке приложения.
+    # Обработчик регистрируется после них, чтобы сессия бота закрывалась последней
+    setup_application(app, dp, bot=bot)
+    LimitedRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=config.WEBHOOK_SECRET,
+        concurrency=config.WEBHOOK_CONCURRENCY
+    ).register(app, path=config.WEBHOOK_PATH)
+    return app
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """
+    Запуск бота в режиме webhook
+
+    Поднимает HTTP-сервер на WEBHOOK_HOST:WEBHOOK_PORT, после запуска
+    регистрирует webhook в Telegram и работает до SIGINT/SIGTERM.
+    Несколько экземпляров за балансировщиком регистрируют один и тот же
+    адрес, поэтому при остановке webhook не удаляется.
+    """
+    app = create_app(bot, dp)
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: остановка через KeyboardInterrupt
+            pass
+
+    try:
+        site = web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+        await site.start()
+        logger.info(f"HTTP-сервер запущен на {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}")
+
+        try:
+            await bot.set_webhook(
+                url=config.WEBHOOK_BASE_URL + config.WEBHOOK_PATH,
+                secret_token=config.WEBHOOK_SECRET,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS
+            )
+            logger.info(f"Webhook установлен: {config.WEBHOOK_BASE_URL}{config.WEBHOOK_PATH}")
+        except TelegramAPIError as e:
+            # Сервер продолжает принимать update (webhook мог установить другой экземпляр)
+            logger.error(f"Не удалось установить webhook: {e}")
+
+        await stop.wait()
+        logger.info("Получен сигнал остановки")
+    finally:
+        await runner.cleanup()
@@ -1,4 +1,5 @@
 import os
+import re
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -17,6 +18,118 @@ class Config:
     CHECK_INTERVAL = int(os.getenv("CHECK_INTERVAL", "60"))
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///data/bot.db")
     
+    # Пул соединений PostgreSQL (postgresql+asyncpg://...): размер, сверх пула, ожидание и пересоздание (секунды)
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    # Сколько месячных секций истории цен PostgreSQL создавать заранее
+    PG_PARTITIONS_AHEAD = int(os.getenv("PG_PARTITIONS_AHEAD", "2"))
+    
+    # Профиль SQLite: performance (WAL, настроенные PRAGMA) или default
+    SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "performance")
+    SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "16384"))
+    SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    # Сколько страниц возвращать файлу за одну очистку (incremental_vacuum)
+    SQLITE_VACUUM_PAGES = int(os.getenv("SQLITE_VACUUM_PAGES", "2000"))
+    
+    # Общий лимит запросов к Buff (запросов в секунду, 0 - без лимита)
+    BUFF_RATE_LIMIT = float(os.getenv("BUFF_RATE_LIMIT", "2"))
+    BUFF_RATE_BURST = int(os.getenv("BUFF_RATE_BURST", "3"))
+    # Цель по p95 задержки интерактивных запросов (миллисекунды)
+    INTERACTIVE_P95_TARGET_MS = int(os.getenv("INTERACTIVE_P95_TARGET_MS", "2000"))
+    # Дедлайны запросов к Buff (секунды): для действий пользователя и для фоновых проверок
+    BUFF_TIMEOUT_INTERACTIVE = float(os.getenv("BUFF_TIMEOUT_INTERACTIVE", "8"))
+    BUFF_TIMEOUT_BACKGROUND = float(os.getenv("BUFF_TIMEOUT_BACKGROUND", "30"))
+    # Максимальная доля хеджированных (повторных) запросов, 0 - отключить
+    BUFF_HEDGE_RATIO = float(os.getenv("BUFF_HEDGE_RATIO", "0.05"))
+    # Потоков для блокирующих запросов к Buff (отдельно от пула asyncio по умолчанию)
+    BUFF_THREADS = int(os.getenv("BUFF_THREADS", "8"))
+    
+    # Пакетная запись результатов проверки: размер пачки и максимальная задержка (секунды)
+    PRICE_BATCH_SIZE = int(os.getenv("PRICE_BATCH_SIZE", "200"))
+    PRICE_FLUSH_SECONDS = float(os.getenv("PRICE_FLUSH_SECONDS", "10"))
+    
+    # Хранение истории цен (дни): сырые записи, агрегаты по часам, агрегаты по дням
+    RAW_HISTORY_DAYS = int(os.getenv("RAW_HISTORY_DAYS", "7"))
+    HOURLY_ROLLUP_DAYS = int(os.getenv("HOURLY_ROLLUP_DAYS", "90"))
+    DAILY_ROLLUP_DAYS = int(os.getenv("DAILY_ROLLUP_DAYS", "1095"))
+    
+    # Колоночный архив истории цен для аналитики (пустое значение - отключить) и размер пачки выгрузки
+    ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "data/archive")
+    ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+    
+    # Пакетная очистка истории: строк в пачке, бюджет времени на запуск и пауза между пачками (секунды)
+    CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", "1000"))
+    CLEANUP_TIME_BUDGET = float(os.getenv("CLEANUP_TIME_BUDGET", "5"))
+    CLEANUP_BATCH_PAUSE = float(os.getenv("CLEANUP_BATCH_PAUSE", "0.05"))
+    
+    # /now: одновременных запросов к Buff и минимальный интервал между правками сообщения (секунды)
+    NOW_CONCURRENCY = int(os.getenv("NOW_CONCURRENCY", "5"))
+    NOW_EDIT_INTERVAL = float(os.getenv("NOW_EDIT_INTERVAL", "1"))
+    
+    # Графики истории цен: процессов рендеринга и размер кеша картинок (МБ)
+    CHART_WORKERS = int(os.getenv("CHART_WORKERS", "1"))
+    CHART_CACHE_MB = int(os.getenv("CHART_CACHE_MB", "16"))
+    
+    # Массовое добавление товаров: максимум за раз и одновременных проверок на Buff
+    BULK_ADD_MAX_ITEMS = int(os.getenv("BULK_ADD_MAX_ITEMS", "200"))
+    BULK_ADD_CONCURRENCY = int(os.getenv("BULK_ADD_CONCURRENCY", "5"))
+    
+    # Inline-режим: результатов в ответе, пауза ввода перед запросом к Buff (мс),
+    # кеш ответа на стороне Telegram и кеш запросов к Buff (секунды)
+    INLINE_RESULTS_LIMIT = int(os.getenv("INLINE_RESULTS_LIMIT", "20"))
+    INLINE_DEBOUNCE_MS = int(os.getenv("INLINE_DEBOUNCE_MS", "300"))
+    INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+    INLINE_SEARCH_TTL = float(os.getenv("INLINE_SEARCH_TTL", "3600"))
+    
+    # Webhook вместо polling: публичный адрес (пустое значение - polling), путь и секрет,
+    # адрес HTTP-сервера, одновременных обработок update и соединений от Telegram
+    WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+    WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+    WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "50"))
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+    # Запускать задачи над общей БД (проверка цен, очистка, архив): при нескольких экземплярах - только в одном
+    SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+    
+    # Хранилище состояний диалогов (FSM): database (общее для экземпляров, переживает перезапуск)
+    # или memory; срок жизни брошенного диалога (часы), кеш в памяти в режиме webhook
+    # и кеш отсутствия записи (секунды)
+    FSM_STORAGE = os.getenv("FSM_STORAGE", "database")
+    FSM_STATE_TTL_HOURS = float(os.getenv("FSM_STATE_TTL_HOURS", "24"))
+    FSM_CACHE_SECONDS = float(os.getenv("FSM_CACHE_SECONDS", "5"))
+    FSM_MISS_CACHE_SECONDS = float(os.getenv("FSM_MISS_CACHE_SECONDS", "1"))
+    
+    # Товаров на одной странице списка
+    WATCHLIST_PAGE_SIZE = int(os.getenv("WATCHLIST_PAGE_SIZE", "10"))
+    
+    # Кеш настроек пользователей и списков подписок: срок жизни записи (секунды, 0 - отключить)
+    # в режиме polling и в режиме webhook (сброс кеша локальный, экземпляров может быть несколько)
+    CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "300"))
+    WEBHOOK_CACHE_TTL_SECONDS = float(os.getenv("WEBHOOK_CACHE_TTL_SECONDS", "5"))
+    
+    # Очередь уведомлений (outbox)
+    OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+    OUTBOX_DRAIN_INTERVAL = int(os.getenv("OUTBOX_DRAIN_INTERVAL", "5"))  # секунды
+    OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "120"))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+    
+    # Справедливое распределение запросов к Buff между пользователями
+    # USER_WEIGHTS: "user_id:вес" через запятую, по умолчанию у всех вес 1
+    FAIR_QUANTUM = float(os.getenv("FAIR_QUANTUM", "1"))
+    USER_WEIGHTS = {
+        int(uid.strip()): float(weight)
+        for uid, weight in (
+            pair.split(":", 1)
+            for pair in os.getenv("USER_WEIGHTS", "").split(",")
+            if pair.strip()
+        )
+    }
+    
     @classmethod
     def validate(cls):
         """Проверка наличия обязательных переменных"""
@@ -26,6 +139,15 @@ class Config:
             raise ValueError("ALLOWED_USER_IDS не задан в .env")
         if not cls.BUFF_SESSION_COOKIE:
             raise ValueError("BUFF_SESSION_COOKIE не задан в .env")
+        if cls.WEBHOOK_BASE_URL:
+            if not cls.WEBHOOK_BASE_URL.startswith("https://"):
+                raise ValueError("WEBHOOK_BASE_URL должен начинаться с https://")
+            if not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", cls.WEBHOOK_SECRET):
+                raise ValueError("WEBHOOK_SECRET не задан или содержит символы кроме A-Z, a-z, 0-9, _ и -")
+            if not cls.WEBHOOK_PATH.startswith("/"):
+                raise ValueError("WEBHOOK_PATH должен начинаться с /")
+        if cls.FSM_STORAGE not in ("database", "memory"):
+            raise ValueError("FSM_STORAGE должен быть database или memory")
 
 
 config = Config()
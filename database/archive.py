@@ -0,0 +1,209 @@
+import logging
+import mmap
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterable, List, Optional, Tuple
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Время в архиве - микросекунды от эпохи UTC (int64), цены - float64
+EPOCH = datetime(1970, 1, 1)
+TIMESTAMP_FORMAT = "q"
+PRICE_FORMAT = "d"
+ITEM_SIZE = 8
+
+
+def to_micros(timestamp: datetime) -> int:
+    """Перевести наивное время UTC в микросекунды от эпохи"""
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(micros: int) -> datetime:
+    """Перевести микросекунды от эпохи в наивное время UTC"""
+    return EPOCH + timedelta(microseconds=micros)
+
+
+class ArchiveSeries:
+    """
+    История цен одного товара из архива
+
+    timestamps и prices - представления memoryview прямо над отображенными
+    в память файлами (без копирования): timestamps в микросекундах от эпохи
+    (см. from_micros), prices в CNY. Представления действительны до close().
+    """
+
+    def __init__(self, maps: List[mmap.mmap], views: List[memoryview],
+                 timestamps: memoryview, prices: memoryview):
+        self._maps = maps
+        self._views = views
+        self.timestamps = timestamps
+        self.prices = prices
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __iter__(self):
+        """Пары (datetime, цена) - копирует значения, для небольших срезов"""
+        for micros, price in zip(self.timestamps, self.prices):
+            yield from_micros(micros), price
+
+    def close(self):
+        """Освободить представления и отображения файлов"""
+        for view in (self.timestamps, self.prices, *self._views):
+            view.release()
+        for mapped in self._maps:
+            mapped.close()
+        self._maps, self._views = [], []
+
+    def __enter__(self) -> "ArchiveSeries":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PriceArchive:
+    """
+    Колоночный архив истории цен для аналитики
+
+    Для каждого товара два append-only файла с массивами фиксированной
+    ширины: {item_id}.ts (время, int64) и {item_id}.px (цена, float64).
+    Записи товара упорядочены по времени, поэтому выборка за период - это
+    бинарный поиск по отображенному в память массиву времени и срез
+    memoryview, без создания Python-объекта на каждую запись.
+
+    Экспорт из БД (Database.archive_price_history) идет по водяной метке:
+    времени, до которого история уже выгружена. История в БД хранится
+    сериями одинаковой цены, в архив попадает каждое наблюдение серии,
+    включая повторные наблюдения, добавленные после прошлой выгрузки.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _paths(self, item_id: int) -> Tuple[str, str]:
+        """Пути к файлам времени и цен товара"""
+        base = os.path.join(self.directory, str(item_id))
+        return f"{base}.ts", f"{base}.px"
+
+    @property
+    def watermark(self) -> Optional[datetime]:
+        """Время, до которого история уже выгружена (None - выгрузки еще не было)"""
+        path = os.path.join(self.directory, "watermark")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return datetime.fromisoformat(f.read().strip())
+
+    @watermark.setter
+    def watermark(self, value: datetime):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "watermark")
+        with open(f"{path}.tmp", "w") as f:
+            f.write(value.isoformat())
+        os.replace(f"{path}.tmp", path)
+
+    def item_ids(self) -> List[int]:
+        """Товары, для которых есть архив"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            int(name[:-3]) for name in os.listdir(self.directory)
+            if name.endswith(".ts") and name[:-3].isdigit()
+        )
+
+    def _count(self, item_id: int) -> int:
+        """Количество полных записей товара (файлы могли быть дописаны не до конца)"""
+        ts_path, px_path = self._paths(item_id)
+        if not os.path.exists(ts_path) or not os.path.exists(px_path):
+            return 0
+        return min(os.path.getsize(ts_path), os.path.getsize(px_path)) // ITEM_SIZE
+
+    def last_timestamp(self, item_id: int) -> Optional[int]:
+        """Время последней записи товара в микросекундах (None, если записей нет)"""
+        count = self._count(item_id)
+        if not count:
+            return None
+
+        ts_path, _ = self._paths(item_id)
+        with open(ts_path, "rb") as f:
+            f.seek((count - 1) * ITEM_SIZE)
+            return array(TIMESTAMP_FORMAT, f.read(ITEM_SIZE))[0]
+
+    def append(self, item_id: int, rows: Iterable[Tuple[datetime, float]]) -> int:
+        """
+        Дописать записи товара (time, price) в хронологическом порядке
+
+        Записи не новее последней уже сохраненной пропускаются, поэтому
+        повторный экспорт того же периода не создает дублей.
+        Возвращает количество дописанных записей.
+        """
+        last = self.last_timestamp(item_id)
+        timestamps = array(TIMESTAMP_FORMAT)
+        prices = array(PRICE_FORMAT)
+
+        for timestamp, price in rows:
+            micros = to_micros(timestamp)
+            if last is not None and micros <= last:
+                continue
+            timestamps.append(micros)
+            prices.append(price)
+            last = micros
+
+        if not timestamps:
+            return 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        ts_path, px_path = self._paths(item_id)
+        count = self._count(item_id)
+        # Отбрасываем хвост от прерванной записи и дописываем сначала цены:
+        # запись считается сохраненной, когда записано ее время
+        for path, values in ((px_path, prices), (ts_path, timestamps)):
+            with open(path, "ab") as f:
+                f.truncate(count * ITEM_SIZE)
+                f.write(values.tobytes())
+        return len(timestamps)
+
+    def append_rows(self, rows: Iterable[Tuple[int, datetime, float]]) -> int:
+        """Дописать записи (item_id, time, price) нескольких товаров"""
+        appended = 0
+        by_item = sorted(rows, key=itemgetter(0))
+        for item_id, item_rows in groupby(by_item, key=itemgetter(0)):
+            appended += self.append(item_id, ((timestamp, price) for _, timestamp, price in item_rows))
+        return appended
+
+    def read(self, item_id: int, start: Optional[datetime] = None,
+             end: Optional[datetime] = None) -> ArchiveSeries:
+        """
+        История товара за период [start, end] без копирования данных
+
+        Файлы отображаются в память, границы периода находятся бинарным
+        поиском по массиву времени. Результат нужно закрыть (close или with),
+        предварительно освободив созданные над ним объекты (например, массивы NumPy).
+        """
+        count = self._count(item_id)
+        if not count:
+            empty = memoryview(b"")
+            return ArchiveSeries([], [], empty.cast(TIMESTAMP_FORMAT), empty.cast(PRICE_FORMAT))
+
+        maps, views = [], []
+        for path, fmt in zip(self._paths(item_id), (TIMESTAMP_FORMAT, PRICE_FORMAT)):
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), count * ITEM_SIZE, access=mmap.ACCESS_READ)
+            maps.append(mapped)
+            views.append(memoryview(mapped).cast(fmt))
+        timestamps, prices = views
+
+        lo = bisect_left(timestamps, to_micros(start)) if start else 0
+        hi = bisect_right(timestamps, to_micros(end)) if end else count
+        return ArchiveSeries(maps, views, timestamps[lo:hi], prices[lo:hi])
+
+
+# Глобальный архив (None, если ARCHIVE_DIR не задан)
+price_archive = PriceArchive(config.ARCHIVE_DIR) if config.ARCHIVE_DIR else None
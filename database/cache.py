@@ -0,0 +1,88 @@
+import logging
+import time
+from typing import Any, Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+V = TypeVar("V")
+
+# Признак отсутствия значения в кеше (None - допустимое закешированное значение)
+MISSING = object()
+
+
+class TTLCache(Generic[V]):
+    """
+    Кеш в памяти процесса со сроком жизни записей и счетчиками попаданий
+
+    Основной механизм актуальности - явная инвалидация при записи в БД,
+    TTL - страховка на случай изменений в обход Database. ttl <= 0
+    отключает кеш: get всегда промахивается, set ничего не сохраняет.
+    max_entries ограничивает число записей: вытесняются самые старые.
+    """
+
+    def __init__(self, name: str, ttl: float, max_entries: Optional[int] = None):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, Tuple[float, V]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any:
+        """Значение по ключу или MISSING, если его нет или срок истек"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if time.monotonic() < expires_at:
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        self.misses += 1
+        return MISSING
+
+    def set(self, key: Hashable, value: V):
+        """Сохранить значение"""
+        if self.ttl <= 0:
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            del self._entries[next(iter(self._entries))]
+
+    def invalidate(self, *keys: Hashable):
+        """Удалить записи по ключам"""
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[V], bool]):
+        """Удалить записи, значения которых удовлетворяют условию"""
+        for key in [key for key, (_, value) in self._entries.items() if predicate(value)]:
+            del self._entries[key]
+
+    def clear(self):
+        """Очистить кеш"""
+        self._entries.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Есть ли запись со сроком жизни (не влияет на счетчики попаданий)"""
+        entry = self._entries.get(key)
+        return entry is not None and time.monotonic() < entry[0]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> Optional[float]:
+        """Доля попаданий (None, если обращений еще не было)"""
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+    def log_stats(self):
+        """Записать в лог статистику попаданий"""
+        if self.hit_rate is None:
+            return
+        logger.info(
+            f"Кеш {self.name}: попаданий {self.hit_rate:.0%} "
+            f"({self.hits}/{self.hits + self.misses}), записей {len(self)}"
+        )
@@ -1,70 +1,625 @@
+import asyncio
+import json
 import logging
+import re
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from uuid import uuid4
 from datetime import datetime, timedelta
-from typing import Optional, List
+from typing import Optional, List, Dict, Any, NamedTuple, Set, Tuple, AsyncIterator, Callable
+import numpy as np
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from sqlalchemy import select, delete, and_
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, insert, delete, update, and_, or_, exists, bindparam, event, func, tuple_, true, text, make_url, inspect, Row
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import aliased, selectinload
 
-from database.models import Base, User, Item, PriceHistory, user_items
+from database.archive import PriceArchive
+from database.cache import MISSING, TTLCache
+from database.models import Base, AllowedUser, FsmState, User, Item, PriceHistory, PriceRollup, NotificationOutbox, user_items
 from config import config
 
 logger = logging.getLogger(__name__)
 
+# Сессия текущей единицы работы (см. Database.unit_of_work)
+_current_session: ContextVar[Optional[AsyncSession]] = ContextVar("current_session", default=None)
+
+# Максимум строк в одном многострочном INSERT (ограничение SQLite на число параметров)
+BATCH_CHUNK_SIZE = 500
+
+
+# Допустимый интервал проверки цен (минуты)
+MIN_CHECK_INTERVAL = 15
+MAX_CHECK_INTERVAL = 1440
+
+# Сортировки списка товаров: имя -> (ключ сортировки для сущности Item, по убыванию)
+WATCHLIST_SORTS: Dict[str, Tuple[Callable[[Any], Any], bool]] = {
+    "new": (lambda entity: entity.created_at, True),
+    "old": (lambda entity: entity.created_at, False),
+    "name": (lambda entity: entity.market_hash_name, False),
+    "price": (lambda entity: func.coalesce(entity.last_price, -1.0), True),
+}
+
+# Роли в списке доступа
+ROLE_ADMIN = "admin"
+ROLE_USER = "user"
+
+# Уровни агрегатов истории цен
+ROLLUP_HOUR = "hour"
+ROLLUP_DAY = "day"
+
+
+class PriceObservation(NamedTuple):
+    """Наблюдение цены, восстановленное из серии истории"""
+    item_id: int
+    price: float
+    timestamp: datetime
+
+
+class PriceColumns(NamedTuple):
+    """История цен товара столбцами: время (мкс от эпохи UTC, int64) и цена (float64)"""
+    timestamps: np.ndarray
+    prices: np.ndarray
+
+
+class RollupColumns(NamedTuple):
+    """
+    Агрегаты истории цен столбцами (старые первыми)
+    
+    bucket_starts - начало периода (мкс от эпохи UTC, int64), остальные -
+    open/high/low/close, сумма и число цен за период.
+    """
+    bucket_starts: np.ndarray
+    opens: np.ndarray
+    highs: np.ndarray
+    lows: np.ndarray
+    closes: np.ndarray
+    sums: np.ndarray
+    counts: np.ndarray
+
+
+class Holding(NamedTuple):
+    """Позиция пользователя в портфеле"""
+    quantity: int
+    buy_price: Optional[float]
+
+
+class PricePoint(NamedTuple):
+    """Точка истории цен: сырая запись или агрегат за час/день"""
+    timestamp: datetime
+    open: float
+    high: float
+    low: float
+    close: float
+    avg: float
+    count: int
+
+
+def _bucket_start(timestamp: datetime, resolution: str) -> datetime:
+    """Начало часа или дня, в который попадает timestamp"""
+    if resolution == ROLLUP_HOUR:
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _chunks(rows: List[Any], size: int):
+    """Разбить список на части по size элементов"""
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _name_filter(search: str):
+    """Условие "название товара содержит search" (без учета регистра)"""
+    escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return Item.market_hash_name.ilike(f"%{escaped}%", escape="\\")
+
+
+def _expand_run(first_seen: datetime, last_seen: Optional[datetime], observations: int) -> List[datetime]:
+    """
+    Время наблюдений серии истории цен
+    
+    Промежуточные наблюдения не хранятся, поэтому считаются равномерно
+    распределенными между первым и последним (проверки идут с постоянным
+    интервалом).
+    """
+    if observations <= 1 or last_seen is None or last_seen <= first_seen:
+        return [first_seen]
+    step = (last_seen - first_seen) / (observations - 1)
+    return [first_seen + step * index for index in range(observations)]
+
+
+# Значение PRAGMA auto_vacuum для режима INCREMENTAL
+SQLITE_AUTO_VACUUM_INCREMENTAL = 2
+
+# Профили SQLite: PRAGMA, выполняемые на каждом новом соединении
+SQLITE_PROFILES = {
+    # Настройки SQLite по умолчанию (rollback journal)
+    "default": {},
+    # WAL: чтение не блокируется записью планировщика; synchronous=NORMAL
+    # в режиме WAL безопасен для целостности и делает fsync только на checkpoint
+    "performance": {
+        # Действует для новой БД; существующая переводится один раз в init_db
+        "auto_vacuum": "INCREMENTAL",
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "temp_store": "MEMORY",
+        "cache_size": lambda: -config.SQLITE_CACHE_SIZE_KB,  # отрицательное значение - в КиБ
+        "mmap_size": lambda: config.SQLITE_MMAP_SIZE,
+        "busy_timeout": lambda: config.SQLITE_BUSY_TIMEOUT_MS,
+    },
+}
+
+
+def _sqlite_pragmas(profile: str) -> Dict[str, Any]:
+    """PRAGMA для профиля SQLite"""
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Неизвестный профиль SQLite: {profile}")
+    
+    return {
+        name: value() if callable(value) else value
+        for name, value in SQLITE_PROFILES[profile].items()
+    }
+
+
+def _create_missing_indexes(connection):
+    """Создать индексы из моделей, которых еще нет в БД"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def _add_missing_columns(connection):
+    """
+    Добавить новые столбцы моделей в уже существующие таблицы
+    
+    create_all не меняет существующие таблицы. NOT NULL ставится только
+    у столбцов со значением по умолчанию на стороне БД (server_default).
+    """
+    inspector = inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            
+            ddl = (
+                f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN "
+                f"{preparer.format_column(column)} {column.type.compile(connection.dialect)}"
+            )
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+            connection.exec_driver_sql(ddl)
+            logger.info(f"Добавлен столбец {table.name}.{column.name}")
+
+
+# История цен в PostgreSQL секционирована по месяцам: устаревшие месяцы
+# удаляются целиком (DROP TABLE секции), а не построчно. Первичный ключ
+# секционированной таблицы обязан включать ключ секционирования.
+PG_PRICE_HISTORY_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS price_history (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY,
+        item_id INTEGER REFERENCES items (id) ON DELETE CASCADE,
+        price DOUBLE PRECISION NOT NULL,
+        "timestamp" TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+        last_seen TIMESTAMP WITHOUT TIME ZONE,
+        observations INTEGER NOT NULL DEFAULT 1,
+        PRIMARY KEY (id, "timestamp")
+    ) PARTITION BY RANGE ("timestamp")
+    """,
+    'CREATE INDEX IF NOT EXISTS ix_price_history_item_id_timestamp ON price_history (item_id, "timestamp")',
+    'CREATE INDEX IF NOT EXISTS ix_price_history_timestamp ON price_history ("timestamp")',
+    'CREATE INDEX IF NOT EXISTS ix_price_history_last_seen ON price_history (last_seen)',
+)
+
+# Имя месячной секции: price_history_y2025m01
+PARTITION_NAME = re.compile(r"^price_history_y(\d{4})m(\d{2})$")
+
+
+def _create_pg_schema(connection):
+    """Создать схему PostgreSQL: таблицы моделей и секционированную историю цен"""
+    history = PriceHistory.__table__
+    Base.metadata.create_all(
+        connection,
+        tables=[table for table in Base.metadata.sorted_tables if table is not history]
+    )
+    for statement in PG_PRICE_HISTORY_DDL:
+        connection.exec_driver_sql(statement)
+
+
+def _month_start(timestamp: datetime) -> datetime:
+    """Начало месяца, в который попадает timestamp"""
+    return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _add_months(month_start: datetime, months: int) -> datetime:
+    """Начало месяца через months месяцев"""
+    month = month_start.month - 1 + months
+    return month_start.replace(year=month_start.year + month // 12, month=month % 12 + 1)
+
+
+def _partition_name(month_start: datetime) -> str:
+    """Имя секции истории цен за месяц"""
+    return f"price_history_y{month_start.year:04d}m{month_start.month:02d}"
+
 
 class Database:
     """Класс для работы с базой данных"""
     
-    def __init__(self):
-        self.engine = create_async_engine(config.DATABASE_URL, echo=False)
+    def __init__(self, url: Optional[str] = None, sqlite_profile: Optional[str] = None):
+        url = make_url(url or config.DATABASE_URL)
+        engine_options: Dict[str, Any] = {}
+        if url.get_backend_name() != "sqlite":
+            # Пул соединений сервера БД (asyncpg)
+            engine_options = {
+                "pool_size": config.DB_POOL_SIZE,
+                "max_overflow": config.DB_MAX_OVERFLOW,
+                "pool_timeout": config.DB_POOL_TIMEOUT,
+                "pool_recycle": config.DB_POOL_RECYCLE,
+                "pool_pre_ping": True,
+            }
+        
+        self.engine = create_async_engine(url, echo=False, **engine_options)
         self.async_session = async_sessionmaker(
             self.engine,
             class_=AsyncSession,
             expire_on_commit=False
         )
+        # Keyset-курсоры пакетной очистки: проход очистки -> ключ последней удаленной строки
+        self._cleanup_cursors: Dict[str, tuple] = {}
+        # Read-through кеш настроек пользователей и списков подписок (user_id -> значение).
+        # Сброс при изменении только локальный: в режиме webhook экземпляров может быть
+        # несколько, и изменения, сделанные другим экземпляром, видны через срок жизни записи
+        cache_ttl = config.WEBHOOK_CACHE_TTL_SECONDS if config.WEBHOOK_BASE_URL else config.CACHE_TTL_SECONDS
+        self.users_cache: TTLCache[Optional[User]] = TTLCache("users", cache_ttl)
+        self.user_items_cache: TTLCache[List[Item]] = TTLCache("user_items", cache_ttl)
+        
+        if self.engine.dialect.name == "sqlite":
+            self.sqlite_profile = sqlite_profile or config.SQLITE_PROFILE
+            pragmas = _sqlite_pragmas(self.sqlite_profile)
+            
+            @event.listens_for(self.engine.sync_engine, "connect")
+            def apply_sqlite_pragmas(dbapi_connection, connection_record):
+                """Применить PRAGMA профиля к новому соединению"""
+                cursor = dbapi_connection.cursor()
+                for name, value in pragmas.items():
+                    cursor.execute(f"PRAGMA {name}={value}")
+                cursor.close()
     
     async def init_db(self):
         """Инициализация базы данных (создание таблиц)"""
         async with self.engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
+            if self.engine.dialect.name == "postgresql":
+                await conn.run_sync(_create_pg_schema)
+            else:
+                await conn.run_sync(Base.metadata.create_all)
+            # create_all не добавляет новые столбцы и индексы к уже существующим таблицам
+            await conn.run_sync(_add_missing_columns)
+            await conn.run_sync(_create_missing_indexes)
+        await self.ensure_price_history_partitions()
+        await self._enable_incremental_vacuum()
+        await self.backfill_price_rollups()
         logger.info("База данных инициализирована")
     
+    async def _enable_incremental_vacuum(self):
+        """
+        Включить auto_vacuum=INCREMENTAL в существующей БД SQLite
+        
+        Режим меняется только полным VACUUM, поэтому он выполняется один раз:
+        дальше место после очистки истории возвращается порциями.
+        """
+        if self.engine.dialect.name != "sqlite":
+            return
+        if "auto_vacuum" not in _sqlite_pragmas(self.sqlite_profile):
+            return
+        
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            result = await conn.exec_driver_sql("PRAGMA auto_vacuum")
+            if result.scalar() == SQLITE_AUTO_VACUUM_INCREMENTAL:
+                return
+            
+            logger.info("Перевожу БД в режим auto_vacuum=INCREMENTAL (однократный VACUUM)...")
+            await conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+            await conn.exec_driver_sql("VACUUM")
+    
+    async def ensure_price_history_partitions(self, start: Optional[datetime] = None,
+                                              end: Optional[datetime] = None):
+        """
+        Создать месячные секции истории цен PostgreSQL за период [start, end]
+        
+        По умолчанию - текущий месяц и PG_PARTITIONS_AHEAD месяцев вперед.
+        Для других БД ничего не делает.
+        """
+        if self.engine.dialect.name != "postgresql":
+            return
+        
+        now = datetime.utcnow()
+        month = _month_start(start or now)
+        end = end or _add_months(_month_start(now), config.PG_PARTITIONS_AHEAD)
+        
+        async with self.engine.begin() as conn:
+            while month <= end:
+                upper = _add_months(month, 1)
+                await conn.exec_driver_sql(
+                    f"CREATE TABLE IF NOT EXISTS {_partition_name(month)} "
+                    f"PARTITION OF price_history "
+                    f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"
+                )
+                month = upper
+    
+    async def _drop_expired_partitions(self, cutoff: datetime) -> int:
+        """
+        Удалить секции истории цен, целиком старше cutoff
+        
+        Возвращает количество удаленных секций.
+        """
+        async with self.engine.begin() as conn:
+            result = await conn.execute(text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE parent.relname = 'price_history'"
+            ))
+            
+            dropped = 0
+            for (name,) in result.all():
+                match = PARTITION_NAME.match(name)
+                if not match:
+                    continue
+                upper = _add_months(datetime(int(match.group(1)), int(match.group(2)), 1), 1)
+                if upper <= cutoff:
+                    await conn.exec_driver_sql(f"DROP TABLE {name}")
+                    logger.info(f"Удалена секция истории цен {name}")
+                    dropped += 1
+            return dropped
+    
+    async def ping(self):
+        """Проверка доступности БД (исключение, если БД не отвечает)"""
+        async with self.engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
     async def close(self):
         """Закрытие соединения с БД"""
         await self.engine.dispose()
         logger.info("Соединение с БД закрыто")
     
-    # === Операции с пользователями ===
+    @asynccontextmanager
+    async def unit_of_work(self) -> AsyncIterator[AsyncSession]:
+        """
+        Единица работы: несколько операций Database в одной сессии и транзакции
+        
+        Внутри блока `async with db.unit_of_work():` все методы Database
+        используют одну сессию, а их коммиты откладываются до выхода из блока
+        (при ошибке транзакция откатывается). Вложенные блоки присоединяются
+        к внешнему. Сессия привязана к текущей задаче asyncio: не запускайте
+        внутри блока параллельные задачи, работающие с БД.
+        """
+        session = _current_session.get()
+        if session is not None:
+            yield session
+            return
+        
+        async with self.async_session() as session:
+            token = _current_session.set(session)
+            try:
+                yield session
+                await session.commit()
+                # Повторная инвалидация кеша: до коммита другие задачи могли
+                # закешировать еще не измененные данные
+                for invalidate in session.info.pop("after_commit", []):
+                    invalidate()
+            except BaseException:
+                await session.rollback()
+                raise
+            finally:
+                _current_session.reset(token)
     
-    async def add_user(self, user_id: int):
-        """Добавить пользователя, если его еще нет"""
+    @asynccontextmanager
+    async def _session(self) -> AsyncIterator[AsyncSession]:
+        """Сессия для одной операции: текущей единицы работы или новая"""
+        session = _current_session.get()
+        if session is not None:
+            yield session
+            return
+        
         async with self.async_session() as session:
+            yield session
+    
+    async def _commit(self, session: AsyncSession):
+        """Зафиксировать изменения (внутри единицы работы - только flush)"""
+        if _current_session.get() is session:
+            await session.flush()
+        else:
+            await session.commit()
+    
+    def _cacheable(self) -> bool:
+        """
+        Можно ли сохранить прочитанное в кеш
+        
+        Внутри единицы работы данные могут быть еще не зафиксированы
+        и откатиться, поэтому кеш только читается.
+        """
+        return _current_session.get() is None
+    
+    def _invalidate(self, invalidate: Callable[[], None]):
+        """Сбросить записи кеша сейчас и, внутри единицы работы, еще раз после ее коммита"""
+        invalidate()
+        session = _current_session.get()
+        if session is not None:
+            session.info.setdefault("after_commit", []).append(invalidate)
+    
+    def _invalidate_users(self, *user_ids: int):
+        """Сбросить закешированные настройки пользователей"""
+        self._invalidate(lambda: self.users_cache.invalidate(*user_ids))
+    
+    def _invalidate_user_items(self, user_id: int):
+        """Сбросить закешированный список подписок пользователя"""
+        self._invalidate(lambda: self.user_items_cache.invalidate(user_id))
+    
+    def _invalidate_prices(self, prices: Dict[int, float]):
+        """Сбросить закешированные списки, в которых изменилась цена товара"""
+        self._invalidate(lambda: self.user_items_cache.invalidate_where(
+            lambda items: any(item.id in prices and item.last_price != prices[item.id] for item in items)
+        ))
+    
+    def log_cache_stats(self):
+        """Записать в лог статистику кеша"""
+        self.users_cache.log_stats()
+        self.user_items_cache.log_stats()
+    
+    def _insert(self, table):
+        """INSERT с поддержкой ON CONFLICT для диалекта текущей БД"""
+        if self.engine.dialect.name == "postgresql":
+            return pg_insert(table)
+        return sqlite_insert(table)
+    
+    def _greatest(self, *args):
+        """Наибольшее из значений (в SQLite - многоаргументный max)"""
+        if self.engine.dialect.name == "postgresql":
+            return func.greatest(*args)
+        return func.max(*args)
+    
+    def _least(self, *args):
+        """Наименьшее из значений (в SQLite - многоаргументный min)"""
+        if self.engine.dialect.name == "postgresql":
+            return func.least(*args)
+        return func.min(*args)
+    
+    # === Список доступа ===
+    
+    async def get_allowed_users(self) -> List[Tuple[int, str]]:
+        """Весь список доступа: (user_id, роль)"""
+        async with self._session() as session:
+            result = await session.execute(select(AllowedUser.user_id, AllowedUser.role))
+            return [tuple(row) for row in result.all()]
+    
+    async def seed_allowed_users(self, admin_ids: List[int]):
+        """Добавить администраторов из конфигурации (существующие записи не меняются)"""
+        if not admin_ids:
+            return
+        async with self._session() as session:
+            await session.execute(
+                self._insert(AllowedUser.__table__)
+                .values([
+                    {"user_id": user_id, "role": ROLE_ADMIN, "added_at": datetime.utcnow()}
+                    for user_id in admin_ids
+                ])
+                .on_conflict_do_nothing(index_elements=["user_id"])
+            )
+            await self._commit(session)
+    
+    async def set_allowed_user(self, user_id: int, role: str, added_by: Optional[int] = None):
+        """Выдать доступ или сменить роль"""
+        async with self._session() as session:
+            stmt = self._insert(AllowedUser.__table__).values(
+                user_id=user_id, role=role, added_by=added_by, added_at=datetime.utcnow()
+            )
+            await session.execute(
+                stmt.on_conflict_do_update(index_elements=["user_id"], set_={"role": stmt.excluded.role})
+            )
+            await self._commit(session)
+            logger.info(f"Доступ выдан: {user_id} ({role}), выдал {added_by}")
+    
+    async def remove_allowed_user(self, user_id: int) -> bool:
+        """Отозвать доступ (данные пользователя сохраняются)"""
+        async with self._session() as session:
             result = await session.execute(
-                select(User).where(User.user_id == user_id)
+                delete(AllowedUser).where(AllowedUser.user_id == user_id)
             )
-            user = result.scalar_one_or_none()
-            
-            if not user:
-                user = User(
+            await self._commit(session)
+            if result.rowcount:
+                logger.info(f"Доступ отозван: {user_id}")
+            return result.rowcount > 0
+    
+    # === Состояния диалогов (FSM) ===
+    
+    async def get_fsm_state(self, key: str) -> Optional[Tuple[Optional[str], Dict[str, Any], datetime]]:
+        """Состояние, данные и срок действия по ключу FSM (None, если записи нет или срок истек)"""
+        async with self._session() as session:
+            result = await session.execute(
+                select(FsmState.state, FsmState.data, FsmState.expires_at)
+                .where(FsmState.key == key, FsmState.expires_at > datetime.utcnow())
+            )
+            row = result.first()
+            if row is None:
+                return None
+            return row.state, json.loads(row.data), row.expires_at
+    
+    async def set_fsm_state(self, key: str, state: Optional[str], data: Dict[str, Any], expires_at: datetime):
+        """Сохранить состояние и данные по ключу FSM (пустая запись удаляется)"""
+        async with self._session() as session:
+            if state is None and not data:
+                await session.execute(delete(FsmState).where(FsmState.key == key))
+            else:
+                stmt = self._insert(FsmState.__table__).values(
+                    key=key, state=state, data=json.dumps(data, ensure_ascii=False), expires_at=expires_at
+                )
+                await session.execute(stmt.on_conflict_do_update(
+                    index_elements=["key"],
+                    set_={"state": stmt.excluded.state, "data": stmt.excluded.data, "expires_at": stmt.excluded.expires_at}
+                ))
+            await self._commit(session)
+    
+    async def cleanup_fsm_states(self) -> int:
+        """Удалить брошенные диалоги (срок действия истек)"""
+        async with self._session() as session:
+            result = await session.execute(
+                delete(FsmState).where(FsmState.expires_at <= datetime.utcnow())
+            )
+            await self._commit(session)
+            if result.rowcount:
+                logger.info(f"Удалено брошенных состояний диалогов: {result.rowcount}")
+            return result.rowcount
+    
+    # === Операции с пользователями ===
+    
+    async def add_user(self, user_id: int):
+        """Добавить пользователя, если его еще нет (один INSERT ... ON CONFLICT DO NOTHING)"""
+        async with self._session() as session:
+            result = await session.execute(
+                self._insert(User.__table__)
+                .values(
                     user_id=user_id,
+                    created_at=datetime.utcnow(),
                     check_interval=60,  # По умолчанию 60 минут
                     notifications_enabled=True
                 )
-                session.add(user)
-                await session.commit()
+                .on_conflict_do_nothing(index_elements=["user_id"])
+            )
+            await self._commit(session)
+            
+            if result.rowcount:
+                self._invalidate_users(user_id)
                 logger.info(f"Добавлен новый пользователь: {user_id}")
     
     async def get_user(self, user_id: int) -> Optional[User]:
-        """Получить пользователя по ID"""
-        async with self.async_session() as session:
+        """Получить пользователя по ID (через кеш)"""
+        user = self.users_cache.get(user_id)
+        if user is not MISSING:
+            return user
+        
+        async with self._session() as session:
             result = await session.execute(
                 select(User).where(User.user_id == user_id)
             )
-            return result.scalar_one_or_none()
+            user = result.scalar_one_or_none()
+        
+        if self._cacheable():
+            self.users_cache.set(user_id, user)
+        return user
     
     async def update_user_settings(self, user_id: int, check_interval: Optional[int] = None, 
                                    notifications_enabled: Optional[bool] = None):
         """Обновить настройки пользователя"""
-        async with self.async_session() as session:
+        async with self._session() as session:
             result = await session.execute(
                 select(User).where(User.user_id == user_id)
             )
@@ -73,7 +628,7 @@ class Database:
             if user:
                 if check_interval is not None:
                     # Проверяем диапазон (15 минут - 24 часа)
-                    if check_interval < 15 or check_interval > 1440:
+                    if check_interval < MIN_CHECK_INTERVAL or check_interval > MAX_CHECK_INTERVAL:
                         raise ValueError("Интервал должен быть от 15 минут до 24 часов")
                     user.check_interval = check_interval
                     logger.info(f"Обновлен интервал проверки для {user_id}: {check_interval} мин")
@@ -82,11 +637,12 @@ class Database:
                     user.notifications_enabled = notifications_enabled
                     logger.info(f"Уведомления для {user_id}: {'включены' if notifications_enabled else 'отключены'}")
                 
-                await session.commit()
+                await self._commit(session)
+                self._invalidate_users(user_id)
     
     async def update_user_last_check(self, user_id: int):
         """Обновить время последней проверки пользователя"""
-        async with self.async_session() as session:
+        async with self._session() as session:
             result = await session.execute(
                 select(User).where(User.user_id == user_id)
             )
@@ -94,97 +650,184 @@ class Database:
             
             if user:
                 user.last_check = datetime.utcnow()
-                await session.commit()
+                await self._commit(session)
+                self._invalidate_users(user_id)
     
-    async def get_users_to_check(self) -> List[User]:
-        """Получить пользователей, которым пора проверять цены"""
-        async with self.async_session() as session:
+    def _check_is_due(self, now: datetime):
+        """
+        SQL-условие "прошло не меньше check_interval минут с last_check"
+        
+        Арифметика с интервалами зависит от диалекта БД.
+        """
+        if self.engine.dialect.name == "postgresql":
+            return User.last_check + func.make_interval(0, 0, 0, 0, 0, User.check_interval) <= now
+        return (func.julianday(now) - func.julianday(User.last_check)) * 1440 >= User.check_interval
+    
+    async def get_users_to_check(self) -> List[Row]:
+        """
+        Получить пользователей, которым пора проверять цены
+        
+        Отбор целиком выполняется в SQL: уведомления включены, есть хотя бы
+        одна подписка и с последней проверки прошло не меньше check_interval.
+        Возвращает строки (user_id, check_interval) без загрузки ORM-объектов.
+        """
+        async with self._session() as session:
             now = datetime.utcnow()
             
-            # Получаем пользователей с включенными уведомлениями
             result = await session.execute(
-                select(User)
-                .where(User.notifications_enabled == 1)
-                .options(selectinload(User.items))
+                select(User.user_id, User.check_interval)
+                .where(
+                    and_(
+                        User.notifications_enabled == true(),
+                        or_(
+                            User.last_check.is_(None),
+                            and_(
+                                # Диапазон по индексу (notifications_enabled, last_check):
+                                # раньше минимального интервала проверять точно рано
+                                User.last_check <= now - timedelta(minutes=MIN_CHECK_INTERVAL),
+                                self._check_is_due(now)
+                            )
+                        ),
+                        exists().where(user_items.c.user_id == User.user_id)
+                    )
+                )
             )
-            users = result.scalars().all()
-            
-            # Фильтруем по времени последней проверки
-            users_to_check = []
-            for user in users:
-                # Если товаров нет - пропускаем
-                if not user.items:
-                    continue
-                
-                # Если никогда не проверяли - проверяем
-                if user.last_check is None:
-                    users_to_check.append(user)
-                    continue
-                
-                # Проверяем, прошло ли достаточно времени
-                time_passed = (now - user.last_check).total_seconds() / 60  # в минутах
-                if time_passed >= user.check_interval:
-                    users_to_check.append(user)
-            
-            return users_to_check
+            return list(result.all())
     
     # === Операции с товарами ===
     
+    def _upsert_item(self, goods_id: int, market_hash_name: str, initial_price: float):
+        """
+        INSERT товара, при конфликте по goods_id - существующая строка
+        
+        DO UPDATE с неизменным значением нужен, чтобы RETURNING вернул
+        и уже существующую строку; цена и название при этом не меняются.
+        """
+        return self._upsert_items([(goods_id, market_hash_name, initial_price)])
+    
+    def _upsert_items(self, items: List[Tuple[int, str, float]]):
+        """Многострочный вариант _upsert_item: items - (goods_id, название, цена) с разными goods_id"""
+        now = datetime.utcnow()
+        stmt = self._insert(Item).values([
+            {
+                "goods_id": goods_id,
+                "market_hash_name": market_hash_name,
+                "last_price": initial_price,
+                "created_at": now,
+                "updated_at": now
+            }
+            for goods_id, market_hash_name, initial_price in items
+        ])
+        return stmt.on_conflict_do_update(
+            index_elements=["goods_id"],
+            set_={"goods_id": stmt.excluded.goods_id}
+        )
+    
     async def get_or_create_item(self, goods_id: int, market_hash_name: str, initial_price: float) -> Item:
-        """Получить товар или создать, если не существует"""
-        async with self.async_session() as session:
-            # Ищем товар по goods_id
+        """Получить товар или создать, если не существует (один запрос, безопасно при гонке)"""
+        async with self._session() as session:
             result = await session.execute(
-                select(Item).where(Item.goods_id == goods_id)
+                self._upsert_item(goods_id, market_hash_name, initial_price).returning(Item),
+                execution_options={"populate_existing": True}
             )
-            item = result.scalar_one_or_none()
-            
-            if not item:
-                # Создаем новый товар
-                item = Item(
-                    goods_id=goods_id,
-                    market_hash_name=market_hash_name,
-                    last_price=initial_price
-                )
-                session.add(item)
-                await session.commit()
-                await session.refresh(item)
-                logger.info(f"Создан новый товар: {goods_id} - {market_hash_name}")
-            
+            item = result.scalar_one()
+            await self._commit(session)
             return item
     
-    async def add_user_subscription(self, user_id: int, goods_id: int, market_hash_name: str, initial_price: float):
-        """Добавить подписку пользователя на товар"""
-        async with self.async_session() as session:
-            # Получаем или создаем товар
-            item = await self.get_or_create_item(goods_id, market_hash_name, initial_price)
+    async def add_user_subscription(self, user_id: int, goods_id: int, market_hash_name: str,
+                                    initial_price: float) -> int:
+        """
+        Добавить подписку пользователя на товар
+        
+        Два запроса в одной транзакции: upsert товара с RETURNING id и вставка
+        подписки с ON CONFLICT DO NOTHING. Одновременное добавление одного
+        goods_id разными пользователями не приводит к ошибке уникальности.
+        Возвращает id товара.
+        """
+        async with self.unit_of_work() as session:
+            result = await session.execute(
+                self._upsert_item(goods_id, market_hash_name, initial_price).returning(Item.id)
+            )
+            item_id = result.scalar_one()
             
-            # Проверяем, не подписан ли уже пользователь
             result = await session.execute(
-                select(user_items).where(
-                    and_(
-                        user_items.c.user_id == user_id,
-                        user_items.c.item_id == item.id
-                    )
-                )
+                self._insert(user_items)
+                .values(user_id=user_id, item_id=item_id, subscribed_at=datetime.utcnow())
+                .on_conflict_do_nothing(index_elements=["user_id", "item_id"])
             )
-            subscription = result.first()
+            await self._commit(session)
+            self._invalidate_user_items(user_id)
             
-            if not subscription:
-                # Добавляем подписку
+            if result.rowcount:
+                logger.info(f"Пользователь {user_id} подписался на товар {goods_id}")
+            
+            return item_id
+    
+    async def add_user_subscriptions(self, user_id: int, items: List[Tuple[int, str, float]]) -> Dict[int, int]:
+        """
+        Добавить подписки пользователя на несколько товаров одной транзакцией
+        
+        items - (goods_id, название, текущая цена) с разными goods_id.
+        Товары - многострочный upsert с RETURNING, подписки - многострочный
+        INSERT ON CONFLICT DO NOTHING, первые записи истории - одной пачкой.
+        Возвращает {goods_id: item_id}.
+        """
+        item_ids: Dict[int, int] = {}
+        prices = {goods_id: price for goods_id, _, price in items}
+        
+        async with self.unit_of_work() as session:
+            for chunk in _chunks(items, BATCH_CHUNK_SIZE):
+                result = await session.execute(
+                    self._upsert_items(chunk).returning(Item.goods_id, Item.id)
+                )
+                item_ids.update(result.tuples().all())
+            
+            now = datetime.utcnow()
+            for chunk in _chunks(list(item_ids.values()), BATCH_CHUNK_SIZE):
                 await session.execute(
-                    user_items.insert().values(
-                        user_id=user_id,
-                        item_id=item.id,
-                        subscribed_at=datetime.utcnow()
+                    self._insert(user_items)
+                    .values([{"user_id": user_id, "item_id": item_id, "subscribed_at": now} for item_id in chunk])
+                    .on_conflict_do_nothing(index_elements=["user_id", "item_id"])
+                )
+            
+            await self._add_history(
+                session, {item_id: prices[goods_id] for goods_id, item_id in item_ids.items()}, now
+            )
+            await self._commit(session)
+            self._invalidate_user_items(user_id)
+        
+        logger.info(f"Пользователь {user_id} подписался на товары: {len(item_ids)}")
+        return item_ids
+    
+    async def get_subscribed_goods_ids(self, user_id: int, goods_ids: List[int]) -> Set[int]:
+        """Какие из goods_ids уже есть в списке пользователя"""
+        subscribed: Set[int] = set()
+        async with self._session() as session:
+            for chunk in _chunks(goods_ids, BATCH_CHUNK_SIZE):
+                result = await session.execute(
+                    select(Item.goods_id)
+                    .join(user_items, user_items.c.item_id == Item.id)
+                    .where(
+                        and_(
+                            user_items.c.user_id == user_id,
+                            Item.goods_id.in_(chunk)
+                        )
                     )
                 )
-                await session.commit()
-                logger.info(f"Пользователь {user_id} подписался на товар {goods_id}")
+                subscribed.update(result.scalars().all())
+        return subscribed
     
     async def remove_user_subscription(self, user_id: int, item_id: int) -> bool:
-        """Удалить подписку пользователя на товар"""
-        async with self.async_session() as session:
+        """Удалить подписку пользователя на товар (позиция в портфеле удаляется вместе с ней)"""
+        async with self._session() as session:
+            position = await self._get_position(session, user_id, item_id)
+            if position is not None and position.quantity:
+                await self._shift_portfolio(
+                    session, user_id,
+                    -position.quantity * (position.last_price or 0),
+                    -position.quantity * (position.buy_price or 0)
+                )
+            
             result = await session.execute(
                 delete(user_items).where(
                     and_(
@@ -193,9 +836,10 @@ class Database:
                     )
                 )
             )
-            await session.commit()
+            await self._commit(session)
             
             if result.rowcount > 0:
+                self._invalidate_user_items(user_id)
                 logger.info(f"Пользователь {user_id} отписался от товара {item_id}")
                 
                 # Проверяем, остались ли подписчики у товара
@@ -208,7 +852,7 @@ class Database:
                     await session.execute(
                         delete(Item).where(Item.id == item_id)
                     )
-                    await session.commit()
+                    await self._commit(session)
                     logger.info(f"Товар {item_id} удален (нет подписчиков)")
                 
                 return True
@@ -216,20 +860,126 @@ class Database:
             return False
     
     async def get_user_items(self, user_id: int) -> List[Item]:
-        """Получить все товары, на которые подписан пользователь"""
-        async with self.async_session() as session:
+        """Получить все товары, на которые подписан пользователь (через кеш)"""
+        items = self.user_items_cache.get(user_id)
+        if items is not MISSING:
+            return list(items)
+        
+        async with self._session() as session:
             result = await session.execute(
                 select(Item)
                 .join(user_items)
                 .where(user_items.c.user_id == user_id)
                 .order_by(Item.created_at.desc())
             )
-            items = result.scalars().all()
-            return list(items)
+            items = list(result.scalars().all())
+        
+        if self._cacheable():
+            self.user_items_cache.set(user_id, items)
+        return list(items)
+    
+    async def get_user_item(self, user_id: int, item_id: int) -> Optional[Item]:
+        """Получить товар, если пользователь на него подписан (один запрос по ключу)"""
+        items = self.user_items_cache.get(user_id)
+        if items is not MISSING:
+            return next((item for item in items if item.id == item_id), None)
+        
+        async with self._session() as session:
+            result = await session.execute(
+                select(Item)
+                .join(user_items, user_items.c.item_id == Item.id)
+                .where(
+                    and_(
+                        user_items.c.user_id == user_id,
+                        user_items.c.item_id == item_id
+                    )
+                )
+            )
+            return result.scalar_one_or_none()
+    
+    async def count_user_items(self, user_id: int, search: Optional[str] = None) -> int:
+        """Количество товаров пользователя (с фильтром по названию), без фильтра - из кеша подписок"""
+        if not search:
+            items = self.user_items_cache.get(user_id)
+            if items is not MISSING:
+                return len(items)
+        
+        async with self._session() as session:
+            query = (
+                select(func.count())
+                .select_from(user_items)
+                .where(user_items.c.user_id == user_id)
+            )
+            if search:
+                query = query.join(Item, Item.id == user_items.c.item_id).where(_name_filter(search))
+            return (await session.execute(query)).scalar_one()
+    
+    async def get_user_items_page(self, user_id: int, sort: str = "new", after: Optional[int] = None,
+                                  limit: int = 10, search: Optional[str] = None
+                                  ) -> Tuple[List[Item], Optional[int]]:
+        """
+        Страница списка товаров пользователя (keyset-пагинация)
+        
+        sort - ключ WATCHLIST_SORTS, after - id последнего товара предыдущей
+        страницы. Следующая страница начинается строго после пары
+        (ключ сортировки, id) этого товара, поэтому стоимость запроса
+        не зависит от номера страницы и размера списка.
+        
+        Ключ товара-курсора читается на момент запроса: если при сортировке
+        по цене цена изменилась между страницами, товары на границе могут
+        пропасть или повториться (список - снимок каждой страницы, а не всего
+        списка). Для created_at и названия граница не сдвигается.
+        Возвращает (товары, id последнего товара или None, если страниц больше нет).
+        """
+        key, descending = WATCHLIST_SORTS.get(sort, WATCHLIST_SORTS["new"])
+        position = tuple_(key(Item), Item.id)
+        
+        query = (
+            select(Item)
+            .join(user_items, user_items.c.item_id == Item.id)
+            .where(user_items.c.user_id == user_id)
+        )
+        if search:
+            query = query.where(_name_filter(search))
+        if after is not None:
+            anchor = aliased(Item)
+            anchor_key = select(key(anchor)).where(anchor.id == after).scalar_subquery()
+            boundary = tuple_(anchor_key, after)
+            query = query.where(position < boundary if descending else position > boundary)
+        
+        if descending:
+            query = query.order_by(key(Item).desc(), Item.id.desc())
+        else:
+            query = query.order_by(key(Item), Item.id)
+        
+        async with self._session() as session:
+            result = await session.execute(query.limit(limit + 1))
+            items = list(result.scalars().all())
+        
+        has_more = len(items) > limit
+        items = items[:limit]
+        return items, (items[-1].id if has_more else None)
+    
+    async def get_items_for_users(self, user_ids: List[int]) -> Dict[int, List[Item]]:
+        """Получить товары нескольких пользователей одним запросом: {user_id: [Item, ...]}"""
+        items_by_user: Dict[int, List[Item]] = {user_id: [] for user_id in user_ids}
+        if not user_ids:
+            return items_by_user
+        
+        async with self._session() as session:
+            result = await session.execute(
+                select(user_items.c.user_id, Item)
+                .join(Item, Item.id == user_items.c.item_id)
+                .where(user_items.c.user_id.in_(user_ids))
+                .order_by(Item.created_at.desc())
+            )
+            for user_id, item in result.all():
+                items_by_user[user_id].append(item)
+            return items_by_user
     
     async def get_item_by_id(self, item_id: int) -> Optional[Item]:
         """Получить товар по ID"""
-        async with self.async_session() as session:
+        async with self._session() as session:
             result = await session.execute(
                 select(Item).where(Item.id == item_id)
             )
@@ -237,29 +987,15 @@ class Database:
     
     async def get_item_by_goods_id(self, goods_id: int) -> Optional[Item]:
         """Получить товар по goods_id"""
-        async with self.async_session() as session:
+        async with self._session() as session:
             result = await session.execute(
                 select(Item).where(Item.goods_id == goods_id)
             )
             return result.scalar_one_or_none()
     
-    async def update_item_price(self, item_id: int, new_price: float):
-        """Обновить цену товара"""
-        async with self.async_session() as session:
-            result = await session.execute(
-                select(Item).where(Item.id == item_id)
-            )
-            item = result.scalar_one_or_none()
-            
-            if item:
-                item.last_price = new_price
-                item.updated_at = datetime.utcnow()
-                await session.commit()
-                logger.debug(f"Обновлена цена товара {item_id}: {new_price}")
-    
     async def get_all_tracked_items(self) -> List[Item]:
         """Получить все отслеживаемые товары (с подписчиками)"""
-        async with self.async_session() as session:
+        async with self._session() as session:
             result = await session.execute(
                 select(Item)
                 .join(user_items)
@@ -271,7 +1007,7 @@ class Database:
     
     async def get_item_subscribers(self, item_id: int) -> List[int]:
         """Получить список user_id подписчиков товара"""
-        async with self.async_session() as session:
+        async with self._session() as session:
             result = await session.execute(
                 select(user_items.c.user_id).where(user_items.c.item_id == item_id)
             )
@@ -280,7 +1016,7 @@ class Database:
     
     async def is_user_subscribed(self, user_id: int, goods_id: int) -> bool:
         """Проверить, подписан ли пользователь на товар"""
-        async with self.async_session() as session:
+        async with self._session() as session:
             # Сначала находим item_id по goods_id
             item_result = await session.execute(
                 select(Item.id).where(Item.goods_id == goods_id)
@@ -301,45 +1037,813 @@ class Database:
             )
             return result.first() is not None
     
-    # === Операции с историей цен ===
+    async def record_price(self, item_id: int, price: float,
+                           notifications: Optional[List[Dict[str, Any]]] = None):
+        """
+        Сохранить результат проверки цены одного товара одной транзакцией
+        
+        См. save_price_batch.
+        """
+        await self.save_price_batch({item_id: price}, notifications=notifications)
     
-    async def add_price_history(self, item_id: int, price: float):
-        """Добавить запись в историю цен"""
+    async def save_price_batch(self, prices: Dict[int, float],
+                               notifications: Optional[List[Dict[str, Any]]] = None,
+                               checked_user_ids: Optional[List[int]] = None):
+        """
+        Сохранить результаты проверки цен одной транзакцией
+        
+        prices - словарь {item_id: цена}. В одной транзакции:
+        - многострочный INSERT в историю цен
+        - сдвиг итогов портфелей на изменение цен (см. _apply_portfolio_deltas)
+        - пакетный UPDATE last_price (только у товаров, цена которых изменилась)
+        - постановка уведомлений в outbox (словари с ключами user_id,
+          idempotency_key, text; уже существующие ключи пропускаются)
+        - обновление last_check у проверенных пользователей
+        """
+        async with self._session() as session:
+            now = datetime.utcnow()
+            
+            if prices:
+                await self._add_history(session, prices, now)
+                await self._apply_portfolio_deltas(session, prices)
+                
+                items_table = Item.__table__
+                await session.execute(
+                    update(items_table)
+                    .where(
+                        and_(
+                            items_table.c.id == bindparam("b_item_id"),
+                            or_(
+                                items_table.c.last_price.is_(None),
+                                items_table.c.last_price != bindparam("b_price")
+                            )
+                        )
+                    )
+                    .values(last_price=bindparam("b_price"), updated_at=now),
+                    [{"b_item_id": item_id, "b_price": price} for item_id, price in prices.items()]
+                )
+            
+            if notifications:
+                outbox_rows = [
+                    {
+                        "user_id": n["user_id"],
+                        "idempotency_key": n["idempotency_key"],
+                        "text": n["text"],
+                        "created_at": now,
+                        "attempts": 0
+                    }
+                    for n in notifications
+                ]
+                for chunk in _chunks(outbox_rows, BATCH_CHUNK_SIZE):
+                    await session.execute(
+                        self._insert(NotificationOutbox)
+                        .values(chunk)
+                        .on_conflict_do_nothing(index_elements=["idempotency_key"])
+                    )
+            
+            if checked_user_ids:
+                await session.execute(
+                    update(User)
+                    .where(User.user_id.in_(checked_user_ids))
+                    .values(last_check=now)
+                )
+            
+            await self._commit(session)
+            self._invalidate_prices(prices)
+            self._invalidate_users(*(checked_user_ids or []))
+            logger.debug(
+                f"Сохранено цен: {len(prices)}, уведомлений: {len(notifications or [])}, "
+                f"пользователей: {len(checked_user_ids or [])}"
+            )
+    
+    # === Портфель ===
+    
+    async def _get_position(self, session: AsyncSession, user_id: int, item_id: int) -> Optional[Row]:
+        """Позиция пользователя по товару с текущей ценой: (quantity, buy_price, last_price)"""
+        result = await session.execute(
+            select(user_items.c.quantity, user_items.c.buy_price, Item.last_price)
+            .select_from(user_items)
+            .join(Item, Item.id == user_items.c.item_id)
+            .where(
+                and_(
+                    user_items.c.user_id == user_id,
+                    user_items.c.item_id == item_id
+                )
+            )
+        )
+        return result.first()
+    
+    async def _shift_portfolio(self, session: AsyncSession, user_id: int, value_delta: float, cost_delta: float):
+        """Сдвинуть итоги портфеля пользователя на изменение стоимости и затрат"""
+        users = User.__table__
+        await session.execute(
+            update(users)
+            .where(users.c.user_id == user_id)
+            .values(
+                portfolio_value=users.c.portfolio_value + value_delta,
+                portfolio_cost=users.c.portfolio_cost + cost_delta
+            )
+        )
+        self._invalidate_users(user_id)
+    
+    async def _apply_portfolio_deltas(self, session: AsyncSession, prices: Dict[int, float]):
+        """
+        Сдвинуть стоимость портфелей на изменение цен товаров
+        
+        Вызывается до обновления last_price: один запрос находит позиции
+        по товарам пачки вместе с прежней ценой, итоги владельцев
+        сдвигаются одним пакетным UPDATE на сумму quantity * (новая - прежняя).
+        """
+        deltas: Dict[int, float] = defaultdict(float)
+        for chunk in _chunks(list(prices), BATCH_CHUNK_SIZE):
+            result = await session.execute(
+                select(user_items.c.user_id, user_items.c.item_id, user_items.c.quantity, Item.last_price)
+                .select_from(user_items)
+                .join(Item, Item.id == user_items.c.item_id)
+                .where(
+                    and_(
+                        user_items.c.item_id.in_(chunk),
+                        user_items.c.quantity > 0
+                    )
+                )
+            )
+            for user_id, item_id, quantity, last_price in result.all():
+                if last_price != prices[item_id]:
+                    deltas[user_id] += quantity * (prices[item_id] - (last_price or 0))
+        
+        if not deltas:
+            return
+        
+        users = User.__table__
+        await session.execute(
+            update(users)
+            .where(users.c.user_id == bindparam("b_user_id"))
+            .values(portfolio_value=users.c.portfolio_value + bindparam("b_delta")),
+            [{"b_user_id": user_id, "b_delta": delta} for user_id, delta in deltas.items()]
+        )
+        self._invalidate_users(*deltas)
+    
+    async def get_holding(self, user_id: int, item_id: int) -> Optional[Holding]:
+        """Позиция пользователя по товару (None - нет подписки или позиции)"""
+        async with self._session() as session:
+            position = await self._get_position(session, user_id, item_id)
+        if position is None or not position.quantity:
+            return None
+        return Holding(position.quantity, position.buy_price)
+    
+    async def set_holding(self, user_id: int, item_id: int, quantity: int,
+                          buy_price: Optional[float] = None) -> bool:
+        """
+        Задать позицию по товару из списка пользователя (quantity=0 - убрать)
+        
+        Итоги портфеля сдвигаются на разницу со старой позицией в той же
+        транзакции. Возвращает False, если пользователь не подписан на товар.
+        """
+        if not quantity:
+            buy_price = None
+        
+        async with self.unit_of_work() as session:
+            position = await self._get_position(session, user_id, item_id)
+            if position is None:
+                return False
+            
+            await session.execute(
+                update(user_items)
+                .where(
+                    and_(
+                        user_items.c.user_id == user_id,
+                        user_items.c.item_id == item_id
+                    )
+                )
+                .values(quantity=quantity, buy_price=buy_price)
+            )
+            await self._shift_portfolio(
+                session, user_id,
+                (quantity - position.quantity) * (position.last_price or 0),
+                quantity * (buy_price or 0) - position.quantity * (position.buy_price or 0)
+            )
+            await self._commit(session)
+            logger.info(f"Пользователь {user_id}: позиция по товару {item_id} - {quantity} шт.")
+            return True
+    
+    async def reconcile_portfolios(self):
+        """
+        Пересчитать итоги всех портфелей по позициям и текущим ценам
+        
+        Страховка инкрементального учета: одновременное обновление цены
+        одного товара из разных транзакций может сдвинуть итог дважды.
+        """
+        users = User.__table__
+        value = (
+            select(func.coalesce(func.sum(user_items.c.quantity * func.coalesce(Item.last_price, 0)), 0))
+            .select_from(user_items)
+            .join(Item, Item.id == user_items.c.item_id)
+            .where(user_items.c.user_id == users.c.user_id)
+            .scalar_subquery()
+        )
+        cost = (
+            select(func.coalesce(func.sum(user_items.c.quantity * func.coalesce(user_items.c.buy_price, 0)), 0))
+            .where(user_items.c.user_id == users.c.user_id)
+            .scalar_subquery()
+        )
+        async with self._session() as session:
+            result = await session.execute(
+                update(users)
+                .where(
+                    # Расхождения меньше копейки - накопленная погрешность сложения
+                    or_(
+                        func.abs(users.c.portfolio_value - value) > 0.005,
+                        func.abs(users.c.portfolio_cost - cost) > 0.005
+                    )
+                )
+                .values(portfolio_value=value, portfolio_cost=cost)
+            )
+            await self._commit(session)
+            self._invalidate(self.users_cache.clear)
+            if result.rowcount:
+                logger.info(f"Итоги портфеля пересчитаны у пользователей: {result.rowcount}")
+    
+    # === Очередь уведомлений (outbox) ===
+    
+    async def claim_notifications(self, limit: int) -> List[NotificationOutbox]:
+        """
+        Забрать пачку неотправленных уведомлений на отправку
+        
+        Записи помечаются токеном и арендой на OUTBOX_LEASE_SECONDS, поэтому
+        параллельный отправитель их не возьмет. Если отправитель упадет,
+        после окончания аренды записи снова станут доступны.
+        """
         async with self.async_session() as session:
-            history = PriceHistory(
-                item_id=item_id,
-                price=price
+            now = datetime.utcnow()
+            token = uuid4().hex
+            available = and_(
+                NotificationOutbox.sent_at.is_(None),
+                NotificationOutbox.attempts < config.OUTBOX_MAX_ATTEMPTS,
+                or_(
+                    NotificationOutbox.claimed_until.is_(None),
+                    NotificationOutbox.claimed_until < now
+                )
+            )
+            pending = (
+                select(NotificationOutbox.id)
+                .where(available)
+                .order_by(NotificationOutbox.id)
+                .limit(limit)
+                .scalar_subquery()
+            )
+            
+            await session.execute(
+                update(NotificationOutbox)
+                .where(and_(NotificationOutbox.id.in_(pending), available))
+                .values(
+                    claim_token=token,
+                    claimed_until=now + timedelta(seconds=config.OUTBOX_LEASE_SECONDS),
+                    attempts=NotificationOutbox.attempts + 1
+                )
+                .execution_options(synchronize_session=False)
             )
-            session.add(history)
             await session.commit()
-            logger.debug(f"Добавлена запись в историю цен: товар {item_id}, цена {price}")
+            
+            result = await session.execute(
+                select(NotificationOutbox)
+                .where(NotificationOutbox.claim_token == token)
+                .order_by(NotificationOutbox.id)
+            )
+            return list(result.scalars().all())
     
-    async def get_price_history(self, item_id: int, days: int = 7) -> List[PriceHistory]:
-        """Получить историю цен товара за последние N дней"""
+    async def mark_notifications_sent(self, ids: List[int]):
+        """Отметить уведомления отправленными (одним запросом)"""
+        if not ids:
+            return
+        
+        async with self._session() as session:
+            await session.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.id.in_(ids))
+                .values(sent_at=datetime.utcnow(), claim_token=None, claimed_until=None)
+            )
+            await self._commit(session)
+    
+    async def release_notifications(self, ids: List[int]):
+        """Вернуть уведомления в очередь без ожидания окончания аренды"""
+        if not ids:
+            return
+        
+        async with self._session() as session:
+            await session.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.id.in_(ids))
+                .values(
+                    claim_token=None,
+                    claimed_until=None,
+                    attempts=NotificationOutbox.attempts - 1
+                )
+            )
+            await self._commit(session)
+    
+    async def drop_notifications(self, ids: List[int]):
+        """Больше не пытаться отправить уведомления (например, бот заблокирован)"""
+        if not ids:
+            return
+        
+        async with self._session() as session:
+            await session.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.id.in_(ids))
+                .values(attempts=config.OUTBOX_MAX_ATTEMPTS, claim_token=None)
+            )
+            await self._commit(session)
+    
+    async def cleanup_sent_notifications(self, days: int = 7):
+        """Удалить отправленные и брошенные уведомления старше N дней"""
         async with self.async_session() as session:
             cutoff_date = datetime.utcnow() - timedelta(days=days)
             result = await session.execute(
-                select(PriceHistory)
+                delete(NotificationOutbox).where(
+                    and_(
+                        NotificationOutbox.created_at < cutoff_date,
+                        or_(
+                            NotificationOutbox.sent_at.isnot(None),
+                            NotificationOutbox.attempts >= config.OUTBOX_MAX_ATTEMPTS
+                        )
+                    )
+                )
+            )
+            await session.commit()
+            logger.info(f"Удалено {result.rowcount} старых уведомлений из outbox")
+    
+    # === Операции с историей цен ===
+    
+    async def _latest_runs(self, session: AsyncSession, item_ids: List[int],
+                           since: datetime) -> Dict[int, Row]:
+        """Последние серии истории товаров, начатые не раньше since: {item_id: (id, item_id, price, timestamp)}"""
+        runs: Dict[int, Row] = {}
+        for chunk in _chunks(item_ids, BATCH_CHUNK_SIZE):
+            latest = (
+                select(PriceHistory.item_id, func.max(PriceHistory.timestamp).label("timestamp"))
+                .where(and_(PriceHistory.item_id.in_(chunk), PriceHistory.timestamp >= since))
+                .group_by(PriceHistory.item_id)
+                .subquery()
+            )
+            result = await session.execute(
+                select(PriceHistory.id, PriceHistory.item_id, PriceHistory.price, PriceHistory.timestamp)
+                .join(latest, and_(
+                    PriceHistory.item_id == latest.c.item_id,
+                    PriceHistory.timestamp == latest.c.timestamp
+                ))
+                .order_by(PriceHistory.id)
+            )
+            for run in result.all():
+                runs[run.item_id] = run
+        return runs
+    
+    async def _add_history(self, session: AsyncSession, prices: Dict[int, float], now: datetime):
+        """
+        Записать цены в историю и обновить агрегаты за час и день
+        
+        История хранится сериями: если цена совпадает с последней серией
+        товара, серия продлевается (last_seen, observations) одним пакетным
+        UPDATE, иначе новая серия добавляется многострочным INSERT. Серии не
+        переходят через границу месяца, поэтому очистка целыми месяцами
+        (секции PostgreSQL) не задевает текущие серии.
+        
+        Агрегаты обновляются одним пакетным UPSERT на уровень: open задается
+        первой записью периода, close - последней, high/low/sum/count копятся.
+        """
+        latest = await self._latest_runs(session, list(prices), _month_start(now))
+        
+        extended, new_runs = [], []
+        for item_id, price in prices.items():
+            run = latest.get(item_id)
+            if run is not None and run.price == price:
+                extended.append({"b_id": run.id, "b_timestamp": run.timestamp})
+            else:
+                new_runs.append({
+                    "item_id": item_id, "price": price, "timestamp": now,
+                    "last_seen": now, "observations": 1
+                })
+        
+        if extended:
+            history = PriceHistory.__table__
+            await session.execute(
+                update(history)
+                .where(
+                    and_(
+                        history.c.id == bindparam("b_id"),
+                        # Ключ секционирования - чтобы PostgreSQL искал только в одной секции
+                        history.c.timestamp == bindparam("b_timestamp")
+                    )
+                )
+                .values(last_seen=now, observations=history.c.observations + 1),
+                extended
+            )
+        for chunk in _chunks(new_runs, BATCH_CHUNK_SIZE):
+            await session.execute(insert(PriceHistory.__table__).values(chunk))
+        
+        await self._upsert_rollups(session, [
+            (item_id, resolution, _bucket_start(now, resolution), price, price, price, price, price, 1)
+            for item_id, price in prices.items()
+            for resolution in (ROLLUP_HOUR, ROLLUP_DAY)
+        ])
+    
+    async def _upsert_rollups(self, session: AsyncSession, rows: List[tuple]):
+        """
+        Слить частичные агрегаты в price_rollups
+        
+        rows - кортежи (item_id, resolution, bucket_start, open, high, low,
+        close, price_sum, count) в хронологическом порядке.
+        """
+        if not rows:
+            return
+        
+        stmt = self._insert(PriceRollup.__table__)
+        excluded = stmt.excluded
+        rollups = PriceRollup.__table__.c
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["item_id", "resolution", "bucket_start"],
+            set_={
+                "high": self._greatest(rollups.high, excluded.high),
+                "low": self._least(rollups.low, excluded.low),
+                "close": excluded.close,
+                "price_sum": rollups.price_sum + excluded.price_sum,
+                "count": rollups.count + excluded.count,
+            }
+        )
+        
+        keys = ("item_id", "resolution", "bucket_start", "open", "high", "low", "close", "price_sum", "count")
+        await session.execute(stmt, [dict(zip(keys, row)) for row in rows])
+    
+    async def add_price_history(self, item_id: int, price: float):
+        """Добавить запись в историю цен"""
+        async with self._session() as session:
+            await self._add_history(session, {item_id: price}, datetime.utcnow())
+            await self._commit(session)
+            logger.debug(f"Добавлена запись в историю цен: товар {item_id}, цена {price}")
+    
+    async def get_price_history(self, item_id: int, days: int = 7) -> List[PriceObservation]:
+        """
+        Получить сырую историю цен товара за последние N дней (новые первыми)
+        
+        Серии одинаковой цены разворачиваются в отдельные наблюдения.
+        """
+        async with self._session() as session:
+            cutoff_date = datetime.utcnow() - timedelta(days=days)
+            result = await session.execute(
+                select(PriceHistory.price, PriceHistory.timestamp,
+                       PriceHistory.last_seen, PriceHistory.observations)
                 .where(
                     and_(
                         PriceHistory.item_id == item_id,
-                        PriceHistory.timestamp >= cutoff_date
+                        or_(
+                            PriceHistory.timestamp >= cutoff_date,
+                            PriceHistory.last_seen >= cutoff_date
+                        )
                     )
                 )
                 .order_by(PriceHistory.timestamp.desc())
             )
-            history = result.scalars().all()
-            return list(history)
+            
+            history = []
+            for price, first_seen, last_seen, observations in result.all():
+                history.extend(
+                    PriceObservation(item_id, price, timestamp)
+                    for timestamp in reversed(_expand_run(first_seen, last_seen, observations))
+                    if timestamp >= cutoff_date
+                )
+            return history
     
-    async def cleanup_old_price_history(self, days: int = 7):
-        """Очистить историю цен старше указанного количества дней"""
-        async with self.async_session() as session:
+    async def get_price_columns(self, item_id: int, days: int = 30) -> PriceColumns:
+        """
+        Сырая история цен товара за N дней столбцами NumPy (старые первыми)
+        
+        Серии читаются одним запросом кортежами, без ORM-объектов, и
+        разворачиваются в наблюдения векторно (как в _expand_run: наблюдения
+        серии равномерно распределены между первым и последним).
+        """
+        async with self._session() as session:
             cutoff_date = datetime.utcnow() - timedelta(days=days)
             result = await session.execute(
-                delete(PriceHistory).where(PriceHistory.timestamp < cutoff_date)
+                select(PriceHistory.price, PriceHistory.timestamp,
+                       PriceHistory.last_seen, PriceHistory.observations)
+                .where(
+                    and_(
+                        PriceHistory.item_id == item_id,
+                        or_(
+                            PriceHistory.timestamp >= cutoff_date,
+                            PriceHistory.last_seen >= cutoff_date
+                        )
+                    )
+                )
+                .order_by(PriceHistory.timestamp)
+            )
+            rows = result.all()
+        
+        if not rows:
+            return PriceColumns(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+        
+        prices, first_seen, last_seen, observations = zip(*rows)
+        first = np.array(first_seen, dtype="datetime64[us]").astype(np.int64)
+        last = np.array(
+            [seen or start for start, seen in zip(first_seen, last_seen)], dtype="datetime64[us]"
+        ).astype(np.int64)
+        
+        counts = np.where(last > first, np.maximum(np.array(observations, dtype=np.int64), 1), 1)
+        steps = (last - first) // np.maximum(counts - 1, 1)
+        # Номер наблюдения внутри своей серии
+        index = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        
+        timestamps = np.repeat(first, counts) + np.repeat(steps, counts) * index
+        values = np.repeat(np.array(prices, dtype=np.float64), counts)
+        
+        keep = timestamps >= np.datetime64(cutoff_date, "us").astype(np.int64)
+        return PriceColumns(timestamps[keep], values[keep])
+    
+    async def get_rollup_columns(self, item_id: int, days: int, resolution: str = ROLLUP_HOUR) -> RollupColumns:
+        """Агрегаты истории цен товара за N дней столбцами NumPy (один запрос кортежами)"""
+        async with self._session() as session:
+            cutoff_date = _bucket_start(datetime.utcnow() - timedelta(days=days), resolution)
+            result = await session.execute(
+                select(PriceRollup.bucket_start, PriceRollup.open, PriceRollup.high, PriceRollup.low,
+                       PriceRollup.close, PriceRollup.price_sum, PriceRollup.count)
+                .where(
+                    and_(
+                        PriceRollup.item_id == item_id,
+                        PriceRollup.resolution == resolution,
+                        PriceRollup.bucket_start >= cutoff_date
+                    )
+                )
+                .order_by(PriceRollup.bucket_start)
+            )
+            rows = result.all()
+        
+        columns = list(zip(*rows)) if rows else [()] * len(RollupColumns._fields)
+        return RollupColumns(
+            np.array(columns[0], dtype="datetime64[us]").astype(np.int64),
+            *(np.array(column, dtype=np.float64) for column in columns[1:6]),
+            np.array(columns[6], dtype=np.int64)
+        )
+    
+    async def get_price_series(self, item_id: int, days: int = 7) -> List[PricePoint]:
+        """
+        Получить историю цен товара за N дней из подходящего уровня хранения
+        
+        До RAW_HISTORY_DAYS - сырые записи, до HOURLY_ROLLUP_DAYS - агрегаты
+        по часам, дальше - по дням. Точки отсортированы по времени.
+        """
+        if days <= config.RAW_HISTORY_DAYS:
+            history = await self.get_price_history(item_id, days)
+            return [
+                PricePoint(h.timestamp, h.price, h.price, h.price, h.price, h.price, 1)
+                for h in reversed(history)
+            ]
+        
+        resolution = ROLLUP_HOUR if days <= config.HOURLY_ROLLUP_DAYS else ROLLUP_DAY
+        async with self._session() as session:
+            cutoff_date = _bucket_start(datetime.utcnow() - timedelta(days=days), resolution)
+            result = await session.execute(
+                select(PriceRollup)
+                .where(
+                    and_(
+                        PriceRollup.item_id == item_id,
+                        PriceRollup.resolution == resolution,
+                        PriceRollup.bucket_start >= cutoff_date
+                    )
+                )
+                .order_by(PriceRollup.bucket_start)
+            )
+            return [
+                PricePoint(r.bucket_start, r.open, r.high, r.low, r.close, r.avg, r.count)
+                for r in result.scalars().all()
+            ]
+    
+    async def backfill_price_rollups(self):
+        """
+        Построить агрегаты по уже накопленной сырой истории
+        
+        Выполняется, только если таблица агрегатов пуста (первый запуск
+        после обновления).
+        """
+        async with self.async_session() as session:
+            has_rollups = await session.execute(select(PriceRollup.id).limit(1))
+            if has_rollups.first():
+                return
+            
+            result = await session.stream(
+                select(PriceHistory.item_id, PriceHistory.price, PriceHistory.timestamp,
+                       PriceHistory.last_seen, PriceHistory.observations)
+                .order_by(PriceHistory.item_id, PriceHistory.timestamp)
             )
+            
+            buckets: Dict[tuple, list] = {}
+            async for item_id, price, first_seen, last_seen, observations in result:
+                for timestamp in _expand_run(first_seen, last_seen, observations):
+                    for resolution in (ROLLUP_HOUR, ROLLUP_DAY):
+                        key = (item_id, resolution, _bucket_start(timestamp, resolution))
+                        bucket = buckets.get(key)
+                        if bucket is None:
+                            buckets[key] = [price, price, price, price, price, 1]
+                        else:
+                            bucket[1] = max(bucket[1], price)
+                            bucket[2] = min(bucket[2], price)
+                            bucket[3] = price
+                            bucket[4] += price
+                            bucket[5] += 1
+            
+            rows = [key + tuple(values) for key, values in buckets.items()]
+            for chunk in _chunks(rows, BATCH_CHUNK_SIZE):
+                await self._upsert_rollups(session, chunk)
             await session.commit()
-            logger.info(f"Удалено {result.rowcount} старых записей из истории цен")
+            
+            if rows:
+                logger.info(f"Построено агрегатов истории цен: {len(rows)}")
+    
+    async def archive_price_history(self, archive: PriceArchive,
+                                    lag: timedelta = timedelta(minutes=5)) -> int:
+        """
+        Выгрузить новую сырую историю цен в колоночный архив
+        
+        Серия продлевается повторными наблюдениями уже после выгрузки своего
+        начала, поэтому выбираются серии, у которых последнее наблюдение новее
+        водяной метки архива, и разворачиваются в наблюдения (_expand_run) не
+        новее until = сейчас - lag (чтобы не пропустить еще не зафиксированные
+        пачки). Уже выгруженные наблюдения архив пропускает (PriceArchive.append).
+        Строки читаются потоком и дописываются пачками, запись файлов - в
+        отдельном потоке. Возвращает количество выгруженных записей.
+        """
+        since = archive.watermark
+        until = datetime.utcnow() - lag
+        
+        query = select(
+            PriceHistory.item_id, PriceHistory.price, PriceHistory.timestamp,
+            PriceHistory.last_seen, PriceHistory.observations
+        )
+        if since is not None:
+            # Новые серии пишутся с last_seen, NULL - только у старых записей:
+            # обе ветки условия идут по индексу last_seen, без просмотра всей таблицы.
+            # Граница until проверяется при разворачивании: условие timestamp <= until
+            # в запросе увело бы SQLite на почти полный просмотр индекса timestamp
+            query = query.where(or_(
+                PriceHistory.last_seen > since,
+                and_(PriceHistory.last_seen.is_(None), PriceHistory.timestamp > since)
+            ))
+        
+        appended = 0
+        async with self.async_session() as session:
+            result = await session.stream(query.order_by(PriceHistory.timestamp, PriceHistory.id))
+            async for runs in result.partitions(config.ARCHIVE_BATCH_SIZE):
+                rows = [
+                    (item_id, timestamp, price)
+                    for item_id, price, first_seen, last_seen, observations in runs
+                    for timestamp in _expand_run(first_seen, last_seen, observations)
+                    if timestamp <= until
+                ]
+                appended += await asyncio.to_thread(archive.append_rows, rows)
+        
+        archive.watermark = until
+        if appended:
+            logger.info(f"Выгружено в архив записей истории цен: {appended}")
+        return appended
+    
+    async def _delete_batched(self, table, condition, key_columns: List[Any],
+                              deadline: float, cursor_key: str) -> Tuple[int, bool]:
+        """
+        Удалять строки небольшими пачками до исчерпания или до дедлайна
+        
+        Пачка выбирается по keyset-курсору (key_columns, последний столбец - id),
+        удаляется по id и сразу коммитится, поэтому блокировка записи держится
+        только на время одной пачки. Между пачками управление отдается другим
+        задачам. Курсор запоминается под cursor_key (у каждого прохода свой,
+        даже по одной таблице), и следующий запуск продолжает с места
+        остановки. Курсор хранится только в памяти процесса: после
+        перезапуска проход начинается сначала - уже удаленные строки
+        не мешают, повторно просматривается только начало индекса.
+        
+        Возвращает (удалено строк, дошли ли до конца).
+        """
+        cursor = self._cleanup_cursors.get(cursor_key)
+        deleted = 0
+        
+        while True:
+            async with self.async_session() as session:
+                query = select(*key_columns).where(condition)
+                if cursor is not None:
+                    query = query.where(tuple_(*key_columns) > tuple_(*cursor))
+                
+                result = await session.execute(
+                    query.order_by(*key_columns).limit(config.CLEANUP_BATCH_SIZE)
+                )
+                keys = result.all()
+                
+                if keys:
+                    await session.execute(
+                        delete(table).where(table.c.id.in_([key[-1] for key in keys]))
+                    )
+                    await session.commit()
+            
+            deleted += len(keys)
+            
+            if len(keys) < config.CLEANUP_BATCH_SIZE:
+                # Дошли до конца - следующий проход начнется сначала
+                self._cleanup_cursors.pop(cursor_key, None)
+                return deleted, True
+            
+            cursor = tuple(keys[-1])
+            self._cleanup_cursors[cursor_key] = cursor
+            
+            if time.monotonic() >= deadline:
+                return deleted, False
+            
+            await asyncio.sleep(config.CLEANUP_BATCH_PAUSE)
+    
+    async def _incremental_vacuum(self):
+        """Вернуть освобожденные страницы SQLite файлу (порциями)"""
+        if self.engine.dialect.name != "sqlite":
+            return
+        
+        async with self.engine.connect() as conn:
+            result = await conn.exec_driver_sql("PRAGMA auto_vacuum")
+            if result.scalar() != SQLITE_AUTO_VACUUM_INCREMENTAL:
+                return
+            
+            await conn.exec_driver_sql(
+                f"PRAGMA incremental_vacuum({config.SQLITE_VACUUM_PAGES})"
+            )
+            await conn.commit()
+    
+    async def cleanup_old_price_history(self, days: Optional[int] = None,
+                                        time_budget: Optional[float] = None) -> bool:
+        """
+        Очистить устаревшую историю цен по уровням хранения
+        
+        Сырые записи хранятся days дней (по умолчанию RAW_HISTORY_DAYS),
+        агрегаты по часам - HOURLY_ROLLUP_DAYS, по дням - DAILY_ROLLUP_DAYS.
+        Удаление идет пачками в пределах time_budget секунд (по умолчанию
+        CLEANUP_TIME_BUDGET) и не держит долгих блокировок записи; если
+        бюджета не хватило, следующий запуск продолжит с места остановки
+        (в пределах жизни процесса, см. _delete_batched).
+        
+        В PostgreSQL сырая история удаляется целыми месячными секциями.
+        
+        Возвращает True, если все устаревшие записи удалены.
+        """
+        if days is None:
+            days = config.RAW_HISTORY_DAYS
+        if time_budget is None:
+            time_budget = config.CLEANUP_TIME_BUDGET
+        
+        deadline = time.monotonic() + time_budget
+        now = datetime.utcnow()
+        
+        if self.engine.dialect.name == "postgresql":
+            # История секционирована по месяцам: устаревшие месяцы удаляются
+            # целиком, сырые записи хранятся от days дней до месяца дольше
+            await self.ensure_price_history_partitions()
+            partitions_dropped = await self._drop_expired_partitions(now - timedelta(days=days))
+            history_deleted, finished = 0, True
+            if partitions_dropped:
+                logger.info(f"Удалено секций истории цен: {partitions_dropped}")
+        else:
+            cutoff = now - timedelta(days=days)
+            history_deleted, finished = await self._delete_batched(
+                PriceHistory.__table__,
+                # Серия удаляется, когда устарело ее последнее наблюдение
+                and_(
+                    PriceHistory.timestamp < cutoff,
+                    or_(PriceHistory.last_seen.is_(None), PriceHistory.last_seen < cutoff)
+                ),
+                [PriceHistory.timestamp, PriceHistory.id],
+                deadline,
+                cursor_key="price_history"
+            )
+        
+        rollups_deleted = 0
+        for resolution, keep_days in ((ROLLUP_HOUR, config.HOURLY_ROLLUP_DAYS),
+                                      (ROLLUP_DAY, config.DAILY_ROLLUP_DAYS)):
+            if not finished or time.monotonic() >= deadline:
+                finished = False
+                break
+            
+            count, finished = await self._delete_batched(
+                PriceRollup.__table__,
+                and_(
+                    PriceRollup.resolution == resolution,
+                    PriceRollup.bucket_start < now - timedelta(days=keep_days)
+                ),
+                [PriceRollup.bucket_start, PriceRollup.id],
+                deadline,
+                cursor_key=f"price_rollups:{resolution}"
+            )
+            rollups_deleted += count
+        
+        if history_deleted or rollups_deleted:
+            await self._incremental_vacuum()
+        
+        logger.info(
+            f"Удалено {history_deleted} старых записей из истории цен "
+            f"и {rollups_deleted} устаревших агрегатов"
+            f"{'' if finished else ' (продолжение при следующем запуске)'}"
+        )
+        return finished
 
 
 # Глобальный экземпляр базы данных
@@ -1,6 +1,6 @@
 from datetime import datetime
-from sqlalchemy import BigInteger, String, Float, DateTime, Integer, ForeignKey, Table, Column
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy import BigInteger, Boolean, String, Text, Float, DateTime, Integer, ForeignKey, Table, Column, Index, UniqueConstraint
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, synonym
 from typing import List
 
 
@@ -16,18 +16,30 @@ user_items = Table(
     Column("user_id", BigInteger, ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True),
     Column("item_id", Integer, ForeignKey("items.id", ondelete="CASCADE"), primary_key=True),
     Column("subscribed_at", DateTime, default=datetime.utcnow, nullable=False),
+    # Позиция в портфеле: количество и цена покупки (CNY за штуку)
+    Column("quantity", Integer, default=0, server_default="0", nullable=False),
+    Column("buy_price", Float, nullable=True),
+    # Поиск подписчиков товара (первичный ключ начинается с user_id)
+    Index("ix_user_items_item_id", "item_id"),
 )
 
 
 class User(Base):
     """Модель пользователя"""
     __tablename__ = "users"
+    __table_args__ = (
+        # Отбор пользователей, которым пора проверять цены
+        Index("ix_users_notifications_last_check", "notifications_enabled", "last_check"),
+    )
     
-    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)  # Telegram ID
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     check_interval: Mapped[int] = mapped_column(Integer, default=60, nullable=False)  # Интервал проверки в минутах (15-1440)
-    notifications_enabled: Mapped[bool] = mapped_column(Integer, default=1, nullable=False)  # SQLite не имеет Boolean
+    notifications_enabled: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)  # В SQLite хранится как 0/1
     last_check: Mapped[datetime] = mapped_column(DateTime, nullable=True)  # Время последней проверки
+    # Итоги портфеля в CNY: обновляются инкрементально при изменении цен и позиций
+    portfolio_value: Mapped[float] = mapped_column(Float, default=0.0, server_default="0", nullable=False)
+    portfolio_cost: Mapped[float] = mapped_column(Float, default=0.0, server_default="0", nullable=False)
     
     # Связь many-to-many с товарами через user_items
     items: Mapped[List["Item"]] = relationship(
@@ -39,6 +51,42 @@ class User(Base):
         return f"User(user_id={self.user_id}, check_interval={self.check_interval}min)"
 
 
+class AllowedUser(Base):
+    """
+    Модель записи списка доступа
+    
+    role - "admin" (может выдавать и отзывать доступ) или "user".
+    Администраторы из ALLOWED_USER_IDS добавляются при каждом запуске.
+    """
+    __tablename__ = "allowed_users"
+    
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)  # Telegram ID
+    role: Mapped[str] = mapped_column(String(16), default="user", nullable=False)
+    added_by: Mapped[int] = mapped_column(BigInteger, nullable=True)  # Кто выдал доступ (NULL - из конфигурации)
+    added_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self) -> str:
+        return f"AllowedUser(user_id={self.user_id}, role={self.role})"
+
+
+class FsmState(Base):
+    """
+    Модель состояния диалога (FSM aiogram)
+    
+    Одна запись на ключ FSM (бот, чат, пользователь). Запись без состояния
+    и данных удаляется сразу, брошенный диалог - после expires_at.
+    """
+    __tablename__ = "fsm_states"
+    
+    key: Mapped[str] = mapped_column(String(200), primary_key=True)
+    state: Mapped[str] = mapped_column(String(200), nullable=True)
+    data: Mapped[str] = mapped_column(Text, default="{}", nullable=False)  # JSON
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+    
+    def __repr__(self) -> str:
+        return f"FsmState(key={self.key}, state={self.state})"
+
+
 class Item(Base):
     """Модель товара (общая для всех пользователей)"""
     __tablename__ = "items"
@@ -67,16 +115,101 @@ class Item(Base):
 
 
 class PriceHistory(Base):
-    """Модель истории изменения цен"""
+    """
+    Модель истории изменения цен (серии одинаковой цены)
+    
+    Одна строка - серия подряд идущих наблюдений одной цены: timestamp
+    (first_seen) - первое наблюдение, last_seen - последнее, observations -
+    количество наблюдений. Повторное наблюдение той же цены продлевает
+    серию, а не добавляет строку.
+    
+    В PostgreSQL таблица создается секционированной по месяцам
+    (см. database.db), первичный ключ там - (id, timestamp).
+    """
     __tablename__ = "price_history"
+    __table_args__ = (
+        # История товара за период: WHERE item_id = ? AND timestamp >= ?
+        Index("ix_price_history_item_id_timestamp", "item_id", "timestamp"),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     item_id: Mapped[int] = mapped_column(Integer, ForeignKey("items.id", ondelete="CASCADE"))
     price: Mapped[float] = mapped_column(Float, nullable=False)
-    timestamp: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    timestamp: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)  # Начало серии
+    # Последнее наблюдение (NULL - как timestamp), индекс - для выгрузки продленных серий в архив
+    last_seen: Mapped[datetime] = mapped_column(DateTime, nullable=True, index=True)
+    observations: Mapped[int] = mapped_column(Integer, default=1, server_default="1", nullable=False)
+    
+    first_seen = synonym("timestamp")
     
     # Связь с товаром
     item: Mapped["Item"] = relationship(back_populates="price_history")
     
     def __repr__(self) -> str:
-        return f"PriceHistory(id={self.id}, item_id={self.item_id}, price={self.price}, timestamp={self.timestamp})"
+        return (
+            f"PriceHistory(id={self.id}, item_id={self.item_id}, price={self.price}, "
+            f"timestamp={self.timestamp}, last_seen={self.last_seen}, n={self.observations})"
+        )
+
+
+class PriceRollup(Base):
+    """
+    Модель агрегата истории цен за час или за день
+    
+    Обновляется инкрементально при каждой новой записи в price_history,
+    поэтому сырая история может храниться недолго, а тренды за месяцы
+    остаются доступны.
+    """
+    __tablename__ = "price_rollups"
+    __table_args__ = (
+        UniqueConstraint("item_id", "resolution", "bucket_start", name="uq_price_rollups_bucket"),
+    )
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    item_id: Mapped[int] = mapped_column(Integer, ForeignKey("items.id", ondelete="CASCADE"), nullable=False)
+    resolution: Mapped[str] = mapped_column(String(8), nullable=False)  # "hour" или "day"
+    bucket_start: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+    open: Mapped[float] = mapped_column(Float, nullable=False)
+    high: Mapped[float] = mapped_column(Float, nullable=False)  # максимум
+    low: Mapped[float] = mapped_column(Float, nullable=False)  # минимум
+    close: Mapped[float] = mapped_column(Float, nullable=False)
+    price_sum: Mapped[float] = mapped_column(Float, nullable=False)  # для среднего
+    count: Mapped[int] = mapped_column(Integer, nullable=False)
+    
+    @property
+    def avg(self) -> float:
+        """Средняя цена за период"""
+        return self.price_sum / self.count if self.count else self.close
+    
+    def __repr__(self) -> str:
+        return (
+            f"PriceRollup(item_id={self.item_id}, {self.resolution}={self.bucket_start}, "
+            f"o={self.open}, h={self.high}, l={self.low}, c={self.close}, n={self.count})"
+        )
+
+
+class NotificationOutbox(Base):
+    """
+    Модель исходящего уведомления (outbox)
+    
+    Записывается в одной транзакции с обновлением цены, отправляется
+    фоновым отправителем. Доставка at-least-once, повторная постановка
+    в очередь того же уведомления отсекается по idempotency_key.
+    """
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        Index("ix_notification_outbox_pending", "sent_at", "claimed_until"),
+    )
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    idempotency_key: Mapped[str] = mapped_column(String(200), unique=True, nullable=False)
+    text: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    claim_token: Mapped[str] = mapped_column(String(32), nullable=True)  # Кто забрал запись на отправку
+    claimed_until: Mapped[datetime] = mapped_column(DateTime, nullable=True)  # До какого времени запись занята
+    sent_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    
+    def __repr__(self) -> str:
+        return f"NotificationOutbox(id={self.id}, user_id={self.user_id}, key={self.idempotency_key})"
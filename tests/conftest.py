@@ -0,0 +1,39 @@
+import asyncio
+import inspect
+
+import pytest
+
+from database.db import Database
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    """
+    Запуск async-тестов в собственном цикле событий
+
+    Если тест принимает фикстуру database, БД создается перед тестом
+    в том же цикле и закрывается после него.
+    """
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+
+    funcargs = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(_run_async_test(pyfuncitem.obj, funcargs))
+    return True
+
+
+async def _run_async_test(test, funcargs):
+    database = funcargs.get("database")
+    if database is not None:
+        await database.init_db()
+    try:
+        await test(**funcargs)
+    finally:
+        if database is not None:
+            await database.close()
+
+
+@pytest.fixture
+def database(tmp_path) -> Database:
+    """Пустая БД SQLite во временном каталоге (таблицы создаются при запуске теста)"""
+    return Database(f"sqlite+aiosqlite:///{tmp_path / 'bot.db'}")
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, update
+
+from database.archive import PriceArchive, from_micros
+from database.models import PriceHistory
+
+
+async def test_run_extension_reaches_archive(database, tmp_path):
+    await database.add_user(1)
+    item_id = await database.add_user_subscription(1, 100, "AK-47 | Redline", 10.0)
+    archive = PriceArchive(str(tmp_path / "archive"))
+    start = datetime.utcnow() - timedelta(minutes=60)
+    async with database.async_session() as session:
+        await session.execute(insert(PriceHistory), [{
+            "item_id": item_id, "price": 10.0, "timestamp": start,
+            "last_seen": start + timedelta(minutes=30), "observations": 4,
+        }])
+        await session.commit()
+
+    # Водяная метка - за 25 минут до текущего момента (start + 35 минут)
+    assert await database.archive_price_history(archive, lag=timedelta(minutes=25)) == 4
+
+    # После метки та же цена наблюдалась еще дважды - серия продлилась, начало прежнее
+    async with database.async_session() as session:
+        await session.execute(
+            update(PriceHistory).values(last_seen=start + timedelta(minutes=50), observations=6)
+        )
+        await session.commit()
+
+    assert await database.archive_price_history(archive) == 2
+    assert await database.archive_price_history(archive) == 0
+    with archive.read(item_id) as series:
+        assert [timestamp for timestamp, _ in series] == [
+            start + timedelta(minutes=10 * step) for step in range(6)
+        ]
+        assert set(series.prices) == {10.0}
+        assert from_micros(series.timestamps[-1]) == start + timedelta(minutes=50)
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+import bot.bulk_add as bulk_add_module
+from bot.bulk_add import fetch_goods, format_bulk_summary, parse_goods_ids
+
+
+def test_urls_and_bare_ids_are_mixed():
+    text = (
+        "https://buff.163.com/goods/43012?from=market\n"
+        "781534, 35800; 42\n"
+        "buff.163.com/goods/900 and buff.163.com/goods/901\n"
+    )
+
+    goods_ids, failures = parse_goods_ids(text)
+
+    assert goods_ids == [43012, 781534, 35800, 42, 900, 901]
+    assert failures == []
+
+
+def test_url_line_ignores_other_numbers():
+    goods_ids, _ = parse_goods_ids("2 шт. https://buff.163.com/goods/43012")
+
+    assert goods_ids == [43012]
+
+
+def test_duplicates_are_dropped_in_order():
+    goods_ids, _ = parse_goods_ids("3 1\n1\nhttps://buff.163.com/goods/3\n2 3")
+
+    assert goods_ids == [3, 1, 2]
+
+
+def test_bad_lines_are_reported_with_line_numbers():
+    text = "43012\n\nAK-47 | Redline\n781534\n" + "x" * 50
+
+    goods_ids, failures = parse_goods_ids(text)
+
+    assert goods_ids == [43012, 781534]
+    assert len(failures) == 2
+    assert failures[0].startswith("строка 3:")
+    assert "AK-47 | Redline" in failures[0]
+    assert failures[1].startswith("строка 5:")
+    assert "x" * 37 + "..." in failures[1]
+
+
+def test_bad_line_is_escaped():
+    _, failures = parse_goods_ids("<b>скин</b>")
+
+    assert "&lt;b&gt;" in failures[0]
+
+
+class FakeBuff:
+    """Buff: 1 - найден, 2 - не найден, 3 - дедлайн, 4 - ошибка API"""
+
+    async def get_item_price(self, goods_id, priority=None, raise_errors=False):
+        assert raise_errors
+        if goods_id == 3:
+            raise asyncio.TimeoutError()
+        if goods_id == 4:
+            raise RuntimeError("502 Bad Gateway")
+        if goods_id == 2:
+            return None
+        return {"goods_id": goods_id, "market_hash_name": "AK-47 | Redline", "min_price": 10.0}
+
+
+@pytest.fixture
+def buff(monkeypatch):
+    monkeypatch.setattr(bulk_add_module, "buff_client", FakeBuff())
+
+
+async def test_fetch_errors_are_not_reported_as_missing(buff):
+    results = await fetch_goods([4, 1, 3, 2])
+
+    assert list(results.found) == [1]
+    assert results.not_found == [2]
+    assert results.errors == [4, 3]
+
+
+def test_summary_has_retry_hint_for_fetch_errors():
+    summary = format_bulk_summary([], [], [2], [4, 3], [])
+
+    assert "Не найдены на Buff (1)" in summary
+    assert "Не удалось проверить (2)" in summary
+    assert "<code>4 3</code>" in summary
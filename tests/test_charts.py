@@ -0,0 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+
+import bot.charts as charts_module
+from bot.charts import ChartRenderer
+from database.db import PricePoint
+
+BUCKET = datetime(2026, 3, 15, 12, 0)
+
+
+@pytest.fixture
+def renderer(monkeypatch):
+    rendered = []
+
+    def render_chart(title, days, timestamps, closes, lows, highs):
+        rendered.append(closes[-1])
+        return f"png:{closes[-1]}".encode()
+
+    monkeypatch.setattr(charts_module, "render_chart", render_chart)
+    renderer = ChartRenderer(workers=1, cache_bytes=1024)
+    renderer._executor = ThreadPoolExecutor(max_workers=1)
+    renderer.rendered = rendered
+    yield renderer
+    renderer.shutdown()
+
+
+def hourly_point(close: float, count: int) -> PricePoint:
+    return PricePoint(BUCKET, 10.0, max(10.0, close), min(10.0, close), close, close, count)
+
+
+async def test_repeated_view_is_served_from_cache(renderer):
+    points = [hourly_point(10.0, 1)]
+
+    first = await renderer.render(1, "AK", 30, points)
+    second = await renderer.render(1, "AK", 30, points)
+
+    assert first == second
+    assert renderer.rendered == [10.0]
+
+
+async def test_new_price_inside_current_bucket_renders_again(renderer):
+    await renderer.render(1, "AK", 30, [hourly_point(10.0, 1)])
+
+    # Новая цена в том же часе: начало периода не изменилось, close и count - да
+    png = await renderer.render(1, "AK", 30, [hourly_point(11.0, 2)])
+
+    assert png == b"png:11.0"
+    assert renderer.rendered == [10.0, 11.0]
+
+
+async def test_point_leaving_window_renders_again(renderer):
+    older = PricePoint(datetime(2026, 3, 14, 12, 0), 9.0, 9.0, 9.0, 9.0, 9.0, 1)
+    latest = hourly_point(10.0, 1)
+    await renderer.render(1, "AK", 1, [older, latest])
+
+    # Новых цен нет, но старая точка вышла из окна
+    await renderer.render(1, "AK", 1, [latest])
+
+    assert renderer.rendered == [10.0, 10.0]
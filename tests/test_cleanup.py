@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from config import config
+from database.db import ROLLUP_DAY, ROLLUP_HOUR
+from database.models import PriceRollup
+
+
+async def add_rollups(database, item_id, resolution, *days_ago):
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    async with database.async_session() as session:
+        await database._upsert_rollups(session, [
+            (item_id, resolution, now - timedelta(days=days), 1.0, 1.0, 1.0, 1.0, 1.0, 1)
+            for days in days_ago
+        ])
+        await session.commit()
+
+
+async def count_rollups(database, resolution):
+    async with database.async_session() as session:
+        result = await session.execute(
+            select(func.count()).select_from(PriceRollup).where(PriceRollup.resolution == resolution)
+        )
+        return result.scalar_one()
+
+
+async def delete_expired(database, resolution, keep_days, deadline):
+    return await database._delete_batched(
+        PriceRollup.__table__,
+        (PriceRollup.resolution == resolution)
+        & (PriceRollup.bucket_start < datetime.utcnow() - timedelta(days=keep_days)),
+        [PriceRollup.bucket_start, PriceRollup.id],
+        deadline,
+        cursor_key=f"price_rollups:{resolution}"
+    )
+
+
+async def test_interrupted_day_pass_does_not_skip_hourly_rows(database, monkeypatch):
+    monkeypatch.setattr(config, "CLEANUP_BATCH_SIZE", 1)
+    monkeypatch.setattr(config, "CLEANUP_BATCH_PAUSE", 0)
+    await database.add_user(1)
+    item_id = await database.add_user_subscription(1, 100, "AK-47 | Redline", 10.0)
+    # Устаревшие часовые агрегаты старше дневных, на которых остановится дневной проход
+    await add_rollups(database, item_id, ROLLUP_HOUR, 2000, 1999)
+    await add_rollups(database, item_id, ROLLUP_DAY, 1200, 1199)
+
+    # Дневной проход удаляет одну пачку и останавливается по дедлайну
+    deleted, finished = await delete_expired(database, ROLLUP_DAY, config.DAILY_ROLLUP_DAYS, deadline=0)
+    assert (deleted, finished) == (1, False)
+
+    # Курсор дневного прохода не влияет на часовой
+    await delete_expired(database, ROLLUP_HOUR, config.HOURLY_ROLLUP_DAYS, deadline=float("inf"))
+    assert await count_rollups(database, ROLLUP_HOUR) == 0
+
+    # Дневной проход продолжает со своего места
+    await delete_expired(database, ROLLUP_DAY, config.DAILY_ROLLUP_DAYS, deadline=float("inf"))
+    assert await count_rollups(database, ROLLUP_DAY) == 0
+
+
+async def test_cleanup_removes_expired_rollups_at_both_resolutions(database, monkeypatch):
+    monkeypatch.setattr(config, "CLEANUP_BATCH_SIZE", 2)
+    monkeypatch.setattr(config, "CLEANUP_BATCH_PAUSE", 0)
+    await database.add_user(1)
+    item_id = await database.add_user_subscription(1, 100, "AK-47 | Redline", 10.0)
+    await add_rollups(database, item_id, ROLLUP_HOUR, 200, 150, 100, 1)
+    await add_rollups(database, item_id, ROLLUP_DAY, 2000, 1500, 1200, 1)
+
+    finished = await database.cleanup_old_price_history(time_budget=60)
+
+    assert finished
+    assert await count_rollups(database, ROLLUP_HOUR) == 1
+    assert await count_rollups(database, ROLLUP_DAY) == 1
@@ -0,0 +1,64 @@
+import pytest
+
+from bot.fair_queue import FairQueue
+
+
+def drain(queue: FairQueue):
+    return [(user_id, item) for user_id, item, _ in queue]
+
+
+def test_heavy_user_does_not_starve_others():
+    queue = FairQueue()
+    queue.push(1, [f"heavy-{n}" for n in range(100)])
+    queue.push(2, ["a", "b", "c"])
+    queue.push(3, ["x", "y", "z"])
+
+    order = drain(queue)
+
+    # Короткие очереди заканчиваются за первые три раунда, а не после 100 товаров
+    last_light = max(position for position, (user_id, _) in enumerate(order) if user_id != 1)
+    assert last_light < 9
+    assert order[:3] == [(1, "heavy-0"), (2, "a"), (3, "x")]
+    assert len(order) == 106
+
+
+def test_weights_give_proportional_shares():
+    queue = FairQueue(weights={1: 2})
+    queue.push(1, range(10))
+    queue.push(2, range(10))
+
+    first_round = drain(queue)[:3]
+
+    assert [user_id for user_id, _ in first_round] == [1, 1, 2]
+
+
+def test_fractional_quantum_carries_deficit():
+    queue = FairQueue(quantum=0.5)
+    queue.push(1, ["a", "b"])
+
+    # Квант 0.5: товар выдается раз в два раунда, остаток переносится
+    assert drain(queue) == [(1, "a"), (1, "b")]
+
+
+def test_is_last_marks_end_of_each_user_queue():
+    queue = FairQueue()
+    queue.push(1, ["a", "b"])
+    queue.push(2, ["c"])
+
+    flags = {(user_id, item): is_last for user_id, item, is_last in queue}
+
+    assert flags == {(1, "a"): False, (1, "b"): True, (2, "c"): True}
+
+
+def test_empty_queues_are_skipped():
+    queue = FairQueue()
+    queue.push(1, [])
+    queue.push(2, ["a"])
+
+    assert len(queue) == 1
+    assert drain(queue) == [(2, "a")]
+
+
+def test_non_positive_quantum_is_rejected():
+    with pytest.raises(ValueError):
+        FairQueue(quantum=0)
@@ -0,0 +1,84 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+import bot.fsm_storage as fsm_storage_module
+from bot.fsm_storage import DatabaseStorage
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+
+@pytest.fixture
+def reads(monkeypatch, database):
+    """Счетчик чтений FSM из БД"""
+    calls = []
+    get_fsm_state = database.get_fsm_state
+
+    async def counting_get(key):
+        calls.append(key)
+        return await get_fsm_state(key)
+
+    monkeypatch.setattr(database, "get_fsm_state", counting_get)
+    monkeypatch.setattr(fsm_storage_module, "db", database)
+    return calls
+
+
+def make_storage(cache_ttl=60.0, miss_ttl=60.0) -> DatabaseStorage:
+    return DatabaseStorage(timedelta(hours=1), cache_ttl, miss_ttl)
+
+
+async def test_round_trip_survives_restart_and_clear(database, reads):
+    storage = make_storage()
+    await storage.set_state(KEY, "AddItem:price")
+    await storage.set_data(KEY, {"goods_id": 100})
+
+    # Новый экземпляр (пустой кеш) читает запись из БД
+    restarted = make_storage()
+    assert await restarted.get_state(KEY) == "AddItem:price"
+    assert await restarted.get_data(KEY) == {"goods_id": 100}
+
+    await restarted.set_state(KEY, None)
+    await restarted.set_data(KEY, {})
+
+    assert await restarted.get_state(KEY) is None
+    assert await make_storage().get_data(KEY) == {}
+    assert await database.get_fsm_state(restarted.key_builder.build(KEY)) is None
+
+
+async def test_writes_update_cache(database, reads):
+    storage = make_storage()
+    await storage.set_state(KEY, "AddItem:goods")
+    reads.clear()
+
+    await storage.set_data(KEY, {"goods_id": 100})
+    await storage.set_state(KEY, "AddItem:price")
+
+    assert await storage.get_state(KEY) == "AddItem:price"
+    assert await storage.get_data(KEY) == {"goods_id": 100}
+    assert reads == []
+
+
+async def test_miss_is_cached_only_for_miss_ttl(database, reads):
+    storage = make_storage(miss_ttl=0.05)
+    other_instance = make_storage()
+
+    assert await storage.get_state(KEY) is None
+    assert await storage.get_state(KEY) is None
+    assert len(reads) == 1
+
+    # Диалог начат на другом экземпляре: отсутствие записи помнится только miss_ttl
+    await other_instance.set_state(KEY, "AddItem:goods")
+    await asyncio.sleep(0.1)
+
+    assert await storage.get_state(KEY) == "AddItem:goods"
+
+
+async def test_disabled_miss_cache_reads_db_every_time(database, reads):
+    storage = make_storage(miss_ttl=0)
+
+    for _ in range(3):
+        assert await storage.get_data(KEY) == {}
+
+    assert len(reads) == 3
@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from api.buff_api import BuffAPIClient, deadline_requests
+from api.request_scheduler import Priority, PriorityScheduler
+from config import config
+
+HEDGE_DELAY = 0.05
+
+
+class FakeApi:
+    """Синхронный API Buff с заданным временем ответа"""
+
+    def __init__(self, name: str, delay: float):
+        self.name = name
+        self.delay = delay
+        self.calls = 0
+        self.release = threading.Event()
+
+    def get_item(self, goods_id):
+        self.calls += 1
+        # Медленный ответ можно прервать в конце теста, чтобы не ждать поток
+        self.release.wait(self.delay)
+        return {"from": self.name, "goods_id": goods_id}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(config, "BUFF_HEDGE_RATIO", 1.0)
+    client = BuffAPIClient.__new__(BuffAPIClient)
+    client.requests_total = 0
+    client.hedged_total = 0
+    client.scheduler = PriorityScheduler(rate=0)
+    # Обычное время ответа известно: p95 = HEDGE_DELAY
+    client.scheduler._service_times.extend([HEDGE_DELAY] * 20)
+    return client
+
+
+def track_runs(monkeypatch, scheduler):
+    """Запоминать задачи, в которых выполняются запросы"""
+    tasks = []
+    original = scheduler.run
+
+    async def run(*args, **kwargs):
+        tasks.append(asyncio.current_task())
+        return await original(*args, **kwargs)
+
+    monkeypatch.setattr(scheduler, "run", run)
+    return tasks
+
+
+async def test_hedge_fires_after_p95_and_loser_is_cancelled(client, monkeypatch):
+    client.api = FakeApi("primary", delay=5)
+    client.hedge_api = FakeApi("hedge", delay=0)
+    tasks = track_runs(monkeypatch, client.scheduler)
+
+    started = time.monotonic()
+    result = await client._request(Priority.INTERACTIVE, 2, "get_item", 1)
+    elapsed = time.monotonic() - started
+    await asyncio.sleep(0)
+
+    assert result["from"] == "hedge"
+    assert HEDGE_DELAY <= elapsed < 1
+    assert client.hedged_total == 1
+    assert tasks[0].cancelled()
+    client.api.release.set()
+
+
+async def test_fast_primary_is_not_hedged(client):
+    client.api = FakeApi("primary", delay=0)
+    client.hedge_api = FakeApi("hedge", delay=0)
+
+    result = await client._request(Priority.INTERACTIVE, 2, "get_item", 1)
+
+    assert result["from"] == "primary"
+    assert client.hedge_api.calls == 0
+
+
+async def test_no_hedge_while_primary_waits_for_rate_limit(client):
+    client.scheduler = PriorityScheduler(rate=5, burst=1)
+    client.scheduler._service_times.extend([HEDGE_DELAY] * 20)
+    client.api = FakeApi("primary", delay=0)
+    client.hedge_api = FakeApi("hedge", delay=0)
+    # Токен израсходован: основной запрос ждет в очереди ~0.2 с, дольше HEDGE_DELAY
+    await client.scheduler.acquire(Priority.SCHEDULED)
+
+    result = await client._request(Priority.SCHEDULED, 2, "get_item", 1)
+
+    assert result["from"] == "primary"
+    assert client.hedged_total == 0
+    assert client.hedge_api.calls == 0
+
+
+class HttpApi:
+    """API Buff, отправляющий запрос так же, как rest_adapter библиотеки"""
+
+    def __init__(self):
+        self.threads = []
+
+    def get_item(self, goods_id):
+        self.threads.append(threading.current_thread().name)
+        return deadline_requests.request(method="GET", url=f"https://buff.163.com/goods/{goods_id}")
+
+
+async def test_http_request_gets_remaining_deadline_on_buff_pool(client, monkeypatch):
+    timeouts = []
+    monkeypatch.setattr(requests, "request", lambda *args, **kwargs: timeouts.append(kwargs["timeout"]) or {})
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="buff")
+    client.scheduler = PriorityScheduler(rate=0, executor=executor)
+    client.api = HttpApi()
+    client.hedge_api = HttpApi()
+
+    try:
+        await client._request(Priority.INTERACTIVE, 2, "get_item", 1)
+    finally:
+        executor.shutdown()
+
+    # Без дедлайна библиотека ждала бы ответ бесконечно
+    assert len(timeouts) == 1
+    assert 1.5 < timeouts[0] <= 2
+    assert client.api.threads[0].startswith("buff")
+    # Вне запроса клиента действует фоновый timeout, а не дедлайн прошлого вызова
+    deadline_requests.request(method="GET", url="https://buff.163.com/")
+    assert timeouts[-1] == config.BUFF_TIMEOUT_BACKGROUND
@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+
+import bot.inline_search as inline_search_module
+from bot.inline_search import InlineSearch, PrefixIndex, normalize_query
+
+
+@pytest.fixture
+def index():
+    index = PrefixIndex()
+    index.add(1, "AK-47 | Redline (Field-Tested)", 10.0)
+    index.add(2, "AK-47 | Redline", 12.0)
+    index.add(3, "AWP | Asiimov", 50.0)
+    index.add(4, "M4A1-S | Hyper Beast", 20.0)
+    return index
+
+
+def goods_ids(entries):
+    return [entry.goods_id for entry in entries]
+
+
+def test_prefix_hits(index):
+    assert set(goods_ids(index.search("red", 10))) == {1, 2}
+    assert goods_ids(index.search("asi", 10)) == [3]
+    assert index.search("zeus", 10) == []
+
+
+def test_multi_token_query_matches_all_words(index):
+    # Короткие названия первыми
+    assert goods_ids(index.search(normalize_query("AK red"), 10)) == [2, 1]
+    assert goods_ids(index.search("ak field", 10)) == [1]
+    assert index.search("ak asiimov", 10) == []
+
+
+def test_limit(index):
+    assert goods_ids(index.search("ak", 1)) == [2]
+
+
+def test_remove_drops_entry_and_unused_words(index):
+    assert index.remove(3)
+    assert not index.remove(3)
+
+    assert index.search("awp", 10) == []
+    assert "asiimov" not in index._tokens
+    assert "asiimov" not in index._postings
+    # Общие слова остаются у других товаров
+    index.remove(2)
+    assert goods_ids(index.search("redline", 10)) == [1]
+    assert len(index) == 2
+
+
+def test_rename_replaces_words(index):
+    index.add(3, "AWP | Dragon Lore", 9000.0)
+
+    assert index.search("asiimov", 10) == []
+    assert goods_ids(index.search("dragon", 10)) == [3]
+
+
+class FakeBuff:
+    def __init__(self):
+        self.queries = []
+
+    async def search_item_by_name(self, query, priority=None):
+        self.queries.append(query)
+        return [{"goods_id": 10, "market_hash_name": "AK-47 | Redline", "min_price": 12.0}]
+
+
+class NoItems:
+    async def get_all_tracked_items(self):
+        return []
+
+
+@pytest.fixture
+def buff(monkeypatch):
+    fake = FakeBuff()
+    monkeypatch.setattr(inline_search_module, "buff_client", fake)
+    monkeypatch.setattr(inline_search_module, "db", NoItems())
+    return fake
+
+
+async def test_superseded_query_is_cancelled(buff):
+    search = InlineSearch(debounce=0.05, search_ttl=60, limit=5)
+
+    first = asyncio.create_task(search.search(1, "ak-4"))
+    await asyncio.sleep(0.01)
+    second = await search.search(1, "ak-47")
+
+    assert await first is None
+    assert buff.queries == ["ak-47"]
+    assert goods_ids(second) == [10]
+
+
+async def test_same_query_from_two_users_is_fetched_once(buff):
+    search = InlineSearch(debounce=0.01, search_ttl=60, limit=5)
+
+    results = await asyncio.gather(search.search(1, "ak"), search.search(2, "ak"))
+
+    assert [goods_ids(result) for result in results] == [[10], [10]]
+    assert buff.queries == ["ak"]
+
+
+class TrackedItems:
+    def __init__(self, *items):
+        self.items = list(items)
+
+    async def get_all_tracked_items(self):
+        return self.items
+
+
+class TrackedItem:
+    def __init__(self, goods_id, market_hash_name, last_price):
+        self.goods_id = goods_id
+        self.market_hash_name = market_hash_name
+        self.last_price = last_price
+
+
+async def test_refresh_drops_expired_buff_results_and_untracked_items(buff, monkeypatch):
+    tracked = TrackedItems(TrackedItem(1, "AK-47 | Slate", 3.0), TrackedItem(2, "AWP | Asiimov", 50.0))
+    monkeypatch.setattr(inline_search_module, "db", tracked)
+    search = InlineSearch(debounce=0, search_ttl=0.05, limit=5)
+
+    assert goods_ids(await search.search(1, "ak-47 red")) == [10]
+    assert len(search.index) == 3
+
+    # Срок результата Buff истек, товар 2 больше никто не отслеживает, цена товара 1 изменилась
+    await asyncio.sleep(0.1)
+    tracked.items = [TrackedItem(1, "AK-47 | Slate", 4.0)]
+    search._index_loaded_at = None
+    await search.ensure_index()
+
+    assert list(search.index.entries) == [1]
+    assert search.index.entries[1].price == 4.0
+    assert search.index.search("redline", 5) == []
+    # Запрос снова уходит на Buff
+    await search.search(1, "ak-47 red")
+    assert buff.queries == ["ak-47 red", "ak-47 red"]
+
+
+async def test_refresh_keeps_fresh_buff_results(buff):
+    search = InlineSearch(debounce=0, search_ttl=60, limit=5)
+    await search.search(1, "ak")
+
+    search._index_loaded_at = None
+    await search.ensure_index()
+
+    assert list(search.index.entries) == [10]
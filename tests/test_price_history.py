@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import insert, select
+
+from database.db import _month_start
+from database.models import PriceHistory
+
+
+async def tracked_item(database) -> int:
+    await database.add_user(1)
+    return await database.add_user_subscription(1, 100, "AK-47 | Redline", 10.0)
+
+
+async def add_prices(database, item_id, *observations):
+    """Записать цены (минут назад, цена) через _add_history с заданным временем"""
+    # Серии не переходят через границу месяца - все наблюдения теста внутри одного месяца
+    now = max(datetime.utcnow(), _month_start(datetime.utcnow()) + timedelta(hours=1))
+    for minutes_ago, price in observations:
+        async with database.async_session() as session:
+            await database._add_history(session, {item_id: price}, now - timedelta(minutes=minutes_ago))
+            await session.commit()
+
+
+async def runs(database, item_id):
+    async with database.async_session() as session:
+        result = await session.execute(
+            select(PriceHistory.price, PriceHistory.observations, PriceHistory.timestamp, PriceHistory.last_seen)
+            .where(PriceHistory.item_id == item_id)
+            .order_by(PriceHistory.timestamp)
+        )
+        return result.all()
+
+
+async def test_repeated_price_extends_run(database):
+    item_id = await tracked_item(database)
+
+    await add_prices(database, item_id, (30, 10.0), (20, 10.0), (10, 10.0))
+
+    [run] = await runs(database, item_id)
+    assert run.price == 10.0
+    assert run.observations == 3
+    assert run.last_seen - run.timestamp == timedelta(minutes=20)
+
+
+async def test_price_change_opens_new_run(database):
+    item_id = await tracked_item(database)
+
+    await add_prices(database, item_id, (30, 10.0), (20, 10.0), (10, 11.0), (0, 10.0))
+
+    assert [(run.price, run.observations) for run in await runs(database, item_id)] == [
+        (10.0, 2), (11.0, 1), (10.0, 1)
+    ]
+
+
+async def test_price_columns_expand_runs(database):
+    item_id = await tracked_item(database)
+    await add_prices(database, item_id, (30, 10.0), (20, 10.0), (10, 10.0), (0, 12.0))
+
+    columns = await database.get_price_columns(item_id, days=1)
+
+    assert columns.prices.tolist() == [10.0, 10.0, 10.0, 12.0]
+    # Наблюдения серии равномерно распределены между первым и последним
+    steps = np.diff(columns.timestamps)
+    assert np.all(steps > 0)
+    assert abs(steps[0] - steps[1]) <= 1
+    history = await database.get_price_history(item_id, days=1)
+    assert [observation.price for observation in history] == [12.0, 10.0, 10.0, 10.0]
+
+
+async def test_cleanup_keeps_run_last_seen_within_retention(database):
+    item_id = await tracked_item(database)
+    now = datetime.utcnow()
+    async with database.async_session() as session:
+        await session.execute(insert(PriceHistory), [
+            # Серия началась давно, но цена подтверждалась и вчера
+            {"item_id": item_id, "price": 10.0, "timestamp": now - timedelta(days=30),
+             "last_seen": now - timedelta(days=1), "observations": 500},
+            # Серия целиком старше срока хранения
+            {"item_id": item_id, "price": 9.0, "timestamp": now - timedelta(days=40),
+             "last_seen": now - timedelta(days=31), "observations": 100},
+        ])
+        await session.commit()
+
+    assert await database.cleanup_old_price_history(days=7, time_budget=60)
+
+    assert [run.price for run in await runs(database, item_id)] == [10.0]
@@ -0,0 +1,173 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import bot.stats as stats_module
+from bot.stats import (
+    archived_history, compute_price_stats, compute_rollup_window_stats, compute_window_stats, load_price_stats
+)
+from database.archive import PriceArchive
+from database.db import PriceColumns, RollupColumns, ROLLUP_HOUR, _bucket_start
+
+NOW = datetime(2026, 3, 15, 12, 0)
+
+
+def micros(timestamp: datetime) -> int:
+    return int(np.datetime64(timestamp, "us").astype(np.int64))
+
+
+def raw_columns(*points):
+    """Сырая история из пар (сколько часов назад, цена)"""
+    points = sorted(points, reverse=True)
+    return PriceColumns(
+        np.array([micros(NOW - timedelta(hours=hours)) for hours, _ in points], dtype=np.int64),
+        np.array([price for _, price in points], dtype=np.float64),
+    )
+
+
+def hourly_rollups(*buckets):
+    """Часовые агрегаты из кортежей (сколько часов назад, open, high, low, close, sum, count)"""
+    buckets = sorted(buckets, reverse=True)
+    columns = list(zip(*buckets))
+    return RollupColumns(
+        np.array([micros(NOW - timedelta(hours=hours)) for hours in columns[0]], dtype=np.int64),
+        *(np.array(column, dtype=np.float64) for column in columns[1:6]),
+        np.array(columns[6], dtype=np.int64),
+    )
+
+
+def test_window_stats_for_known_prices():
+    stats = compute_window_stats("7д", np.array([10.0, 12.0, 11.0, 13.0]))
+
+    assert stats.samples == 4
+    assert (stats.min, stats.max) == (10.0, 13.0)
+    assert stats.mean == pytest.approx(11.5)
+    assert stats.median == pytest.approx(11.5)
+    assert stats.std == pytest.approx(np.std([10, 12, 11, 13]))
+    assert stats.change == pytest.approx(30.0)
+    returns = np.diff(np.log([10, 12, 11, 13]))
+    assert stats.volatility == pytest.approx(np.sqrt(np.sum(returns ** 2)) * 100)
+
+
+def test_empty_window_has_no_stats():
+    assert compute_window_stats("24ч", np.array([], dtype=np.float64)) is None
+
+
+def test_single_sample_window():
+    stats = compute_window_stats("24ч", np.array([42.0]))
+
+    assert stats.samples == 1
+    assert stats.min == stats.max == stats.mean == stats.median == 42.0
+    assert stats.std == 0.0
+    assert stats.change == 0.0
+    assert stats.volatility == 0.0
+
+
+def test_rollup_window_stats_are_weighted_by_count():
+    rollups = hourly_rollups(
+        (30, 10.0, 12.0, 9.0, 11.0, 30.0, 3),   # среднее 10
+        (20, 11.0, 20.0, 11.0, 20.0, 20.0, 1),  # среднее 20
+    )
+
+    stats = compute_rollup_window_stats("30д", rollups)
+
+    assert stats.samples == 4
+    assert (stats.min, stats.max) == (9.0, 20.0)
+    assert stats.mean == pytest.approx(12.5)
+    assert stats.median == pytest.approx(10.0)
+    assert stats.std == pytest.approx(np.sqrt((3 * 2.5 ** 2 + 7.5 ** 2) / 4))
+    assert stats.change == pytest.approx(100.0)
+
+
+def test_windows_use_raw_history_then_rollups():
+    # Сырая история - только последние дни, 30-дневное окно считается по агрегатам
+    columns = raw_columns((2, 11.0), (72, 10.0))
+    rollups = {ROLLUP_HOUR: hourly_rollups(
+        (20 * 24, 8.0, 8.0, 8.0, 8.0, 16.0, 2),
+        (72, 10.0, 10.0, 10.0, 10.0, 10.0, 1),
+        (2, 11.0, 11.0, 11.0, 11.0, 11.0, 1),
+    )}
+
+    stats = {window.label: window for window in compute_price_stats(columns, rollups, now=NOW)}
+
+    assert stats["24ч"].samples == 1
+    assert stats["7д"].samples == 2
+    assert stats["30д"].samples == 4
+    assert stats["30д"].min == 8.0
+    assert stats["30д"].change == pytest.approx(37.5)
+
+
+def test_empty_windows_are_omitted():
+    columns = raw_columns((72, 10.0))
+
+    labels = [window.label for window in compute_price_stats(columns, {}, now=NOW)]
+
+    assert labels == ["7д"]
+
+
+async def test_thirty_day_window_covers_history_older_than_raw_retention(database, monkeypatch):
+    monkeypatch.setattr(stats_module, "db", database)
+    monkeypatch.setattr(stats_module, "price_archive", None)
+    await database.add_user(1)
+    item_id = await database.add_user_subscription(1, 100, "AK-47 | Redline", 10.0)
+
+    # Сырая история 20-дневной давности уже удалена, остался часовой агрегат
+    old_bucket = _bucket_start(datetime.utcnow() - timedelta(days=20), ROLLUP_HOUR)
+    async with database.async_session() as session:
+        await database._upsert_rollups(session, [(item_id, ROLLUP_HOUR, old_bucket, 8.0, 8.0, 8.0, 8.0, 8.0, 1)])
+        await session.commit()
+
+    stats = {window.label: window for window in await load_price_stats(item_id)}
+
+    assert "7д" not in stats
+    assert stats["30д"].samples == 1
+    assert stats["30д"].min == 8.0
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """Архив товара 1: цены 8, 9, 100 (20, 15 и 10 дней назад), выгружен до NOW - 1ч"""
+    archive = PriceArchive(str(tmp_path / "archive"))
+    archive.append(1, [(NOW - timedelta(days=days), price) for days, price in ((20, 8.0), (15, 9.0), (10, 100.0))])
+    archive.watermark = NOW - timedelta(hours=1)
+    return archive
+
+
+def archive_rollups(first_hours_ago):
+    return {ROLLUP_HOUR: hourly_rollups((first_hours_ago, 8.0, 100.0, 8.0, 11.0, 128.0, 4))}
+
+
+def test_long_window_uses_exact_archive_history(archive):
+    # Сырая история: запись до метки уже есть в архиве, после метки - новая
+    columns = raw_columns((2, 10.0), (0.5, 11.0))
+    rollups = archive_rollups(20 * 24)
+
+    history = archived_history(archive, 1, columns, NOW - timedelta(days=7), rollups, NOW)
+    stats = {window.label: window for window in compute_price_stats(columns, rollups, NOW, history)}
+
+    assert history.prices.tolist() == [8.0, 9.0, 100.0, 11.0]
+    assert stats["30д"].samples == 4
+    # Медиана по настоящим наблюдениям, а не по средним часовых агрегатов
+    assert stats["30д"].median == pytest.approx(10.0)
+    assert stats["30д"].change == pytest.approx(37.5)
+
+
+def test_archive_started_after_rollups_is_not_used(archive):
+    columns = raw_columns((0.5, 11.0))
+
+    # Агрегаты начинаются 25 дней назад, архив - только 20 дней назад
+    assert archived_history(archive, 1, columns, NOW - timedelta(days=7), archive_rollups(25 * 24), NOW) is None
+
+
+def test_stale_archive_watermark_is_not_used(archive):
+    archive.watermark = NOW - timedelta(days=8)
+    columns = raw_columns((0.5, 11.0))
+
+    assert archived_history(archive, 1, columns, NOW - timedelta(days=7), archive_rollups(20 * 24), NOW) is None
+
+
+def test_archive_without_export_is_not_used(tmp_path):
+    archive = PriceArchive(str(tmp_path / "empty"))
+
+    assert archived_history(archive, 1, raw_columns((1, 1.0)), NOW - timedelta(days=7), {}, NOW) is None
@@ -0,0 +1,105 @@
+from typing import Dict, List
+
+import pytest
+from sqlalchemy import func, select
+
+import bot.scheduler as scheduler_module
+from api.currency_converter import currency_converter
+from bot.scheduler import PriceScheduler, SweepBuffer
+from database.models import NotificationOutbox, User
+
+SHARED_GOODS_ID = 100
+OWN_GOODS_ID = 200
+
+
+class FakeBuff:
+    """Buff с фиксированными ценами и счетчиком запросов по goods_id"""
+
+    def __init__(self, prices: Dict[int, float]):
+        self.prices = prices
+        self.calls: List[int] = []
+
+    async def get_item_price(self, goods_id: int, priority=None):
+        self.calls.append(goods_id)
+        return {"min_price": self.prices[goods_id], "prices": {}}
+
+
+@pytest.fixture
+def buff(monkeypatch, database):
+    fake = FakeBuff({SHARED_GOODS_ID: 12.0, OWN_GOODS_ID: 5.0})
+    monkeypatch.setattr(scheduler_module, "db", database)
+    monkeypatch.setattr(scheduler_module, "buff_client", fake)
+
+    async def convert(amount):
+        return {}
+    monkeypatch.setattr(currency_converter, "convert", convert)
+    return fake
+
+
+async def subscribe_users(database, user_ids):
+    for user_id in user_ids:
+        await database.add_user(user_id)
+        await database.add_user_subscription(user_id, SHARED_GOODS_ID, "AK-47 | Redline", 10.0)
+    await database.add_user_subscription(user_ids[0], OWN_GOODS_ID, "Glock-18 | Fade", 5.0)
+
+
+async def count(database, query):
+    async with database.async_session() as session:
+        return (await session.execute(query)).scalar_one()
+
+
+async def test_shared_item_is_fetched_once_per_sweep(database, buff):
+    await subscribe_users(database, [1, 2, 3])
+
+    await PriceScheduler(bot=None).check_prices()
+
+    assert buff.calls.count(SHARED_GOODS_ID) == 1
+    assert buff.calls.count(OWN_GOODS_ID) == 1
+    # Цена общего товара изменилась 10 -> 12: уведомление каждому подписчику
+    notified = await count(database, select(func.count(func.distinct(NotificationOutbox.user_id))))
+    assert notified == 3
+    assert await count(database, select(func.count()).where(User.last_check.is_(None))) == 0
+    assert (await database.get_item_by_goods_id(SHARED_GOODS_ID)).last_price == 12.0
+
+
+async def test_repeated_notification_is_queued_once(database, buff):
+    await subscribe_users(database, [1])
+    items = (await database.get_items_for_users([1]))[1]
+    shared = next(item for item in items if item.goods_id == SHARED_GOODS_ID)
+    scheduler = PriceScheduler(bot=None)
+
+    # Повтор проверки с тем же снимком товара (например, после сбоя до записи last_check)
+    for _ in range(2):
+        buffer = SweepBuffer()
+        await scheduler._check_item(1, shared, buffer)
+        assert len(buffer.notifications) == 1
+        await scheduler._flush(buffer)
+
+    assert await count(database, select(func.count()).select_from(NotificationOutbox)) == 1
+
+
+async def test_user_due_mid_sweep_joins_current_round(database, buff, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "ADMIT_INTERVAL_SECONDS", 0)
+    await database.add_user(1)
+    heavy_goods = list(range(1000, 1010))
+    for goods_id in heavy_goods:
+        buff.prices[goods_id] = 1.0
+        await database.add_user_subscription(1, goods_id, f"Item {goods_id}", 1.0)
+
+    fetch = buff.get_item_price
+
+    async def get_item_price(goods_id, priority=None):
+        if len(buff.calls) == 2:
+            # Легкому пользователю подошло время, пока идет проверка тяжелого
+            await database.add_user(2)
+            await database.add_user_subscription(2, OWN_GOODS_ID, "Glock-18 | Fade", 5.0)
+        return await fetch(goods_id, priority)
+
+    monkeypatch.setattr(buff, "get_item_price", get_item_price)
+
+    await PriceScheduler(bot=None).check_prices()
+
+    # Товар легкого пользователя проверен в ближайшем раунде, а не после всех 10 товаров
+    assert buff.calls.index(OWN_GOODS_ID) <= 4
+    assert len(buff.calls) == 11
+    assert await count(database, select(func.count()).where(User.last_check.is_(None))) == 0
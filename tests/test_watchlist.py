@@ -0,0 +1,56 @@
+import pytest
+
+import bot.handlers as handlers_module
+from bot.handlers import build_watchlist_page
+from config import config
+
+
+@pytest.fixture
+def counts(monkeypatch, database):
+    """Счетчик вызовов count_user_items"""
+    calls = []
+    count_user_items = database.count_user_items
+
+    async def counting(user_id, search=None):
+        calls.append(search)
+        return await count_user_items(user_id, search=search)
+
+    monkeypatch.setattr(database, "count_user_items", counting)
+    monkeypatch.setattr(handlers_module, "db", database)
+    monkeypatch.setattr(config, "WATCHLIST_PAGE_SIZE", 2)
+    return calls
+
+
+async def subscribe(database, count):
+    await database.add_user(1)
+    for goods_id in range(count):
+        await database.add_user_subscription(1, 100 + goods_id, f"AK-47 | Skin {goods_id}", 10.0 + goods_id)
+
+
+async def test_total_is_counted_only_on_first_page(database, counts):
+    await subscribe(database, 5)
+
+    first_text, _ = await build_watchlist_page(1, sort="price")
+    items, next_after = await database.get_user_items_page(1, sort="price", limit=2)
+    next_text, _ = await build_watchlist_page(1, sort="price", after=next_after)
+
+    assert "(5)" in first_text
+    assert "(" not in next_text.splitlines()[0]
+    assert counts == [None]
+
+
+async def test_unfiltered_count_uses_subscriptions_cache(database, counts):
+    await subscribe(database, 3)
+    await database.get_user_items(1)
+
+    async def no_session():
+        raise AssertionError("COUNT не должен идти в БД")
+
+    # Список подписок уже в кеше - количество без запроса к БД
+    original = database._session
+    database._session = no_session
+    try:
+        assert await database.count_user_items(1) == 3
+    finally:
+        database._session = original
+    assert await database.count_user_items(1, search="skin 1") == 1